@@ -1,13 +1,19 @@
+import inspect
 from structured_chat import StructuredChatCompleter
 from abc import ABC, abstractmethod
 from models import ProviderSearchInputState, ProviderSearchAgentResponse, AgentGoalState
-from typing import List, Dict
+from typing import Hashable, List, Dict, Optional, Tuple
 
 class ProviderSearchChatAgent(ABC):
     """
     Abstract base class for a ProviderSearchChatAgent.    
     Subclasses must implement the is_match(), constraints() and next_goal() methods.
     """
+    # the ProviderSearchInputState fields this agent asks about, as "member_profile.<field>" or "provider_preferences.<field>"
+    fields: Tuple[str, ...] = ()
+    # agents with the same batch group can be asked in one turn, see CompositeProviderSearchAgent; None is never batched
+    batch_group: Optional[str] = None
+
     @abstractmethod
     def is_match(self, input_state: ProviderSearchInputState) -> bool:
         """
@@ -35,8 +41,22 @@ class ProviderSearchChatAgent(ABC):
         """
         return ""
 
+    def prompt_key(self) -> Hashable:
+        """
+        Returns the key the agent's prompt is built once for: agents with equal keys have the same goal and constraints
+        """
+        return type(self)
+
+    def name(self) -> str:
+        """
+        Returns the agent's name for traces and metrics
+        """
+        return type(self).__name__
+
 
 class GeneralProviderSearchAgent(ProviderSearchChatAgent):
+    fields = ("provider_preferences.specialties", "provider_preferences.therapy_types")
+
     def is_match(self, input_state: ProviderSearchInputState) -> bool:
         return (
             input_state.member_profile.gender is None and
@@ -66,6 +86,9 @@ class GeneralProviderSearchAgent(ProviderSearchChatAgent):
 
 
 class MemberDemographicsProviderSearchAgent(ProviderSearchChatAgent):
+    fields = ("member_profile.gender", "member_profile.age")
+    batch_group = "member_profile"
+
     def is_match(self, input_state: ProviderSearchInputState) -> bool:
         return input_state.member_profile.gender is None or input_state.member_profile.age is None
 
@@ -83,6 +106,9 @@ class MemberDemographicsProviderSearchAgent(ProviderSearchChatAgent):
 
 
 class MemberInsuranceProviderSearchAgent(ProviderSearchChatAgent):
+    fields = ("member_profile.insurance",)
+    batch_group = "member_profile"
+
     def is_match(self, input_state: ProviderSearchInputState) -> bool:
         return input_state.member_profile.insurance is None
 
@@ -100,6 +126,9 @@ class MemberInsuranceProviderSearchAgent(ProviderSearchChatAgent):
 
 
 class MemberLanguangeProviderSearchAgent(ProviderSearchChatAgent):
+    fields = ("member_profile.language",)
+    batch_group = "member_profile"
+
     def is_match(self, input_state: ProviderSearchInputState) -> bool:
         return input_state.member_profile.language is None
 
@@ -117,6 +146,9 @@ class MemberLanguangeProviderSearchAgent(ProviderSearchChatAgent):
 
 
 class ProviderSpecialtiesProviderSearchAgent(ProviderSearchChatAgent):
+    fields = ("provider_preferences.specialties",)
+    batch_group = "treatment"
+
     def is_match(self, input_state: ProviderSearchInputState) -> bool:
         return input_state.provider_preferences.specialties is None or len(input_state.provider_preferences.specialties) == 0
 
@@ -134,6 +166,9 @@ class ProviderSpecialtiesProviderSearchAgent(ProviderSearchChatAgent):
 
 
 class TherapyTypeProviderSearchAgent(ProviderSearchChatAgent):
+    fields = ("provider_preferences.therapy_types",)
+    batch_group = "treatment"
+
     def is_match(self, input_state: ProviderSearchInputState) -> bool:
         return input_state.provider_preferences.therapy_types is None or len(input_state.provider_preferences.therapy_types) == 0
 
@@ -151,6 +186,9 @@ class TherapyTypeProviderSearchAgent(ProviderSearchChatAgent):
 
 
 class ProviderGenderProviderSearchAgent(ProviderSearchChatAgent):
+    fields = ("provider_preferences.gender",)
+    batch_group = "provider_preferences"
+
     def is_match(self, input_state: ProviderSearchInputState) -> bool:
         return input_state.provider_preferences.gender is None
 
@@ -168,6 +206,9 @@ class ProviderGenderProviderSearchAgent(ProviderSearchChatAgent):
         '''
 
 class AppointmentTypeProviderSearchAgent(ProviderSearchChatAgent):
+    fields = ("provider_preferences.appointment_types",)
+    batch_group = "provider_preferences"
+
     def is_match(self, input_state: ProviderSearchInputState) -> bool:
         return input_state.provider_preferences.appointment_types is None or len(input_state.provider_preferences.appointment_types) == 0
 
@@ -198,3 +239,34 @@ class ConfirmationProviderSearchAgent(ProviderSearchChatAgent):
             If the user confirms all information is correct, agent_state should be COMPLETE
             If the user adds or corrects information, the agent_stage should be MATCH
         '''
+
+
+class CompositeProviderSearchAgent(ProviderSearchChatAgent):
+    """
+    Asks the questions of several agents in one turn.  It matches while any of its agents match;
+    each agent is done independently once its own fields are extracted.
+    """
+
+    def __init__(self, agents: List[ProviderSearchChatAgent]):
+        self.agents = agents
+        self.fields = tuple(field for agent in agents for field in agent.fields)
+
+    def is_match(self, input_state: ProviderSearchInputState) -> bool:
+        return any(agent.is_match(input_state) for agent in self.agents)
+
+    def goal(self) -> str:
+        goals = "\n".join(inspect.cleandoc(agent.goal()) for agent in self.agents)
+        return f"Ask about all of the following in one message, as one or two short questions.\n{goals}"
+
+    def constraints(self) -> str:
+        constraints = "\n\n".join(inspect.cleandoc(agent.constraints()) for agent in self.agents)
+        return (
+            "Each goal has its own constraints below. agent_state should be COMPLETE only if the constraints of every goal "
+            f"say COMPLETE, otherwise agent_state should be MATCH\n\n{constraints}"
+        )
+
+    def prompt_key(self) -> Hashable:
+        return tuple(type(agent) for agent in self.agents)
+
+    def name(self) -> str:
+        return "+".join(agent.name() for agent in self.agents)
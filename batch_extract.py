@@ -0,0 +1,408 @@
+"""
+    Extracts ProviderSearchInputState from archived intake transcripts in bulk, with one completion per transcript
+    instead of one ChatController turn per message.
+
+    Transcripts are JSON lines of {"id": "...", "messages": [{"role": "user" or "assistant", "content": "..."}, ...]}.
+    Results are appended to a JSON lines file as they finish, as {"id": ..., "state": {...}}, or {"id": ..., "error": "..."}
+    once the retries are used up.  Transcripts with a state in the results file are skipped, so a run which stopped
+    part way is resumed by running it again.
+
+    From the project root directory:
+    > python3 batch_extract.py run transcripts.jsonl results.jsonl --concurrency 32 --requests-per-minute 5000
+    > python3 batch_extract.py emit-batch transcripts.jsonl batch_requests.jsonl
+    > python3 batch_extract.py ingest-batch batch_output.jsonl results.jsonl
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import random
+import sys
+import time
+from typing import Callable, Iterator, List, Optional, Set
+import openai
+from openai import AsyncOpenAI
+from pydantic import ValidationError
+from history import estimate_message_tokens
+from models import ProviderSearchInputState
+from http_client import RequestPolicy, retry_after
+from structured_chat import AsyncStructuredChatCompleter, response_format
+
+EXTRACTION_PROMPT = inspect.cleandoc('''
+    You read a finished conversation between a member and an assistant who helped the member find a mental health
+    provider in the provider directory.
+
+    Extract every field of the member profile and the provider preferences which the member stated in the conversation.
+    If the member changed an answer, keep the latest one.
+    MemberProfile must always be populated with a dictionary.
+    ProviderPreferences must always be populated with a dictionary.
+    MemberProfile and ProviderPreferences fields should be null or empty list if not specified by the member.
+''')
+
+
+def read_transcripts(path: str) -> Iterator[dict]:
+    """
+        Yields the transcripts of a JSON lines file, using the line number as the id of a transcript without one
+    """
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if line.strip():
+                transcript = json.loads(line)
+                transcript.setdefault("id", str(number))
+                yield transcript
+
+
+def transcript_messages(transcript: dict) -> List[dict]:
+    conversation = [{"role": message["role"], "content": message["content"]} for message in transcript["messages"]
+                    if message["role"] in ("user", "assistant")]
+    return [{"role": "developer", "content": EXTRACTION_PROMPT}] + conversation
+
+
+def completed_ids(path: str) -> Set[str]:
+    """
+        Returns the ids with a state in a results file.  A line cut short by a crash is ignored.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            if "state" in result:
+                done.add(str(result["id"]))
+    return done
+
+
+class ResultWriter:
+    """
+        Appends results to a JSON lines file, one flushed line per transcript
+    """
+
+    def __init__(self, path: str):
+        # a crash may have cut the last line short, so the next result starts on a new line
+        partial = False
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                partial = f.read(1) != b"\n"
+        self.file = open(path, "a", encoding="utf-8")
+        if partial:
+            self.file.write("\n")
+
+    def write(self, transcript_id: str, state: Optional[ProviderSearchInputState] = None, error: Optional[str] = None):
+        result = {"id": transcript_id}
+        if state is not None:
+            result["state"] = json.loads(state.model_dump_json(exclude_none=True))
+        else:
+            result["error"] = error
+        self.file.write(json.dumps(result, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class RateLimiter:
+    """
+        This RateLimiter spaces requests to stay under requests and tokens per minute, with token buckets which hold
+        burst_seconds of each rate.  pause() stops every request for a while, after the API answered 429.
+    """
+
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None,
+                 burst_seconds: float = 1.0, clock: Callable[[], float] = time.monotonic):
+        """
+            Parameters:
+                requests_per_minute (float): the request limit, or None for no limit
+                tokens_per_minute (float): the prompt token limit, or None for no limit
+                burst_seconds (float): the seconds of each rate which may be used at once. Default is 1.
+        """
+        self.request_rate = requests_per_minute / 60 if requests_per_minute else None
+        self.token_rate = tokens_per_minute / 60 if tokens_per_minute else None
+        self.request_capacity = max(1.0, self.request_rate * burst_seconds) if self.request_rate else 0.0
+        self.token_capacity = self.token_rate * burst_seconds if self.token_rate else 0.0
+        self.requests = self.request_capacity
+        self.tokens = self.token_capacity
+        self.clock = clock
+        self.updated = clock()
+        self.paused_until = 0.0
+
+    def refill(self, now: float):
+        elapsed = now - self.updated
+        self.updated = now
+        if self.request_rate:
+            self.requests = min(self.request_capacity, self.requests + elapsed * self.request_rate)
+        if self.token_rate:
+            self.tokens = min(self.token_capacity, self.tokens + elapsed * self.token_rate)
+
+    def delay(self, tokens: int) -> float:
+        """
+            Takes capacity for a request and returns 0, or returns the seconds to wait before asking again
+        """
+        now = self.clock()
+        self.refill(now)
+        if now < self.paused_until:
+            return self.paused_until - now
+        # a request larger than the bucket waits for a full bucket
+        tokens = min(tokens, self.token_capacity)
+        wait = 0.0
+        if self.request_rate and self.requests < 1:
+            wait = max(wait, (1 - self.requests) / self.request_rate)
+        if self.token_rate and self.tokens < tokens:
+            wait = max(wait, (tokens - self.tokens) / self.token_rate)
+        if wait > 0:
+            return wait
+        if self.request_rate:
+            self.requests -= 1
+        if self.token_rate:
+            self.tokens -= tokens
+        return 0.0
+
+    async def acquire(self, tokens: int):
+        while True:
+            wait = self.delay(tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, self.clock() + seconds)
+
+
+class BatchStats:
+    def __init__(self):
+        self.extracted = 0
+        self.skipped = 0
+        self.failed = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.elapsed = 0.0
+
+    @property
+    def transcripts_per_second(self) -> float:
+        return self.extracted / self.elapsed if self.elapsed else 0.0
+
+
+class BatchExtractor:
+    """
+        This BatchExtractor extracts transcripts with a bounded pool of asyncio workers sharing one
+        AsyncStructuredChatCompleter.  Requests wait for the RateLimiter; a 429 pauses every worker for the time
+        the API asks for, and 429s, 5xx responses and connection errors are retried with exponential backoff.
+    """
+
+    def __init__(self, completer: Optional[AsyncStructuredChatCompleter] = None, concurrency: int = 16,
+                 limiter: Optional[RateLimiter] = None, max_retries: int = 6, backoff: float = 0.5, max_backoff: float = 30.0):
+        """
+            Parameters:
+                completer (AsyncStructuredChatCompleter): the completer to extract with. Default is a completer with temperature 0,
+                    and a client and RequestPolicy which leave the retries to the BatchExtractor.
+                concurrency (int): the number of workers, and so of requests in flight. Default is 16.
+                limiter (RateLimiter): spaces the requests. Default is no limit besides the 429 responses.
+                max_retries (int): retries of a transcript before its error is written. Default is 6.
+                backoff (float): seconds before the first retry, doubled for each retry. Default is 0.5.
+        """
+        self.completer = completer or AsyncStructuredChatCompleter(temperature=0, max_concurrency=concurrency, client=AsyncOpenAI(max_retries=0),
+                                                                   policy=RequestPolicy(max_retries=0))
+        self.concurrency = concurrency
+        self.limiter = limiter or RateLimiter()
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stats = BatchStats()
+
+    async def extract(self, transcript: dict) -> ProviderSearchInputState:
+        messages = transcript_messages(transcript)
+        tokens = estimate_message_tokens(messages)
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire(tokens)
+            try:
+                state, usage = await self.completer.complete_with_usage(messages, ProviderSearchInputState)
+            except (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError) as error:
+                if attempt == self.max_retries:
+                    raise
+                self.stats.retries += 1
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+                if isinstance(error, openai.RateLimitError):
+                    self.stats.rate_limited += 1
+                    delay = retry_after(error) or delay
+                    self.limiter.pause(delay)
+                await asyncio.sleep(delay)
+                continue
+            if state is None:
+                raise ValueError("the model refused to extract the transcript")
+            if usage is not None:
+                self.stats.prompt_tokens += usage.prompt_tokens
+                self.stats.completion_tokens += usage.completion_tokens
+            return state
+
+    async def run(self, transcripts: Iterator[dict], writer: ResultWriter, done: Set[str] = frozenset(),
+                  on_progress: Optional[Callable[[BatchStats], None]] = None) -> BatchStats:
+        """
+            Extracts every transcript whose id is not in done, writing each result as it finishes
+        """
+        # a bounded queue, so the transcripts are read as the workers take them
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        start = time.perf_counter()
+
+        async def worker():
+            while True:
+                transcript = await queue.get()
+                if transcript is None:
+                    return
+                transcript_id = str(transcript["id"])
+                try:
+                    writer.write(transcript_id, state=await self.extract(transcript))
+                    self.stats.extracted += 1
+                except Exception as error:
+                    # any failure of one transcript is its result: a worker which stopped would leave the queue full
+                    writer.write(transcript_id, error=f"{type(error).__name__}: {error}")
+                    self.stats.failed += 1
+                if on_progress is not None:
+                    on_progress(self.stats)
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        for transcript in transcripts:
+            if str(transcript["id"]) in done:
+                self.stats.skipped += 1
+                continue
+            await queue.put(transcript)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+        self.stats.elapsed = time.perf_counter() - start
+        return self.stats
+
+
+def batch_request(transcript: dict, model: str, temperature: float) -> dict:
+    """
+        Returns a line of an OpenAI Batch API input file for a transcript, with its id as the custom_id
+    """
+    return {
+        "custom_id": str(transcript["id"]),
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": model,
+            "temperature": temperature,
+            "messages": transcript_messages(transcript),
+            "response_format": response_format(ProviderSearchInputState),
+        },
+    }
+
+
+def emit_batch(transcripts_path: str, requests_path: str, model: str, temperature: float, done: Set[str] = frozenset()) -> int:
+    """
+        Writes an OpenAI Batch API input file with a request for each transcript whose id is not in done
+
+        Returns:
+            the number of requests written
+    """
+    count = 0
+    with open(requests_path, "w", encoding="utf-8") as f:
+        for transcript in read_transcripts(transcripts_path):
+            if str(transcript["id"]) in done:
+                continue
+            f.write(json.dumps(batch_request(transcript, model, temperature), ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def ingest_batch(output_path: str, writer: ResultWriter, done: Set[str] = frozenset()) -> BatchStats:
+    """
+        Validates the responses of an OpenAI Batch API output file, and writes their results
+    """
+    stats = BatchStats()
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            transcript_id = record["custom_id"]
+            if transcript_id in done:
+                stats.skipped += 1
+                continue
+            response = record.get("response") or {}
+            if record.get("error") or response.get("status_code") != 200:
+                error = record.get("error") or response.get("body", {}).get("error") or f"status {response.get('status_code')}"
+                writer.write(transcript_id, error=json.dumps(error) if not isinstance(error, str) else error)
+                stats.failed += 1
+                continue
+            body = response["body"]
+            content = body["choices"][0]["message"].get("content")
+            try:
+                if content is None:
+                    raise ValueError("the model refused to extract the transcript")
+                state = ProviderSearchInputState.model_validate_json(content)
+            except (ValidationError, ValueError) as error:
+                writer.write(transcript_id, error=f"{type(error).__name__}: {error}")
+                stats.failed += 1
+                continue
+            writer.write(transcript_id, state=state)
+            usage = body.get("usage") or {}
+            stats.prompt_tokens += usage.get("prompt_tokens", 0)
+            stats.completion_tokens += usage.get("completion_tokens", 0)
+            stats.extracted += 1
+    return stats
+
+
+def print_stats(stats: BatchStats):
+    print(f"extracted {stats.extracted}, failed {stats.failed}, skipped {stats.skipped} already extracted, "
+          f"{stats.retries} retries ({stats.rate_limited} rate limited), "
+          f"{stats.prompt_tokens} prompt and {stats.completion_tokens} completion tokens", file=sys.stderr)
+    if stats.elapsed:
+        print(f"{stats.elapsed:.1f}s, {stats.transcripts_per_second:.1f} transcripts/s", file=sys.stderr)
+
+
+async def run(args):
+    done = completed_ids(args.results)
+    limiter = RateLimiter(args.requests_per_minute, args.tokens_per_minute)
+    completer = AsyncStructuredChatCompleter(temperature=args.temperature, model=args.model, max_concurrency=args.concurrency,
+                                             client=AsyncOpenAI(max_retries=0),
+                                             policy=RequestPolicy(max_retries=0))
+    extractor = BatchExtractor(completer, args.concurrency, limiter, max_retries=args.max_retries)
+    writer = ResultWriter(args.results)
+    try:
+        return await extractor.run(read_transcripts(args.transcripts), writer, done)
+    finally:
+        writer.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="extract transcripts with the chat completions API")
+    run_parser.add_argument("transcripts")
+    run_parser.add_argument("results")
+    run_parser.add_argument("--concurrency", type=int, default=16, help="requests in flight")
+    run_parser.add_argument("--requests-per-minute", type=float, help="the account's request limit")
+    run_parser.add_argument("--tokens-per-minute", type=float, help="the account's token limit")
+    run_parser.add_argument("--max-retries", type=int, default=6)
+    emit_parser = commands.add_parser("emit-batch", help="write an OpenAI Batch API input file")
+    emit_parser.add_argument("transcripts")
+    emit_parser.add_argument("requests")
+    emit_parser.add_argument("--results", help="skip the transcripts already extracted in this results file")
+    ingest_parser = commands.add_parser("ingest-batch", help="validate an OpenAI Batch API output file into results")
+    ingest_parser.add_argument("output")
+    ingest_parser.add_argument("results")
+    for command in (run_parser, emit_parser):
+        command.add_argument("--model", default="gpt-4o-mini")
+        command.add_argument("--temperature", type=float, default=0.0)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        print_stats(asyncio.run(run(args)))
+    elif args.command == "emit-batch":
+        count = emit_batch(args.transcripts, args.requests, args.model, args.temperature,
+                           completed_ids(args.results) if args.results else set())
+        print(f"wrote {count} requests to {args.requests}", file=sys.stderr)
+    else:
+        writer = ResultWriter(args.results)
+        try:
+            print_stats(ingest_batch(args.output, writer, completed_ids(args.results)))
+        finally:
+            writer.close()
@@ -0,0 +1,68 @@
+"""
+    Reports the throughput of batch_extract.BatchExtractor as the number of workers grows, against the local fake
+    chat completions endpoint answering with the extraction of each transcript after a configurable latency.
+
+    With --max-in-flight, the endpoint answers 429 beyond that many requests in flight, to show the retries.
+
+    From the project root directory:
+    > python3 -m benchmarks.batch_extract_benchmark --latency 0.2 --concurrency 1 2 4 8 16 32 64 128
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+from openai import AsyncOpenAI
+from batch_extract import BatchExtractor, RateLimiter, ResultWriter
+from benchmarks.load_test import start_server
+from benchmarks.simulation import PERSONAS, persona_transcript
+from http_client import RequestPolicy
+from structured_chat import AsyncStructuredChatCompleter
+
+
+async def extract(port: int, concurrency: int, transcripts, results: str, requests_per_minute):
+    client = AsyncOpenAI(api_key="fake", base_url=f"http://127.0.0.1:{port}/v1", max_retries=0)
+    completer = AsyncStructuredChatCompleter(temperature=0, max_concurrency=concurrency, client=client,
+                                             policy=RequestPolicy(max_retries=0))
+    extractor = BatchExtractor(completer, concurrency, RateLimiter(requests_per_minute), backoff=0.05)
+    writer = ResultWriter(results)
+    try:
+        return await extractor.run(iter(transcripts), writer)
+    finally:
+        writer.close()
+        await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.2, help="fake completion latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64, 128])
+    parser.add_argument("--transcripts-per-worker", type=int, default=10)
+    parser.add_argument("--max-in-flight", type=int, help="the fake endpoint answers 429 beyond this many requests in flight")
+    parser.add_argument("--requests-per-minute", type=float, help="the client side request limit")
+    args = parser.parse_args()
+
+    arguments = ["-m", "benchmarks.fake_openai", "--port", "0", "--latency", str(args.latency), "--jitter", str(args.jitter),
+                 "--seed", "0", "--responder", "extract"]
+    if args.max_in_flight:
+        arguments += ["--max-in-flight", str(args.max_in_flight)]
+    fake, port = start_server(arguments)
+    try:
+        print(f"{'workers':>7} {'transcripts':>11} {'seconds':>8} {'per second':>10} {'speedup':>8} {'retries':>8} {'failed':>7}")
+        single = None
+        with tempfile.TemporaryDirectory() as directory:
+            for concurrency in args.concurrency:
+                count = max(20, concurrency * args.transcripts_per_worker)
+                transcripts = [persona_transcript(PERSONAS[index % len(PERSONAS)], str(index)) for index in range(count)]
+                results = os.path.join(directory, f"results-{concurrency}.jsonl")
+                stats = asyncio.run(extract(port, concurrency, transcripts, results, args.requests_per_minute))
+                single = single or stats.transcripts_per_second
+                print(f"{concurrency:>7} {count:>11} {stats.elapsed:>8.2f} {stats.transcripts_per_second:>10.1f} "
+                      f"{stats.transcripts_per_second / single:>7.1f}x {stats.retries:>8} {stats.failed:>7}")
+    finally:
+        fake.kill()
+        fake.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""
+    Runs each simulated persona through a ChatController at several batch sizes, and reports the average
+    LLM calls and member turns to reach a complete ProviderSearchInputState.
+
+    From the project root directory:
+    > python3 -m benchmarks.batching_benchmark --batch-sizes 1 2 3
+"""
+import argparse
+import statistics
+from benchmarks.simulation import PERSONAS, SimulatedCompleter, run_session
+from controller import ChatController
+from fast_extract import FastPathExtractor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 3])
+    parser.add_argument("--fast-path", action="store_true", help="also resolve single-value replies locally")
+    args = parser.parse_args()
+
+    print(f"{'batch size':>10} {'calls':>6} {'turns':>6} {'complete':>9}")
+    for batch_size in args.batch_sizes:
+        calls, turns, complete = [], [], 0
+        for persona in PERSONAS:
+            completer = SimulatedCompleter(persona)
+            controller = ChatController(
+                completer=completer, debug=False, batch_size=batch_size, fast_path=FastPathExtractor() if args.fast_path else None,
+            )
+            result = run_session(controller, persona)
+            calls.append(completer.calls)
+            turns.append(result["turns"])
+            complete += result["complete"]
+        print(f"{batch_size:>10} {statistics.mean(calls):>6.1f} {statistics.mean(turns):>6.1f} {complete:>4}/{len(PERSONAS)}")
+
+
+if __name__ == "__main__":
+    main()
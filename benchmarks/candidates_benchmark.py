@@ -0,0 +1,108 @@
+"""
+    Benchmarks the per-turn cost of keeping a session's live candidate count and facet counts current,
+    with an incremental CandidateSet against re-filtering the whole roster every turn, on a synthetic roster.
+
+    Each session answers the fields in the order the ChatController asks them, one field per turn, and --corrections
+    of the sessions change their insurance once more at the end.  After every turn both approaches produce the count of
+    matching providers and the facet counts of the required columns which are still unanswered, as ChatController.get_agent()
+    needs them to skip questions.
+
+    From the project root directory:
+    > python3 -m benchmarks.candidates_benchmark --providers 1000000
+"""
+import argparse
+import random
+import statistics
+import time
+import numpy as np
+from benchmarks.synthetic import random_columns, random_names, random_search_state
+from candidates import FIELD_COLUMNS, CandidateSet
+from matching import DEFAULT_REQUIRED, ENUM_COLUMNS, ProviderIndex, bit_counts, search_criteria
+from models import Insurance, MemberProfile, ProviderPreferences, ProviderSearchInputState
+
+# the fields in the order the controller's agents ask them
+ASKED = [
+    "provider_preferences.specialties",
+    "provider_preferences.therapy_types",
+    "member_profile.insurance",
+    "member_profile.language",
+    "member_profile.gender",
+    "member_profile.age",
+    "provider_preferences.gender",
+    "provider_preferences.appointment_types",
+]
+
+
+def field_value(state: ProviderSearchInputState, field: str):
+    section, name = field.split(".")
+    return getattr(getattr(state, section), name)
+
+
+def session_turns(rng: random.Random, correct: bool):
+    """
+        Returns the search state after each turn of a session, and the required columns still unanswered
+    """
+    final = random_search_state(rng)
+    state = ProviderSearchInputState(member_profile=MemberProfile(), provider_preferences=ProviderPreferences())
+    turns = []
+    for position, field in enumerate(ASKED):
+        section, name = field.split(".")
+        state = state.model_copy(update={section: getattr(state, section).model_copy(update={name: field_value(final, field)})})
+        unanswered = [FIELD_COLUMNS[field] for field in ASKED[position + 1:] if FIELD_COLUMNS.get(field) in DEFAULT_REQUIRED]
+        turns.append((state, unanswered))
+    if correct:
+        insurance = rng.choice([insurance for insurance in Insurance if insurance != state.member_profile.insurance])
+        turns.append((state.model_copy(update={"member_profile": state.member_profile.model_copy(update={"insurance": insurance})}), []))
+    return turns
+
+
+def refilter(index: ProviderIndex, state: ProviderSearchInputState, unanswered):
+    mask = index.filter([criterion for criterion in search_criteria(state) if criterion.column in DEFAULT_REQUIRED])
+    count = int(np.count_nonzero(mask))
+    positions = np.flatnonzero(mask)
+    facets = {column: bit_counts(index.columns[column][positions], len(ENUM_COLUMNS[column])) for column in unanswered}
+    return count, facets
+
+
+def incremental(candidates: CandidateSet, state: ProviderSearchInputState, unanswered):
+    count = candidates.update(state)
+    facets = {column: candidates.facet_array(column) for column in unanswered}
+    return count, facets
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--providers", type=int, default=1_000_000)
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--corrections", type=float, default=0.3, help="the fraction of sessions which correct their insurance")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = ProviderIndex(random_columns(args.providers), random_names(args.providers))
+    print(f"built a {args.providers} provider roster in {time.perf_counter() - start:.1f}s")
+    rng = random.Random(0)
+    sessions = [session_turns(rng, rng.random() < args.corrections) for _ in range(args.sessions)]
+
+    timings = {"refilter": [], "incremental": []}
+    for turns in sessions:
+        candidates = CandidateSet(index)
+        for state, unanswered in turns:
+            start = time.perf_counter()
+            expected = refilter(index, state, unanswered)
+            timings["refilter"].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            actual = incremental(candidates, state, unanswered)
+            timings["incremental"].append(time.perf_counter() - start)
+            assert actual[0] == expected[0] and all(np.array_equal(actual[1][column], expected[1][column]) for column in unanswered)
+    session_bytes = candidates.failures.nbytes + candidates.mask.nbytes + sum(failed.nbytes for failed in candidates.failed.values())
+
+    print(f"{'approach':>12} {'turns':>6} {'mean ms':>8} {'p50 ms':>7} {'p95 ms':>7} {'max ms':>7}")
+    for name, values in timings.items():
+        ordered = sorted(values)
+        print(f"{name:>12} {len(values):>6} {statistics.mean(values) * 1000:>8.2f} {ordered[len(ordered) // 2] * 1000:>7.2f} "
+              f"{ordered[int(0.95 * len(ordered))] * 1000:>7.2f} {ordered[-1] * 1000:>7.2f}")
+    print(f"incremental state per session: {session_bytes / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
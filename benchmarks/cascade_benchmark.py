@@ -0,0 +1,102 @@
+"""
+    Compares a model cascade (cascade.CascadePolicy) with always calling the large model, against the local fake
+    chat completions endpoint.  The endpoint answers the large model perfectly after --large-latency, and the small
+    model after --small-latency with a mistake in --error-rate of its responses (benchmarks.simulation.CheapModelResponder),
+    some of which the cascade's checks find and some of which they can not.
+
+    Reports LLM calls, escalation rate, cost per session from cascade.MODEL_PRICES, turn latency, and the fraction
+    of sessions whose final search state is correct.
+
+    From the project root directory:
+    > python3 -m benchmarks.cascade_benchmark --error-rate 0.2
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from openai import OpenAI
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.simulation import FIELDS, PERSONAS, CheapModelResponder, field_value
+from cascade import CascadePolicy
+from controller import ChatController
+from structured_chat import StructuredChatCompleter
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_session(controller: ChatController, persona, max_turns: int = 20):
+    """
+        Runs a conversation like simulation.run_session(), returning the turn latencies and whether the final state is correct
+    """
+    turn_seconds = []
+    start = time.perf_counter()
+    controller.get_next_assistant_response()
+    turn_seconds.append(time.perf_counter() - start)
+    while len(turn_seconds) <= max_turns and any(field_value(controller.search_input_state, field) is None for field in FIELDS):
+        asked = [field for field in controller.agent.fields if field_value(controller.search_input_state, field) is None]
+        if not asked:
+            asked = [field for field in FIELDS if field_value(controller.search_input_state, field) is None][:1]
+        controller.add_user_message(persona.reply(asked))
+        start = time.perf_counter()
+        controller.get_next_assistant_response()
+        turn_seconds.append(time.perf_counter() - start)
+    correct = all(field_value(controller.search_input_state, field) == persona.answers[field][1] for field in FIELDS)
+    return turn_seconds, correct
+
+
+def run(port: int, cascade: CascadePolicy, sessions: int, concurrency: int):
+    client = OpenAI(api_key="fake", base_url=f"http://127.0.0.1:{port}/v1", max_retries=0)
+    completer = StructuredChatCompleter(client=client, cascade=cascade)
+    controllers = []
+
+    def session(index):
+        controller = ChatController(completer=completer, debug=False)
+        controllers.append(controller)
+        return run_session(controller, PERSONAS[index % len(PERSONAS)])
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(session, range(sessions)))
+    client.close()
+    turn_seconds = [seconds for session_seconds, _ in results for seconds in session_seconds]
+    return {
+        "calls": sum(controller.usage.calls for controller in controllers) / sessions,
+        "escalation_rate": cascade.stats.escalation_rate,
+        "cost": cascade.stats.total_cost / sessions,
+        "p50": percentile(turn_seconds, 0.5),
+        "p95": percentile(turn_seconds, 0.95),
+        "correct": sum(correct for _, correct in results) / sessions,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--small", default="gpt-4o-mini")
+    parser.add_argument("--large", default="gpt-4o")
+    parser.add_argument("--small-latency", type=float, default=0.4, help="seconds per small model completion")
+    parser.add_argument("--large-latency", type=float, default=1.0, help="seconds per large model completion")
+    parser.add_argument("--error-rate", type=float, default=0.2, help="the fraction of small model responses with a mistake")
+    parser.add_argument("--sessions", type=int, default=30)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'policy':>14} {'calls':>6} {'escalated':>9} {'cost':>9} {'p50':>6} {'p95':>6} {'correct':>7}")
+    policies = [
+        ("always large", CascadePolicy(small=args.large, large=args.large)),
+        ("always small", CascadePolicy(small=args.small, large=args.small)),
+        ("cascade", CascadePolicy(small=args.small, large=args.large)),
+    ]
+    for name, cascade in policies:
+        responder = CheapModelResponder(large=args.large, error_rate=args.error_rate, seed=args.seed)
+        fake = FakeOpenAIServer(responder, latency=args.small_latency, seed=args.seed,
+                                model_latency={args.small: args.small_latency, args.large: args.large_latency})
+        port = fake.serve_in_thread()
+        result = run(port, cascade, args.sessions, args.concurrency)
+        print(f"{name:>14} {result['calls']:>6.1f} {result['escalation_rate']:>9.1%} {result['cost'] * 100:>8.3f}c "
+              f"{result['p50']:>6.2f} {result['p95']:>6.2f} {result['correct']:>7.0%}")
+
+
+if __name__ == "__main__":
+    main()
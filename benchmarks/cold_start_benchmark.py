@@ -0,0 +1,89 @@
+"""
+    Benchmarks cold start in fresh processes: the time to import the controller, and the time from starting main.py
+    to its first response, against a FakeOpenAIServer whose new connections take --connect-latency, as the TCP and TLS
+    handshakes to the API do.  Each variant is started --runs times and the median is reported, with the part of it
+    which is not the completion itself:
+    * default - lazy openai import and warm-up connection, building the response formats
+    * warm schema cache - the response formats are read from SCHEMA_CACHE_DIR, filled by an earlier run
+    * no warm-up - main.py --no-warm-up, which connects at the first completion
+    With --root, the same is measured for another checkout of the project, such as one before these changes:
+    > git archive <commit> | tar -x -C /tmp/before
+
+    From the project root directory:
+    > python3 -m benchmarks.cold_start_benchmark --runs 7 --connect-latency 0.2 --latency 0.5
+    > python3 -m benchmarks.cold_start_benchmark --root /tmp/before
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+from benchmarks.fake_openai import FakeOpenAIServer
+
+IMPORT_SCRIPT = "import sys, time; start = time.perf_counter(); import controller; print(time.perf_counter() - start, 'openai' in sys.modules)"
+
+
+def import_time(root: str, env: Dict[str, str]) -> tuple:
+    output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], cwd=root, env=env, capture_output=True, text=True, check=True).stdout.split()
+    return float(output[0]), output[1] == "True"
+
+
+def first_response_time(root: str, env: Dict[str, str], flags: List[str]) -> float:
+    """
+        Returns the seconds from starting main.py to the first line of its first response
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "main.py", "--no-stream", *flags], cwd=root, env=env,
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        for line in process.stdout:
+            if line.strip():
+                return time.perf_counter() - start
+        raise RuntimeError("main.py exited without a response")
+    finally:
+        process.kill()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--root", default=".", help="the project checkout to start")
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds the fake API takes to answer a completion")
+    parser.add_argument("--connect-latency", type=float, default=0.2, help="seconds of handshakes for each new connection")
+    args = parser.parse_args()
+
+    fake = FakeOpenAIServer(latency=args.latency, connect_latency=args.connect_latency)
+    port = fake.serve_in_thread()
+    root = os.path.abspath(args.root)
+    with tempfile.TemporaryDirectory() as warm_cache:
+        env = dict(os.environ, OPENAI_API_KEY="fake", OPENAI_BASE_URL=f"http://127.0.0.1:{port}/v1")
+        env.pop("SCHEMA_CACHE_DIR", None)
+        imports = [import_time(root, env) for _ in range(args.runs)]
+        print(f"import controller: {statistics.median(seconds for seconds, _ in imports) * 1000:.0f}ms, "
+              f"openai {'imported' if imports[0][1] else 'not imported'}")
+
+        # main.py of an earlier checkout may not have --no-warm-up
+        variants = {"default": ([], {})}
+        with open(os.path.join(root, "main.py")) as script:
+            warms_up = "--no-warm-up" in script.read()
+        if warms_up:
+            variants["warm schema cache"] = ([], {"SCHEMA_CACHE_DIR": warm_cache})
+            variants["no warm-up"] = (["--no-warm-up"], {})
+            # fill the schema cache
+            first_response_time(root, dict(env, SCHEMA_CACHE_DIR=warm_cache), [])
+        print(f"{'variant':>18} {'first response':>15} {'not completing':>15}")
+        for name, (flags, overrides) in variants.items():
+            timings = []
+            for _ in range(args.runs):
+                timings.append(first_response_time(root, dict(env, **overrides), flags))
+            median = statistics.median(timings)
+            # the part of the first response which is not the completion itself: startup, and connecting unless warmed up
+            print(f"{name:>18} {median * 1000:>13.0f}ms {(median - args.latency) * 1000:>13.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
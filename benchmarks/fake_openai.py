@@ -0,0 +1,341 @@
+"""
+    A local stand-in for the OpenAI chat completions endpoint, for load tests and benchmarks.
+    It answers every request with a ProviderSearchAgentResponse after a configurable delay,
+    streamed or not, with an estimated usage block.  The response comes from a responder:
+    * default - the same response to every request
+    * rule - the simulated LLM of benchmarks/simulation.py, which extracts the replies of its personas
+    * recorded - responses recorded with CompletionRecorder, replayed by request, falling back to rule
+    * extract - the ProviderSearchInputState of a whole transcript, for batch_extract.py
+    With --max-in-flight, requests beyond that many in flight are answered 429, as a rate limited API would.
+    With --slow-fraction, that fraction of requests take --slow-latency instead, to reproduce tail latency,
+    and with --error-fraction that fraction of requests are answered 500.  --token-latency adds that many seconds
+    per completion token, as generation takes, and --connect-latency delays the first response on each new connection,
+    as the TCP and TLS handshakes to the API do.  A request for ProviderSearchAgentDeltaResponse is answered with the changes
+    between the search state in its prompt and the responder's response.
+
+    From the project root directory:
+    > python3 -m benchmarks.fake_openai --port 8081 --latency 0.5 --responder rule
+    then point the client at it with OPENAI_BASE_URL=http://127.0.0.1:8081/v1
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+from benchmarks.simulation import extraction_responder, prompt_state, rule_responder
+from delta import delta_response
+from models import AgentGoalState, MemberProfile, ProviderPreferences, ProviderSearchAgentResponse, ProviderSearchInputState
+from session_server import json_response, read_request, response_head
+
+CHUNK_CHARACTERS = 12
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def default_responder(request: dict) -> ProviderSearchAgentResponse:
+    return ProviderSearchAgentResponse(
+        assistant_response="Thanks for sharing that. Could you tell me a little more about what you are looking for?",
+        provider_search_information=ProviderSearchInputState(
+            member_profile=MemberProfile(),
+            provider_preferences=ProviderPreferences(),
+        ),
+        agent_state=AgentGoalState.MATCHED,
+    )
+
+
+def messages_key(messages: List[dict]) -> str:
+    return hashlib.sha256(json.dumps(messages, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class RecordedResponder:
+    """
+        Replays recorded responses for requests with the same messages.  Requests which were not recorded
+        go to the fallback responder, or fail if there is none.
+    """
+
+    def __init__(self, path: str, fallback: Optional[Callable[[dict], ProviderSearchAgentResponse]] = None):
+        """
+            Parameters:
+                path (str): a JSON lines file of {"messages": [...], "response": {...}}, as written by CompletionRecorder
+                fallback (Callable): the responder for requests which were not recorded
+        """
+        self.responses: Dict[str, ProviderSearchAgentResponse] = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self.responses[messages_key(record["messages"])] = ProviderSearchAgentResponse.model_validate(record["response"])
+        self.fallback = fallback
+        self.misses = 0
+
+    def __call__(self, request: dict) -> ProviderSearchAgentResponse:
+        response = self.responses.get(messages_key(request["messages"]))
+        if response is not None:
+            return response
+        self.misses += 1
+        if self.fallback is None:
+            raise KeyError("the request was not recorded")
+        return self.fallback(request)
+
+
+class CompletionRecorder:
+    """
+        Wraps a StructuredChatCompleter, appending each request's messages and response to a JSON lines file
+        which RecordedResponder can replay
+    """
+
+    def __init__(self, completer, path: str):
+        self.completer = completer
+        self.path = path
+        self.lock = threading.Lock()
+
+    def record(self, messages: List[dict], response):
+        if response is None:
+            return
+        line = json.dumps({"messages": messages, "response": json.loads(response.model_dump_json())}, ensure_ascii=False)
+        with self.lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    def complete(self, messages, response_model):
+        return self.complete_with_usage(messages, response_model)[0]
+
+    def complete_with_usage(self, messages, response_model):
+        response, usage = self.completer.complete_with_usage(messages, response_model)
+        self.record(messages, response)
+        return response, usage
+
+    def complete_streaming(self, messages, response_model, text_field, on_text, model=None, on_fields=None):
+        stream = self.completer.complete_streaming(messages, response_model, text_field, on_text, model, on_fields=on_fields)
+        self.record(messages, stream.result)
+        return stream
+
+
+class FakeOpenAIServer:
+    """
+        This FakeOpenAIServer serves POST /v1/chat/completions, delegating the response content to a responder
+    """
+
+    def __init__(
+        self,
+        responder: Callable[[dict], ProviderSearchAgentResponse] = default_responder,
+        latency: float = 0.5,
+        jitter: float = 0.0,
+        chunk_delay: float = 0.0,
+        seed: Optional[int] = None,
+        max_in_flight: Optional[int] = None,
+        retry_after: float = 0.05,
+        slow_fraction: float = 0.0,
+        slow_latency: float = 5.0,
+        error_fraction: float = 0.0,
+        model_latency: Optional[Dict[str, float]] = None,
+        token_latency: float = 0.0,
+        connect_latency: float = 0.0,
+    ):
+        """
+            Parameters:
+                responder (Callable): builds the response for a decoded request body
+                latency (float): seconds before the first byte of each response
+                jitter (float): up to this many seconds are added to the latency at random
+                chunk_delay (float): seconds between streamed chunks
+                max_in_flight (int): requests beyond this many in flight are answered 429. Default is no limit.
+                retry_after (float): the seconds a 429 response asks the client to wait
+                slow_fraction (float): the fraction of requests which take slow_latency instead of latency. Default is none.
+                slow_latency (float): seconds before the first byte of a slow response
+                error_fraction (float): the fraction of requests answered 500 after the latency. Default is none.
+                model_latency (Dict[str, float]): the latency of requests to each model, instead of latency
+                token_latency (float): seconds added to the latency for each completion token. Default is none.
+                connect_latency (float): seconds before the first request of each connection is read. Default is none.
+        """
+        self.responder = responder
+        self.latency = latency
+        self.jitter = jitter
+        self.chunk_delay = chunk_delay
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.max_in_flight = max_in_flight
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.rate_limited = 0
+        self.slow_fraction = slow_fraction
+        self.slow_latency = slow_latency
+        self.error_fraction = error_fraction
+        self.model_latency = model_latency or {}
+        self.token_latency = token_latency
+        self.connect_latency = connect_latency
+        self.slow = 0
+        self.errors = 0
+        self.connections = 0
+
+    def usage(self, request: dict, content: str) -> dict:
+        prompt = estimate_tokens("".join(str(message.get("content", "")) for message in request.get("messages", [])))
+        completion = estimate_tokens(content)
+        return {
+            "prompt_tokens": prompt,
+            "completion_tokens": completion,
+            "total_tokens": prompt + completion,
+            "prompt_tokens_details": {"cached_tokens": 0},
+        }
+
+    async def respond(self, request: dict, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.requests += 1
+        if self.max_in_flight is not None and self.in_flight >= self.max_in_flight:
+            self.rate_limited += 1
+            body = json.dumps({"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}).encode("utf-8")
+            writer.write(response_head(429, {
+                "Content-Type": "application/json",
+                "Content-Length": str(len(body)),
+                "retry-after-ms": str(int(self.retry_after * 1000)),
+            }) + body)
+            return
+        self.in_flight += 1
+        try:
+            await self.complete(request, reader, writer)
+        finally:
+            self.in_flight -= 1
+
+    async def complete(self, request: dict, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            response = self.responder(request)
+            if ((request.get("response_format") or {}).get("json_schema") or {}).get("name") == "ProviderSearchAgentDeltaResponse":
+                response = delta_response(response, prompt_state(request["messages"]))
+            content = response.model_dump_json()
+        except Exception as error:
+            writer.write(json_response(500, {"error": {"message": f"{type(error).__name__}: {error}"}}))
+            return
+        latency = self.model_latency.get(request.get("model"), self.latency) + self.random.uniform(0, self.jitter)
+        if not request.get("stream"):
+            # a streamed response takes its generation time chunk by chunk instead
+            latency += self.token_latency * estimate_tokens(content)
+        if self.slow_fraction and self.random.random() < self.slow_fraction:
+            self.slow += 1
+            latency = self.slow_latency
+        await asyncio.sleep(latency)
+        if reader.at_eof():
+            # the client gave up on the request, as a timed out or hedged client does
+            return
+        if self.error_fraction and self.random.random() < self.error_fraction:
+            self.errors += 1
+            writer.write(json_response(500, {"error": {"message": "The server had an error while processing your request"}}))
+            return
+        base = {"id": f"chatcmpl-{self.requests}", "created": int(time.time()), "model": request.get("model", "fake")}
+        if not request.get("stream"):
+            writer.write(json_response(200, dict(
+                base,
+                object="chat.completion",
+                choices=[{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                usage=self.usage(request, content),
+            )))
+            return
+        writer.write(response_head(200, {"Content-Type": "text/event-stream", "Transfer-Encoding": "chunked"}))
+
+        def send(chunk: dict):
+            data = f"data: {json.dumps(dict(base, object='chat.completion.chunk', **chunk))}\n\n".encode("utf-8")
+            writer.write(f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n")
+
+        for start in range(0, len(content), CHUNK_CHARACTERS):
+            send({"choices": [{"index": 0, "delta": {"content": content[start:start + CHUNK_CHARACTERS]}, "finish_reason": None}]})
+            delay = self.chunk_delay + self.token_latency * CHUNK_CHARACTERS / 4
+            if delay:
+                await writer.drain()
+                await asyncio.sleep(delay)
+        send({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (request.get("stream_options") or {}).get("include_usage"):
+            send({"choices": [], "usage": self.usage(request, content)})
+        done = b"data: [DONE]\n\n"
+        writer.write(f"{len(done):x}\r\n".encode("latin-1") + done + b"\r\n0\r\n\r\n")
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            if self.connect_latency:
+                await asyncio.sleep(self.connect_latency)
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                if method == "POST" and path.rstrip("/").endswith("/chat/completions"):
+                    await self.respond(json.loads(body), reader, writer)
+                else:
+                    writer.write(json_response(404, {"error": {"message": f"{method} {path} is not served"}}))
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # a response still delayed when the event loop stops, typically for a request the client dropped
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 0) -> asyncio.AbstractServer:
+        return await asyncio.start_server(self.handle, host, port, backlog=4096)
+
+    def serve_in_thread(self, host: str = "127.0.0.1") -> int:
+        """
+            Serves from an event loop in a daemon thread, for synchronous clients in this process, and returns the port
+        """
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+        ports = []
+
+        def run():
+            server = loop.run_until_complete(self.serve(host))
+            ports.append(server.sockets[0].getsockname()[1])
+            started.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        started.wait()
+        return ports[0]
+
+
+def make_responder(name: str, recording: Optional[str] = None) -> Callable[[dict], ProviderSearchAgentResponse]:
+    if name == "default":
+        return default_responder
+    if name == "rule":
+        return rule_responder
+    if name == "extract":
+        return extraction_responder
+    if name == "recorded":
+        if recording is None:
+            raise ValueError("the recorded responder needs a recording file")
+        return RecordedResponder(recording, fallback=rule_responder)
+    raise ValueError(f"unknown responder {name}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--chunk-delay", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--responder", choices=["default", "rule", "recorded", "extract"], default="default")
+    parser.add_argument("--recording", help="the JSON lines file for the recorded responder")
+    parser.add_argument("--max-in-flight", type=int, help="answer 429 beyond this many requests in flight")
+    parser.add_argument("--slow-fraction", type=float, default=0.0, help="the fraction of requests which take --slow-latency")
+    parser.add_argument("--slow-latency", type=float, default=5.0)
+    parser.add_argument("--error-fraction", type=float, default=0.0, help="the fraction of requests answered 500")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="seconds per completion token")
+    parser.add_argument("--connect-latency", type=float, default=0.0, help="seconds of handshakes for each new connection")
+    args = parser.parse_args()
+    fake = FakeOpenAIServer(make_responder(args.responder, args.recording), latency=args.latency, jitter=args.jitter,
+                            chunk_delay=args.chunk_delay, seed=args.seed, max_in_flight=args.max_in_flight,
+                            slow_fraction=args.slow_fraction, slow_latency=args.slow_latency, error_fraction=args.error_fraction,
+                            token_latency=args.token_latency, connect_latency=args.connect_latency)
+    server = await fake.serve(args.host, args.port)
+    print(f"listening on port {server.sockets[0].getsockname()[1]}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,49 @@
+"""
+    Runs each simulated persona through a ChatController with and without the fast path extractor,
+    and reports the fraction of member turns resolved locally, the completions saved, and the latency saved
+    with a simulated completion latency.
+
+    From the project root directory:
+    > python3 -m benchmarks.fast_path_benchmark --latency 0.6
+"""
+import argparse
+import statistics
+from benchmarks.simulation import PERSONAS, SimulatedCompleter, run_session
+from controller import ChatController
+from fast_extract import FastPathExtractor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--latency", type=float, default=0.6, help="seconds per simulated completion")
+    args = parser.parse_args()
+
+    extractor = FastPathExtractor()
+    print(f"{'persona':<8} {'turns':>5} {'local':>6} {'calls':>11} {'mean turn':>15} {'saved':>7}")
+    totals = {"turns": 0, "resolved": 0, "calls": [0, 0], "seconds": [0.0, 0.0]}
+    for persona in PERSONAS:
+        results = []
+        for fast_path in (None, extractor):
+            completer = SimulatedCompleter(persona, latency=args.latency)
+            controller = ChatController(completer=completer, debug=False, fast_path=fast_path)
+            results.append((run_session(controller, persona), completer.calls, controller.fast_path_stats))
+        (before, before_calls, _), (after, after_calls, stats) = results
+        assert before["complete"] and after["complete"]
+        saved = sum(before["turn_seconds"]) - sum(after["turn_seconds"])
+        print(
+            f"{persona.name:<8} {after['turns']:>5} {stats.resolved_fraction:>6.0%} {before_calls:>5} -> {after_calls:<3}"
+            f" {statistics.mean(before['turn_seconds']):>5.2f}s -> {statistics.mean(after['turn_seconds']):.2f}s {saved:>6.2f}s"
+        )
+        totals["turns"] += stats.turns
+        totals["resolved"] += stats.resolved
+        for i, (result, calls) in enumerate([(before, before_calls), (after, after_calls)]):
+            totals["calls"][i] += calls
+            totals["seconds"][i] += sum(result["turn_seconds"])
+    print(
+        f"{'all':<8} {totals['turns']:>5} {totals['resolved'] / totals['turns']:>6.0%} {totals['calls'][0]:>5} -> {totals['calls'][1]:<3}"
+        f" {'':>15} {totals['seconds'][0] - totals['seconds'][1]:>6.2f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+    Offline end-to-end benchmark of ChatController.  Simulated member personas hold main.py-style conversations
+    through StructuredChatCompleter and the OpenAI client, against the local fake chat completions endpoint,
+    so no API key or network access is needed.
+
+    Reports LLM calls, prompt and completion tokens per session, member turn latency percentiles and throughput,
+    and compares them with the stored baseline of the scenario: a metric which is worse than its baseline
+    by more than the tolerance fails the run with exit status 1.  Only the metrics which depend on the code alone
+    are stored and compared, unless --timing also stores and compares the timing metrics, for baselines recorded
+    on the machine which runs the comparison.
+
+    From the project root directory:
+    > python3 -m benchmarks.harness
+    > python3 -m benchmarks.harness --batch-size 3 --fast-path --update-baseline
+    > python3 -m benchmarks.harness --token-latency 0.01 --delta
+    > python3 -m benchmarks.harness --timing --update-baseline --baseline /tmp/local_baselines.json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from openai import OpenAI
+from benchmarks.load_test import start_server
+from benchmarks.simulation import PERSONAS, run_session
+from controller import ChatController
+from fast_extract import FastPathExtractor
+from structured_chat import StructuredChatCompleter
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines.json")
+
+# metric -> whether lower is better, and whether it only depends on the code rather than on timing
+METRICS = {
+    "llm_calls_per_session": (True, True),
+    "turns_per_session": (True, True),
+    "prompt_tokens_per_session": (True, True),
+    "completion_tokens_per_session": (True, True),
+    "completed_sessions": (False, True),
+    "turn_latency_p50": (True, False),
+    "turn_latency_p90": (True, False),
+    "turn_latency_p99": (True, False),
+    "turns_per_second": (False, False),
+}
+# deterministic metrics may still move a little, for example with the ordering of concurrent sessions
+DETERMINISTIC_TOLERANCE = 0.02
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def scenario_name(args) -> str:
+    return (
+        f"{args.responder}-latency{args.latency:g}-jitter{args.jitter:g}-batch{args.batch_size}"
+        f"{'-fastpath' if args.fast_path else ''}{'-nostream' if args.no_stream else ''}"
+        f"{f'-tokenlatency{args.token_latency:g}' if args.token_latency else ''}{'-delta' if args.delta else ''}"
+        f"-sessions{args.sessions}-concurrency{args.concurrency}"
+    )
+
+
+def run_benchmark(args) -> Dict[str, float]:
+    """
+        Runs args.sessions conversations per persona, args.concurrency at a time, and returns the metrics
+    """
+    arguments = ["-m", "benchmarks.fake_openai", "--port", "0", "--latency", str(args.latency), "--jitter", str(args.jitter),
+                 "--seed", str(args.seed), "--responder", args.responder, "--token-latency", str(args.token_latency)]
+    if args.recording:
+        arguments += ["--recording", args.recording]
+    # the fake endpoint runs in its own process, so its CPU time does not slow down the sessions
+    fake, port = start_server(arguments)
+    try:
+        client = OpenAI(api_key="fake", base_url=f"http://127.0.0.1:{port}/v1", max_retries=0)
+        completer = StructuredChatCompleter(client=client)
+
+        def session(persona):
+            controller = ChatController(
+                completer=completer,
+                debug=False,
+                batch_size=args.batch_size,
+                fast_path=FastPathExtractor() if args.fast_path else None,
+                delta=args.delta,
+            )
+            result = run_session(controller, persona, on_text=None if args.no_stream else lambda text: None)
+            return result, controller.usage
+
+        personas = [persona for persona in PERSONAS for _ in range(args.sessions)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(session, personas))
+        elapsed = time.perf_counter() - start
+    finally:
+        fake.kill()
+        fake.wait()
+
+    latencies = [seconds for result, usage in results for seconds in result["turn_seconds"]]
+    return {
+        "sessions": len(results),
+        "completed_sessions": sum(result["complete"] for result, usage in results),
+        "llm_calls_per_session": statistics.mean(usage.calls for result, usage in results),
+        "turns_per_session": statistics.mean(result["turns"] for result, usage in results),
+        "prompt_tokens_per_session": statistics.mean(usage.prompt_tokens for result, usage in results),
+        "completion_tokens_per_session": statistics.mean(usage.completion_tokens for result, usage in results),
+        "turn_latency_p50": percentile(latencies, 0.5),
+        "turn_latency_p90": percentile(latencies, 0.9),
+        "turn_latency_p99": percentile(latencies, 0.99),
+        "turns_per_second": len(latencies) / elapsed,
+        "elapsed": elapsed,
+    }
+
+
+def regressions(metrics: Dict[str, float], baseline: Dict[str, float], tolerance: float, timing: bool = False) -> List[str]:
+    """
+        Returns a description of each metric which is worse than its baseline by more than its tolerance.
+        Timing metrics are only compared with timing, since they depend on the machine.
+    """
+    failures = []
+    for name, (lower_is_better, deterministic) in METRICS.items():
+        if name not in baseline or not (deterministic or timing):
+            continue
+        allowed = DETERMINISTIC_TOLERANCE if deterministic else tolerance
+        expected, actual = baseline[name], metrics[name]
+        limit = expected * (1 + allowed) if lower_is_better else expected * (1 - allowed)
+        if (actual > limit) if lower_is_better else (actual < limit):
+            failures.append(f"{name} {actual:.4g} is worse than baseline {expected:.4g} by more than {allowed:.0%}")
+    return failures
+
+
+def load_baselines(path: str) -> Dict[str, Dict[str, float]]:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=10, help="sessions per persona")
+    parser.add_argument("--concurrency", type=int, default=8, help="sessions in flight")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake completion latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02, help="up to this many seconds are added to each latency")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--responder", choices=["rule", "recorded"], default="rule")
+    parser.add_argument("--recording", help="the JSON lines file for the recorded responder")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--fast-path", action="store_true")
+    parser.add_argument("--no-stream", action="store_true")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="fake seconds per completion token")
+    parser.add_argument("--delta", action="store_true", help="agents answer with the changed fields instead of the whole search state")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="the JSON file of baseline metrics by scenario")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression of timing metrics")
+    parser.add_argument("--timing", action="store_true", help="also store and compare the timing metrics, which depend on the machine")
+    parser.add_argument("--update-baseline", action="store_true", help="store the metrics as the scenario's baseline")
+    args = parser.parse_args(argv)
+
+    scenario = scenario_name(args)
+    metrics = run_benchmark(args)
+    print(f"scenario {scenario}")
+    print(f"sessions {metrics['sessions']}, completed {metrics['completed_sessions']}, elapsed {metrics['elapsed']:.1f}s")
+    print(f"per session: {metrics['llm_calls_per_session']:.1f} LLM calls, {metrics['turns_per_session']:.1f} member turns, "
+          f"{metrics['prompt_tokens_per_session']:.0f} prompt and {metrics['completion_tokens_per_session']:.0f} completion tokens")
+    print(f"turn latency p50 {metrics['turn_latency_p50'] * 1000:.0f} ms, p90 {metrics['turn_latency_p90'] * 1000:.0f} ms, "
+          f"p99 {metrics['turn_latency_p99'] * 1000:.0f} ms; {metrics['turns_per_second']:.1f} turns/s")
+
+    baselines = load_baselines(args.baseline)
+    if args.update_baseline:
+        baselines[scenario] = {name: metrics[name] for name, (_, deterministic) in METRICS.items() if deterministic or args.timing}
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"baseline updated in {args.baseline}")
+        return 0
+    if scenario not in baselines:
+        print("no baseline for this scenario, run with --update-baseline to store one")
+        return 0
+    failures = regressions(metrics, baselines[scenario], args.tolerance, args.timing)
+    for failure in failures:
+        print(f"REGRESSION: {failure}")
+    if not failures:
+        print("no regressions against the baseline")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
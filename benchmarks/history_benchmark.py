@@ -0,0 +1,129 @@
+"""
+    Reports estimated prompt tokens per turn over a 20-turn scripted conversation, for the previous history
+    (every assistant turn kept as the full response JSON) against ChatHistory (assistant text only,
+    search state once in the prompt, older turns in a truncated transcript beyond the token budget).
+
+    From the project root directory:
+    > python3 -m benchmarks.history_benchmark --token-budget 1500
+"""
+import argparse
+import re
+from controller import ChatController
+from history import ChatHistory, estimate_message_tokens
+from models import (
+    AgentGoalState,
+    AppointmentType,
+    Gender,
+    Insurance,
+    Language,
+    MemberProfile,
+    ProviderPreferences,
+    ProviderSearchAgentResponse,
+    ProviderSearchInputState,
+    TherapyType,
+    TreatmentSpecialty,
+)
+
+USER_MESSAGES = [
+    "Hi, I have been feeling really anxious lately and I can't sleep well at night, it has been going on for months.",
+    "I'm 34 years old and I'm a woman.",
+    "I have Aetna through my employer, the PPO plan I think.",
+    "English is fine, but I also speak Spanish at home with my family.",
+    "I think I would prefer someone who does cognitive behavioral therapy, a friend recommended it.",
+    "Yes, I would prefer a female provider if possible.",
+    "Online would be best, I work long hours and commuting is hard.",
+    "Actually, in person could also work on weekends.",
+    "Can you tell me more about how the matching works?",
+    "My sleep problems started after I changed jobs last year, and the stress at work makes everything worse.",
+    "I also sometimes get panic attacks before big meetings.",
+    "No, I have never seen a therapist before.",
+    "Is there a limit on how many sessions my insurance covers?",
+    "I'd like to start as soon as possible, ideally in the next two weeks.",
+    "Evenings after 6pm are best for me.",
+    "I don't have any preference about the provider's age.",
+    "Could the provider also help with work-life balance and stress?",
+    "That sounds good to me.",
+    "Yes, everything you have collected is correct.",
+    "Thank you, please go ahead with the search.",
+]
+
+STATES = [
+    {"provider_preferences": {"specialties": [TreatmentSpecialty.ANXIETY, TreatmentSpecialty.INSOMNIA]}},
+    {"member_profile": {"age": 34, "gender": Gender.FEMALE}},
+    {"member_profile": {"insurance": Insurance.AETNA}},
+    {"member_profile": {"language": Language.SPANISH}},
+    {"provider_preferences": {"therapy_types": [TherapyType.COGNITIVE_BEHAVIORAL]}},
+    {"provider_preferences": {"gender": Gender.FEMALE}},
+    {"provider_preferences": {"appointment_types": [AppointmentType.ONLINE]}},
+    {"provider_preferences": {"appointment_types": [AppointmentType.ONLINE, AppointmentType.IN_PERSON]}},
+    {},
+    {"provider_preferences": {"specialties": [TreatmentSpecialty.ANXIETY, TreatmentSpecialty.INSOMNIA, TreatmentSpecialty.STRESS]}},
+    {"provider_preferences": {"specialties": [TreatmentSpecialty.ANXIETY, TreatmentSpecialty.INSOMNIA, TreatmentSpecialty.STRESS, TreatmentSpecialty.PANIC_ATTACKS]}},
+]
+
+ASSISTANT_TEXT = (
+    "Thank you for sharing that with me, it really helps me understand what you are looking for. "
+    "To find the best match in our directory, could you tell me a little more about your preferences?"
+)
+
+
+class ScriptedCompleter:
+    """
+        Returns the scripted state for the current turn and records the estimated prompt tokens of each call
+    """
+
+    def __init__(self):
+        self.turn = 0
+        self.state = ProviderSearchInputState(member_profile=MemberProfile(), provider_preferences=ProviderPreferences())
+        self.prompt_tokens = []
+
+    def complete(self, messages, response_model):
+        return self.complete_with_usage(messages, response_model)[0]
+
+    def complete_with_usage(self, messages, response_model):
+        self.prompt_tokens.append(estimate_message_tokens(messages))
+        if self.turn < len(STATES):
+            for section, values in STATES[self.turn].items():
+                setattr(self.state, section, getattr(self.state, section).model_copy(update=values))
+        return ProviderSearchAgentResponse(
+            assistant_response=ASSISTANT_TEXT,
+            provider_search_information=self.state.model_copy(deep=True),
+            agent_state=AgentGoalState.MATCHED,
+        ), None
+
+
+def legacy_prompt(messages: list) -> str:
+    prompt = "\n".join(message["content"] for message in messages if message["role"] == "developer")
+    return re.sub(r"\s*<CURRENT_SEARCH_STATE>.*</CURRENT_SEARCH_STATE>", "", prompt, flags=re.S)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--token-budget", type=int, default=1500)
+    args = parser.parse_args()
+
+    completer = ScriptedCompleter()
+    controller = ChatController(completer=completer, debug=False, history=ChatHistory(token_budget=args.token_budget))
+    legacy_history = []
+    print(f"{'turn':>4} {'before':>7} {'after':>6}")
+    totals = [0, 0]
+    for turn, user_message in enumerate(USER_MESSAGES, start=1):
+        completer.turn = turn - 1
+        controller.add_user_message(user_message)
+        legacy_history.append({"role": "user", "content": user_message})
+        calls = len(completer.prompt_tokens)
+        response = controller.get_next_assistant_response()
+        after = sum(completer.prompt_tokens[calls:])
+        before = sum(
+            estimate_message_tokens([{"role": "developer", "content": legacy_prompt(controller.messages)}] + legacy_history)
+            for _ in completer.prompt_tokens[calls:]
+        )
+        legacy_history.append({"role": "assistant", "content": response.model_dump_json()})
+        totals[0] += before
+        totals[1] += after
+        print(f"{turn:>4} {before:>7} {after:>6}")
+    print(f"{'all':>4} {totals[0]:>7} {totals[1]:>6}  ({1 - totals[1] / totals[0]:.0%} fewer prompt tokens)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+    Reports what the pooled client and hedged requests of http_client.py save, against the local fake
+    chat completions endpoint.
+
+    connections: --sessions sessions of --turns completions each, every session with a StructuredChatCompleter of its own,
+    as each ChatController used to build.  With a client per completer every session opens new connections
+    (and pays a TLS handshake against the real API); with the shared pooled client the sessions reuse them.
+
+    hedging: --requests completions from --concurrency concurrent callers, where --slow-fraction of the responses
+    take --slow-latency.  Hedging sends a duplicate of a request slower than the hedge percentile of recent requests.
+
+    From the project root directory:
+    > python3 -m benchmarks.http_client_benchmark --slow-fraction 0.03 --slow-latency 2
+"""
+import argparse
+import asyncio
+import time
+from openai import AsyncOpenAI, DefaultHttpxClient, OpenAI
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.load_test import start_server
+from http_client import RequestPolicy, client_options
+from models import ProviderSearchAgentResponse
+from structured_chat import AsyncStructuredChatCompleter, StructuredChatCompleter
+
+MESSAGES = [{"role": "user", "content": "I need a therapist who speaks Spanish"}]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_sessions(base_url: str, sessions: int, turns: int, pooled: bool) -> float:
+    shared = OpenAI(api_key="fake", base_url=base_url, max_retries=0, http_client=DefaultHttpxClient(**client_options(100, 20, 30.0, 5.0)))
+    start = time.perf_counter()
+    for _ in range(sessions):
+        client = shared if pooled else OpenAI(api_key="fake", base_url=base_url, max_retries=0)
+        completer = StructuredChatCompleter(client=client)
+        for _ in range(turns):
+            completer.complete(MESSAGES, ProviderSearchAgentResponse)
+        if not pooled:
+            client.close()
+    shared.close()
+    return time.perf_counter() - start
+
+
+async def run_hedged(port: int, requests: int, concurrency: int, policy: RequestPolicy):
+    client = AsyncOpenAI(api_key="fake", base_url=f"http://127.0.0.1:{port}/v1", max_retries=0)
+    completer = AsyncStructuredChatCompleter(client=client, max_concurrency=concurrency, policy=policy)
+    latencies = []
+
+    async def caller(count):
+        for _ in range(count):
+            start = time.perf_counter()
+            await completer.complete(MESSAGES, ProviderSearchAgentResponse)
+            latencies.append(time.perf_counter() - start)
+
+    try:
+        await asyncio.gather(*[caller(requests // concurrency) for _ in range(concurrency)])
+    finally:
+        await client.close()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--turns", type=int, default=6)
+    parser.add_argument("--latency", type=float, default=0.02, help="fake completion latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=5, help="concurrent callers, few enough that the client CPU is not the bottleneck")
+    parser.add_argument("--slow-fraction", type=float, default=0.03)
+    parser.add_argument("--slow-latency", type=float, default=2.0)
+    parser.add_argument("--hedge-percentile", type=float, default=0.95)
+    args = parser.parse_args()
+
+    print(f"{'clients':>16} {'sessions':>8} {'completions':>11} {'connections':>11} {'seconds':>8}")
+    for pooled in (False, True):
+        fake = FakeOpenAIServer(latency=args.latency, jitter=args.jitter, seed=0)
+        port = fake.serve_in_thread()
+        seconds = run_sessions(f"http://127.0.0.1:{port}/v1", args.sessions, args.turns, pooled)
+        print(f"{'shared pooled' if pooled else 'per completer':>16} {args.sessions:>8} {fake.requests:>11} {fake.connections:>11} {seconds:>8.2f}")
+
+    print()
+    print(f"{'hedging':>8} {'requests':>8} {'p50':>7} {'p95':>7} {'p99':>7} {'max':>7} {'hedges':>7} {'wins':>6} {'extra':>6}")
+    for hedge in (False, True):
+        # a separate process, so the CPU time of the endpoint does not delay the client
+        fake, port = start_server(["-m", "benchmarks.fake_openai", "--port", "0", "--latency", str(args.latency), "--jitter", str(args.jitter),
+                                   "--seed", "0", "--slow-fraction", str(args.slow_fraction), "--slow-latency", str(args.slow_latency)])
+        policy = RequestPolicy(hedge=hedge, hedge_percentile=args.hedge_percentile)
+        try:
+            latencies = asyncio.run(run_hedged(port, args.requests, args.concurrency, policy))
+        finally:
+            fake.kill()
+            fake.wait()
+        stats = policy.stats
+        print(f"{'on' if hedge else 'off':>8} {len(latencies):>8} {percentile(latencies, 0.5):>7.3f} {percentile(latencies, 0.95):>7.3f} "
+              f"{percentile(latencies, 0.99):>7.3f} {max(latencies):>7.3f} {stats.hedges:>7} {stats.hedge_wins:>6} "
+              f"{stats.hedges / len(latencies):>6.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+    Load test for session_server.py against the local fake completion endpoint.
+    Both servers run as separate processes; this process drives concurrent sessions over HTTP,
+    and the CPU time of the session server process is used to estimate sessions per core.
+
+    From the project root directory:
+    > python3 -m benchmarks.load_test --sessions 1000 --turns 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+def start_server(arguments, env=None):
+    process = subprocess.Popen([sys.executable, *arguments], stdout=subprocess.PIPE, text=True, env=env)
+    line = process.stdout.readline()
+    if not line.startswith("listening on port"):
+        process.kill()
+        raise RuntimeError(f"{arguments} did not start: {line!r}")
+    return process, int(line.split()[-1])
+
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    # utime and stime are fields 14 and 15 of /proc/pid/stat
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def request(port, method, path, payload=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return response
+
+
+async def run_session(port, turns, think_time, first_token_latencies, turn_latencies, errors):
+    response = await request(port, "POST", "/sessions")
+    session_id = json.loads(response.split(b"\r\n\r\n", 1)[1])["session_id"]
+    message = None
+    for _ in range(turns):
+        start = time.perf_counter()
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        body = json.dumps({"message": message} if message else {}).encode("utf-8")
+        writer.write(f"POST /sessions/{session_id}/turns HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+        first_token = None
+        events = b""
+        while True:
+            chunk = await reader.read(65536)
+            if not chunk:
+                break
+            if first_token is None and b"event: text" in events + chunk:
+                first_token = time.perf_counter() - start
+            events += chunk
+        writer.close()
+        turn_latencies.append(time.perf_counter() - start)
+        if first_token is not None:
+            first_token_latencies.append(first_token)
+        if b"event: response" not in events:
+            errors.append(events[-200:])
+        message = "I would like to find a therapist for anxiety."
+        await asyncio.sleep(think_time)
+    await request(port, "DELETE", f"/sessions/{session_id}")
+
+
+async def drive(port, sessions, turns, think_time, ramp):
+    first_token_latencies, turn_latencies, errors = [], [], []
+    tasks = []
+    for index in range(sessions):
+        tasks.append(asyncio.create_task(run_session(port, turns, think_time, first_token_latencies, turn_latencies, errors)))
+        if ramp:
+            await asyncio.sleep(ramp / sessions)
+    await asyncio.gather(*tasks)
+    return first_token_latencies, turn_latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--think-time", type=float, default=1.0, help="seconds between a response and the next member message")
+    parser.add_argument("--ramp", type=float, default=1.0, help="seconds over which sessions are started")
+    parser.add_argument("--latency", type=float, default=0.5, help="fake completion latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--max-concurrency", type=int, default=1000)
+    args = parser.parse_args()
+
+    fake, fake_port = start_server(["-m", "benchmarks.fake_openai", "--port", "0", "--latency", str(args.latency), "--jitter", str(args.jitter)])
+    env = dict(os.environ, OPENAI_API_KEY="fake", OPENAI_BASE_URL=f"http://127.0.0.1:{fake_port}/v1")
+    server, port = start_server(["session_server.py", "--port", "0", "--max-concurrency", str(args.max_concurrency), "--max-sessions", str(args.sessions)], env)
+    try:
+        cpu_start = cpu_seconds(server.pid)
+        start = time.perf_counter()
+        first_tokens, latencies, errors = asyncio.run(drive(port, args.sessions, args.turns, args.think_time, args.ramp))
+        elapsed = time.perf_counter() - start
+        cpu = cpu_seconds(server.pid) - cpu_start
+    finally:
+        server.kill()
+        fake.kill()
+
+    turns = len(latencies)
+    cpu_per_turn = cpu / turns
+    print(f"sessions {args.sessions}, turns {turns}, errors {len(errors)}, elapsed {elapsed:.1f}s, {turns / elapsed:.0f} turns/s")
+    print(f"turn latency p50 {percentile(latencies, 0.5) * 1000:.0f} ms, p99 {percentile(latencies, 0.99) * 1000:.0f} ms "
+          f"(fake completion {args.latency * 1000:.0f}+{args.jitter * 1000:.0f} ms)")
+    if first_tokens:
+        print(f"first token p50 {percentile(first_tokens, 0.5) * 1000:.0f} ms, p99 {percentile(first_tokens, 0.99) * 1000:.0f} ms")
+    print(f"session server CPU {cpu:.1f}s, {cpu_per_turn * 1000:.2f} ms per turn, "
+          f"{turns / elapsed * cpu_per_turn:.0%} of one core at this load")
+    for think in (10, 30):
+        print(f"sessions per core at one turn every {think}s: {think / cpu_per_turn:.0f}")
+
+
+if __name__ == "__main__":
+    main()
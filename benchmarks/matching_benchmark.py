@@ -0,0 +1,81 @@
+"""
+    Benchmarks ProviderIndex filtering and top-k ranking on synthetic rosters.
+
+    From the project root directory:
+    > python3 -m benchmarks.matching_benchmark
+"""
+import argparse
+import random
+import statistics
+import time
+from benchmarks.synthetic import random_columns, random_names, random_providers, random_search_state
+from matching import ProviderIndex, search_criteria
+
+
+def linear_search(providers, input_state, k):
+    """
+        The straightforward pass over ProviderInformation objects, for comparison
+    """
+    member = input_state.member_profile
+    preferences = input_state.provider_preferences
+    scored = []
+    for position, provider in enumerate(providers):
+        if member.insurance is not None and member.insurance not in provider.insurance_accepted:
+            continue
+        if member.language is not None and member.language not in provider.languages_spoken:
+            continue
+        if member.gender is not None and member.gender not in provider.genders_treated:
+            continue
+        if preferences.appointment_types and not set(preferences.appointment_types) & set(provider.appointment_types):
+            continue
+        score = 0.0
+        if preferences.specialties:
+            score += 2.0 * len(set(preferences.specialties) & set(provider.specialties)) / len(preferences.specialties)
+        scored.append((-score, position))
+    return sorted(scored)[:k]
+
+
+def time_queries(function, states, repeat=1):
+    timings = []
+    for state in states:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            function(state)
+        timings.append((time.perf_counter() - start) / repeat)
+    return statistics.median(timings), max(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--linear-limit", type=int, default=100_000, help="largest roster to build as pydantic objects")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    states = [random_search_state(rng) for _ in range(args.queries)]
+    print(f"{'providers':>10} {'build(s)':>9} {'filter ms':>10} {'top-k ms':>9} {'p100 ms':>8} {'linear ms':>10}")
+    for size in args.sizes:
+        linear = None
+        if size <= args.linear_limit:
+            providers = random_providers(size)
+            start = time.perf_counter()
+            index = ProviderIndex.from_providers(providers)
+            build = time.perf_counter() - start
+            linear, _ = time_queries(lambda state: linear_search(providers, state, args.k), states[:5])
+        else:
+            start = time.perf_counter()
+            index = ProviderIndex(random_columns(size), random_names(size))
+            build = time.perf_counter() - start
+        filter_median, _ = time_queries(lambda state: index.filter(search_criteria(state)), states)
+        search_median, search_max = time_queries(lambda state: index.search(state, k=args.k), states)
+        linear_text = f"{linear * 1000:10.2f}" if linear is not None else f"{'-':>10}"
+        print(
+            f"{size:>10} {build:9.2f} {filter_median * 1000:10.3f} {search_median * 1000:9.3f} "
+            f"{search_max * 1000:8.3f} {linear_text}"
+        )
+
+
+if __name__ == "__main__":
+    main()
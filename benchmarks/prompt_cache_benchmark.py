@@ -0,0 +1,109 @@
+"""
+    Estimates how much of each prompt the provider's prompt cache could reuse, for the previous prompt
+    (rebuilt every turn, with the agent's goal between the shared instructions) against the stable prefix
+    (all shared instructions first, then the agent's goal and constraints built once per agent class, then the search state).
+
+    Every request of the simulated sessions is compared with all earlier requests, as a prompt cache shared by
+    the sessions would.  The strict response schema is the same for every request and comes ahead of the messages,
+    so it meets the provider's minimum cacheable prompt by itself; the cached prefix of the messages then grows
+    in --increment token steps.  Also times building the response schema per request against the cached schema.
+
+    From the project root directory:
+    > python3 -m benchmarks.prompt_cache_benchmark
+"""
+import argparse
+import os
+import time
+from typing import List
+from benchmarks.simulation import PERSONAS, SimulatedCompleter, run_session
+from controller import ChatController
+from history import estimate_tokens
+from models import ProviderSearchAgentResponse
+from structured_chat import build_response_format, response_format
+
+
+class LegacyPromptController(ChatController):
+    """
+        Sends the prompt layout before the stable prefix: one developer message with the agent's goal in the middle
+    """
+
+    def get_agent_messages(self, agent) -> List[dict]:
+        return self.history.render(f'''
+                You assist the user to find a mental health provider in the provider directory.
+                Your goal is to prompt the user to answer questions about themselves and their preferred provider
+                so you can populate fields in their member profile and in provider preferences.
+
+                You can ask one or two questions at a time.
+
+            <GOAL>
+                {agent.goal()}
+                Note: you plan to collect additional information after you achieve this goal.
+            </GOAL>
+            <CONSTRAINTS>
+                MemberProfile must always be populated with a dictionary.
+                ProviderPreferences must always be populated with a dictionary.
+                MemberProfile and ProviderPreferences fields should be null or empty list if not specified by the user.
+
+                YOUR RESPONSE SHOULD NOT SAY "LASTLY" or "LAST" BECAUSE THIS IS NOT THE LAST QUESTION
+                {agent.constraints()}
+            </CONSTRAINTS>
+            <CURRENT_SEARCH_STATE>
+                provider_search_information collected so far, omitting fields which are still null. Keep these values unless the user changes them.
+                {self.search_input_state.model_dump_json(exclude_none=True)}
+            </CURRENT_SEARCH_STATE>
+        ''')
+
+
+class RecordingCompleter(SimulatedCompleter):
+    def __init__(self, persona, requests: List[str]):
+        super().__init__(persona)
+        self.requests = requests
+
+    def complete_with_usage(self, messages, response_model):
+        self.requests.append("".join(f"<{message['role']}>{message['content']}" for message in messages))
+        return super().complete_with_usage(messages, response_model)
+
+
+def cached_tokens(requests: List[str], increment: int):
+    """
+        Returns the total message tokens, the tokens shared with an earlier request, and the tokens a prompt cache would serve
+    """
+    total = shared = cacheable = 0
+    for i, request in enumerate(requests):
+        prefix = max((len(os.path.commonprefix([request, earlier])) for earlier in requests[:i]), default=0)
+        prefix_tokens = estimate_tokens(request[:prefix])
+        total += estimate_tokens(request)
+        shared += prefix_tokens
+        cacheable += prefix_tokens // increment * increment
+    return total, shared, cacheable
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=1, help="sessions per persona")
+    parser.add_argument("--increment", type=int, default=128)
+    args = parser.parse_args()
+
+    print(f"{'layout':<14} {'requests':>8} {'messages':>8} {'shared prefix':>14} {'cacheable':>10}")
+    for name, controller_class in [("previous", LegacyPromptController), ("stable prefix", ChatController)]:
+        requests = []
+        for persona in PERSONAS:
+            for _ in range(args.sessions):
+                run_session(controller_class(completer=RecordingCompleter(persona, requests), debug=False), persona)
+        total, shared, cacheable = cached_tokens(requests, args.increment)
+        print(f"{name:<14} {len(requests):>8} {total:>8} {shared:>8} ({shared / total:>3.0%}) {cacheable:>10}")
+
+    repeats = 1000
+    start = time.perf_counter()
+    for _ in range(repeats):
+        build_response_format(ProviderSearchAgentResponse)
+    rebuilt = (time.perf_counter() - start) / repeats
+    start = time.perf_counter()
+    for _ in range(repeats):
+        response_format(ProviderSearchAgentResponse)
+    cached = (time.perf_counter() - start) / repeats
+    print(f"response schema per request: rebuilt {rebuilt * 1e6:.0f}us, cached {cached * 1e6:.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+    Evaluates the ReasonMatcher on a labeled set of paraphrased member replies, no clause of which is one of its
+    curated phrases: the top-1 and top-3 accuracy of its ranked candidates, how many replies each fill threshold
+    resolves locally and how many of those are exactly right, that replies denying a value are never resolved, and
+    the latency of ranking and matching a reply.
+
+    From the project root directory:
+    > python3 -m benchmarks.reason_benchmark
+"""
+import argparse
+import time
+from typing import List, Set, Tuple
+from models import TherapyType, TreatmentSpecialty
+from reason_match import ALIASES, ReasonMatcher
+
+S = TreatmentSpecialty
+T = TherapyType
+
+# paraphrased reply -> the values it names, excluding aliases
+SPECIALTY_REPLIES: List[Tuple[str, Set[TreatmentSpecialty]]] = [
+    ("I can't sleep and I'm always on edge", {S.INSOMNIA, S.ANXIETY}),
+    ("I'm anxious and sleep badly", {S.ANXIETY, S.INSOMNIA}),
+    ("I keep having panic attacks at work", {S.PANIC_ATTACKS}),
+    ("my marriage has been falling apart since last year", {S.MARRIAGE_COUNSELING}),
+    ("I worry about everything all day", {S.ANXIETY}),
+    ("I get really nervous around people", {S.ANXIETY}),
+    ("my anxiety is through the roof", {S.ANXIETY}),
+    ("I've been so depressed", {S.DEPRESSION}),
+    ("I feel hopeless and sad most days", {S.DEPRESSION}),
+    ("I have no energy and don't enjoy anything anymore", {S.DEPRESSION}),
+    ("I lie awake every night", {S.INSOMNIA}),
+    ("my sleep is terrible", {S.INSOMNIA}),
+    ("I was diagnosed with ADHD as a kid", {S.ADHD}),
+    ("I can never concentrate on my work", {S.ADHD}),
+    ("my son is autistic", {S.AUTISM}),
+    ("I think I might be on the autism spectrum", {S.AUTISM}),
+    ("I have bipolar", {S.BIPOLAR}),
+    ("my moods swing from manic to really low", {S.BIPOLAR}),
+    ("work has me totally stressed", {S.STRESS}),
+    ("I'm completely burnt out", {S.STRESS}),
+    ("I was diagnosed with borderline", {S.BORDERLINE_PERSONALITY}),
+    ("I have OCD", {S.OCD}),
+    ("I check the locks over and over", {S.OCD}),
+    ("I have PTSD from the army", {S.PTSD}),
+    ("I keep having flashbacks of the accident", {S.PTSD}),
+    ("I was abused as a child", {S.PTSD}),
+    ("I hear voices sometimes", {S.PSYCHOSIS}),
+    ("I'm struggling with alcohol", {S.ADDICTION}),
+    ("I'm addicted to painkillers", {S.ADDICTION}),
+    ("I want to stay sober", {S.ADDICTION}),
+    ("I've been cutting myself", {S.SELF_HARM}),
+    ("I hurt myself when things get bad", {S.SELF_HARM}),
+    ("my mother has dementia", {S.DEMENTIA}),
+    ("my dad is losing his memory", {S.DEMENTIA}),
+    ("my daughter has dyslexia", {S.DYSLEXIA}),
+    ("I'm going through a divorce", {S.DIVORCE}),
+    ("my wife and I are separating", {S.DIVORCE}),
+    ("I get sudden waves of panic out of nowhere", {S.PANIC_ATTACKS}),
+    ("my heart races and I feel like I can't breathe", {S.PANIC_ATTACKS}),
+    ("I have an eating disorder", {S.EATING_DISORDER}),
+    ("I binge and then purge", {S.EATING_DISORDER}),
+    ("my husband and I fight constantly", {S.MARRIAGE_COUNSELING}),
+    ("we need marriage counseling", {S.MARRIAGE_COUNSELING}),
+    ("I want a coach to help me with my career", {S.LIFE_COACHING}),
+    ("I feel stuck and want to set goals", {S.LIFE_COACHING}),
+    ("I'm depressed and worried all the time", {S.DEPRESSION, S.ANXIETY}),
+    ("stressed at work, and I lie awake at night", {S.STRESS, S.INSOMNIA}),
+    ("I drink too much since my divorce", {S.ADDICTION, S.DIVORCE}),
+    ("panicky episodes and feeling depressed", {S.PANIC_ATTACKS, S.DEPRESSION}),
+    ("trauma from a car crash and nightmares", {S.PTSD}),
+]
+THERAPY_TYPE_REPLIES: List[Tuple[str, Set[TherapyType]]] = [
+    ("we would like to come in together as a couple", {T.COUPLES}),
+    ("therapy that changes how I think", {T.COGNITIVE_BEHAVIORAL}),
+    ("cognitive behavioural therapy", {T.COGNITIVE_BEHAVIORAL}),
+    ("something practical with exercises", {T.COGNITIVE_BEHAVIORAL}),
+    ("I'd like to work on my thought patterns", {T.COGNITIVE_BEHAVIORAL}),
+    ("family counseling", {T.FAMILY}),
+    ("with my kids and my husband", {T.FAMILY}),
+    ("our whole family needs help", {T.FAMILY}),
+    ("I want trauma focused therapy", {T.TRAUMA}),
+    ("the eye movement therapy for trauma", {T.TRAUMA}),
+    ("couples counselling", {T.COUPLES}),
+    ("me and my partner", {T.COUPLES}),
+    ("my boyfriend and I together", {T.COUPLES}),
+    ("practical exercises, and sessions with my whole family", {T.COGNITIVE_BEHAVIORAL, T.FAMILY}),
+]
+
+# replies which deny or hedge the value they are most similar to, so none may be filled
+NEGATED_REPLIES: List[str] = [
+    "I'm not anxious", "alcohol is not a problem", "depression, not anxiety", "I used to drink a lot",
+    "I never had panic attacks", "no trauma or anything like that", "I don't think it's ADHD", "it isn't about my marriage",
+]
+
+
+def expand(values):
+    return set(values) | {alias for value in values for alias in ALIASES.get(value, ())}
+
+
+def evaluate(matcher: ReasonMatcher, field: str, replies, thresholds):
+    index = matcher.index(field)
+    top1 = top3 = 0
+    for text, expected in replies:
+        ranked = [candidate.value for candidate in index.rank(text, k=len(expected) + 2)]
+        top1 += ranked[0] in expected if ranked else 0
+        # every expected value within the top len(expected) + 2
+        top3 += expected <= set(ranked)
+    print(f"{field}: {len(replies)} replies, top-1 {top1 / len(replies):.0%}, all expected in top k+2 {top3 / len(replies):.0%}")
+    print(f"{'threshold':>10} {'filled':>7} {'exact':>6} {'wrong':>6}")
+    for threshold in thresholds:
+        filled = exact = 0
+        for text, expected in replies:
+            values = index.match(text, threshold)
+            if values is not None:
+                filled += 1
+                exact += set(values) == expand(expected)
+        print(f"{threshold:>10.2f} {filled / len(replies):>7.0%} {exact / len(replies):>6.0%} {(filled - exact) / len(replies):>6.0%}")
+
+
+def evaluate_negated(matcher: ReasonMatcher, replies: List[str], thresholds):
+    filled = [sum(matcher.specialties.match(text, threshold) is not None for text in replies) for threshold in thresholds]
+    print(f"negated replies: {len(replies)}, filled at " + ", ".join(f"{threshold:.2f}: {count}" for threshold, count in zip(thresholds, filled)))
+
+
+def latency(matcher: ReasonMatcher, replies, repeat: int):
+    texts = [text for text, _ in replies]
+    for name, call in (("rank", lambda text: matcher.specialties.rank(text)),
+                       ("match", lambda text: matcher.specialties.match(text, matcher.fill_threshold)),
+                       ("hints", lambda text: matcher.hints(text, ReasonMatcher.FIELDS))):
+        timings = []
+        for text in texts:
+            start = time.perf_counter()
+            for _ in range(repeat):
+                call(text)
+            timings.append((time.perf_counter() - start) / repeat)
+        timings.sort()
+        print(f"{name:>6}: p50 {timings[len(timings) // 2] * 1e6:.0f}us, max {timings[-1] * 1e6:.0f}us per reply")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.3, 0.4, 0.5, 0.6, 0.7, 0.8])
+    parser.add_argument("--repeat", type=int, default=200, help="the calls per reply timed")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    matcher = ReasonMatcher()
+    print(f"built the indexes in {(time.perf_counter() - start) * 1000:.1f}ms, "
+          f"{matcher.specialties.matrix.shape[0]} + {matcher.therapy_types.matrix.shape[0]} features")
+    evaluate(matcher, "provider_preferences.specialties", SPECIALTY_REPLIES, args.thresholds)
+    evaluate(matcher, "provider_preferences.therapy_types", THERAPY_TYPE_REPLIES, args.thresholds)
+    evaluate_negated(matcher, NEGATED_REPLIES, args.thresholds)
+    latency(matcher, SPECIALTY_REPLIES, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
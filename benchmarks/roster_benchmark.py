@@ -0,0 +1,76 @@
+"""
+    Compares load time and resident memory of the compiled, memory-mapped roster against
+    validating the roster into ProviderInformation objects.  Each loader runs in a fresh process.
+
+    From the project root directory:
+    > python3 -m benchmarks.roster_benchmark --providers 100000
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.synthetic import random_providers, random_search_state
+
+
+def rss_kib():
+    with open("/proc/self/status") as f:
+        fields = dict(line.split(":", 1) for line in f)
+    return {key: int(fields[key].split()[0]) for key in ("VmRSS", "RssAnon", "RssFile")}
+
+
+def child(mode, path):
+    before = rss_kib()
+    start = time.perf_counter()
+    if mode == "pydantic":
+        from matching import ProviderIndex
+        from roster import read_providers
+        providers = list(read_providers(path))
+        index = ProviderIndex.from_providers(providers)
+    else:
+        from roster import load_roster
+        index = load_roster(path)
+    loaded = time.perf_counter() - start
+    start = time.perf_counter()
+    index.search(random_search_state(random.Random(0)))
+    first_search = time.perf_counter() - start
+    after = rss_kib()
+    print(mode, len(index), loaded, first_search, *(after[key] - before[key] for key in ("VmRSS", "RssAnon", "RssFile")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--providers", type=int, default=100_000)
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child)
+        return
+
+    from roster import compile_roster
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "providers.jsonl")
+        compiled = os.path.join(directory, "roster.bin")
+        providers = random_providers(args.providers)
+        with open(source, "w") as f:
+            for provider in providers:
+                f.write(provider.model_dump_json() + "\n")
+        start = time.perf_counter()
+        compile_roster(providers, compiled)
+        print(f"compiled {len(providers)} providers in {time.perf_counter() - start:.2f}s: "
+              f"{os.path.getsize(source) / 1e6:.1f} MB JSONL -> {os.path.getsize(compiled) / 1e6:.1f} MB roster")
+        print(f"{'loader':>9} {'load(s)':>8} {'search ms':>10} {'RSS MiB':>8} {'anon MiB':>9} {'shared MiB':>11}")
+        for mode, path in (("pydantic", source), ("mmap", compiled)):
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.roster_benchmark", "--child", mode, path],
+                check=True, capture_output=True, text=True,
+            ).stdout.split()
+            _, _, loaded, search, rss, anon, shared = output
+            print(f"{mode:>9} {float(loaded):8.3f} {float(search) * 1000:10.2f} "
+                  f"{int(rss) / 1024:8.1f} {int(anon) / 1024:9.1f} {int(shared) / 1024:11.1f}")
+
+
+if __name__ == "__main__":
+    main()
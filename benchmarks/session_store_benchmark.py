@@ -0,0 +1,88 @@
+"""
+    Reports SessionStore checkpoint write latency and rehydration time with many stored sessions.
+
+    The store is filled with --sessions simulated conversations, each recorded turn by turn as a live server would,
+    then --samples more conversations are checkpointed and --samples random stored sessions are rehydrated
+    into new ChatControllers.
+
+    From the project root directory:
+    > python3 -m benchmarks.session_store_benchmark --sessions 10000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from benchmarks.simulation import FIELDS, PERSONAS, SimulatedCompleter, field_value
+from controller import ChatController
+from session_store import SessionStore
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def record_session(store: SessionStore, persona, write_seconds=None) -> str:
+    """
+        Runs a simulated conversation like run_session(), appending each user message and checkpointing each turn
+    """
+    session_id = store.create()
+    controller = ChatController(completer=SimulatedCompleter(persona), debug=False)
+
+    def write(append, *arguments):
+        start = time.perf_counter()
+        append(session_id, *arguments)
+        if write_seconds is not None:
+            write_seconds.append(time.perf_counter() - start)
+
+    controller.get_next_assistant_response()
+    write(store.checkpoint_turn, controller)
+    while any(field_value(controller.search_input_state, field) is None for field in FIELDS):
+        asked = [field for field in controller.agent.fields if field_value(controller.search_input_state, field) is None]
+        reply = persona.reply(asked or [field for field in FIELDS if field_value(controller.search_input_state, field) is None][:1])
+        controller.add_user_message(reply)
+        write(store.append_user_message, reply)
+        controller.get_next_assistant_response()
+        write(store.checkpoint_turn, controller)
+    return session_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=10000, help="sessions stored before measuring")
+    parser.add_argument("--samples", type=int, default=1000, help="sessions checkpointed and rehydrated while measuring")
+    parser.add_argument("--synchronous", default="NORMAL", choices=["OFF", "NORMAL", "FULL"])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "sessions.sqlite")
+        store = SessionStore(path, synchronous=args.synchronous)
+        session_ids = []
+        start = time.perf_counter()
+        for index in range(args.sessions):
+            session_ids.append(record_session(store, PERSONAS[index % len(PERSONAS)]))
+        fill = time.perf_counter() - start
+        events = store.connection.execute("SELECT COUNT(*) FROM session_events").fetchone()[0]
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+        print(f"stored {len(store)} sessions, {events} events, {size / len(store):.0f} bytes per session, filled in {fill:.1f}s")
+
+        write_seconds = []
+        for index in range(args.samples):
+            session_ids.append(record_session(store, PERSONAS[index % len(PERSONAS)], write_seconds))
+        print(f"checkpoint write: p50 {percentile(write_seconds, 0.5) * 1e6:.0f}us, p99 {percentile(write_seconds, 0.99) * 1e6:.0f}us "
+              f"({len(write_seconds)} appends, synchronous={args.synchronous})")
+
+        rehydrate_seconds = []
+        for session_id in random.Random(0).sample(session_ids, args.samples):
+            start = time.perf_counter()
+            controller = store.rehydrate(session_id, ChatController(completer=SimulatedCompleter(PERSONAS[0]), debug=False))
+            rehydrate_seconds.append(time.perf_counter() - start)
+            assert controller is not None
+        print(f"rehydrate: p50 {percentile(rehydrate_seconds, 0.5) * 1e6:.0f}us, p99 {percentile(rehydrate_seconds, 0.99) * 1e6:.0f}us "
+              f"with {len(store)} stored sessions")
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
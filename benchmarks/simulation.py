@@ -0,0 +1,305 @@
+"""
+    Simulated members and a simulated LLM, for benchmarks which run whole conversations through a ChatController
+    without an OpenAI key.
+"""
+import json
+import random
+import re
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import agents
+from history import estimate_message_tokens, estimate_tokens
+from models import (
+    AgentGoalState,
+    AppointmentType,
+    Gender,
+    Insurance,
+    Language,
+    ProviderSearchAgentResponse,
+    ProviderSearchInputState,
+    TherapyType,
+    TreatmentSpecialty,
+)
+
+FIELDS = (
+    "provider_preferences.specialties",
+    "provider_preferences.therapy_types",
+    "member_profile.gender",
+    "member_profile.age",
+    "member_profile.insurance",
+    "member_profile.language",
+    "provider_preferences.gender",
+    "provider_preferences.appointment_types",
+)
+AGENT_CLASSES = [
+    cls for cls in vars(agents).values()
+    if isinstance(cls, type) and issubclass(cls, agents.ProviderSearchChatAgent) and cls.fields
+]
+_SEARCH_STATE = re.compile(r"<CURRENT_SEARCH_STATE>.*?(\{.*\})\s*</CURRENT_SEARCH_STATE>", re.S)
+
+
+class Persona:
+    """
+        A simulated member, who answers each field with a fixed reply
+    """
+
+    def __init__(self, name: str, answers: Dict[str, Tuple[str, Any]]):
+        """
+            Parameters:
+                name (str): the persona name, for reports
+                answers (Dict): field -> (reply text, extracted value), for every field in FIELDS
+        """
+        self.name = name
+        self.answers = answers
+
+    def reply(self, fields: Sequence[str]) -> str:
+        return ", ".join(self.answers[field][0] for field in fields)
+
+    def extract(self, text: str) -> Dict[str, Any]:
+        """
+            Returns the field values a perfect extractor would find in a reply of this persona
+        """
+        # whole words only, so "male" is not found in "female"
+        return {field: value for field, (reply, value) in self.answers.items() if reply and re.search(rf"\b{re.escape(reply)}\b", text)}
+
+
+PERSONAS = [
+    Persona("terse", {
+        "provider_preferences.specialties": ("anxiety and insomnia", [TreatmentSpecialty.ANXIETY, TreatmentSpecialty.INSOMNIA]),
+        "provider_preferences.therapy_types": ("CBT", [TherapyType.COGNITIVE_BEHAVIORAL]),
+        "member_profile.gender": ("female", Gender.FEMALE),
+        "member_profile.age": ("34", 34),
+        "member_profile.insurance": ("Aetna", Insurance.AETNA),
+        "member_profile.language": ("Spanish", Language.SPANISH),
+        "provider_preferences.gender": ("a woman please", Gender.FEMALE),
+        "provider_preferences.appointment_types": ("online", [AppointmentType.ONLINE]),
+    }),
+    Persona("mixed", {
+        "provider_preferences.specialties": ("I keep having panic attacks at work", [TreatmentSpecialty.PANIC_ATTACKS]),
+        "provider_preferences.therapy_types": ("whatever works for panic", [TherapyType.COGNITIVE_BEHAVIORAL]),
+        "member_profile.gender": ("male", Gender.MALE),
+        "member_profile.age": ("I'm 52 years old", 52),
+        "member_profile.insurance": ("I have Blue Cross", Insurance.BLUE_CROSS),
+        "member_profile.language": ("English is fine", Language.ENGLISH),
+        "provider_preferences.gender": ("a man would be better", Gender.MALE),
+        "provider_preferences.appointment_types": ("in person", [AppointmentType.IN_PERSON]),
+    }),
+    Persona("chatty", {
+        "provider_preferences.specialties": ("my marriage has been falling apart since last year", [TreatmentSpecialty.MARRIAGE_COUNSELING]),
+        "provider_preferences.therapy_types": ("we would like to come in together as a couple", [TherapyType.COUPLES]),
+        "member_profile.gender": ("I am a woman", Gender.FEMALE),
+        "member_profile.age": ("I turned 41 in March", 41),
+        "member_profile.insurance": ("my employer gives us United through work", Insurance.UNITED_HEALTHCARE),
+        "member_profile.language": ("we speak Mandarin at home, but English is fine too", Language.ENGLISH),
+        "provider_preferences.gender": ("I think my husband would feel better with a man", Gender.MALE),
+        "provider_preferences.appointment_types": ("we could do either online or in person", [AppointmentType.ONLINE, AppointmentType.IN_PERSON]),
+    }),
+]
+
+
+def field_value(state: ProviderSearchInputState, field: str) -> Any:
+    section, name = field.split(".")
+    return getattr(getattr(state, section), name)
+
+
+def set_field(state: ProviderSearchInputState, field: str, value: Any):
+    section, name = field.split(".")
+    setattr(getattr(state, section), name, value)
+
+
+class Usage:
+    def __init__(self, prompt_tokens: int, completion_tokens: int):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.total_tokens = prompt_tokens + completion_tokens
+
+
+def agent_fields(prompt: str) -> List[str]:
+    """
+        Returns the fields of the agents whose goals are in the prompt
+    """
+    # compared without whitespace, so prompts which indent the goal differently are understood
+    prompt = " ".join(prompt.split())
+    return [field for cls in AGENT_CLASSES if " ".join(cls().goal().split()) in prompt for field in cls.fields]
+
+
+def prompt_state(messages: List[dict]) -> ProviderSearchInputState:
+    """
+        Returns the search state in the developer prompt, or an empty one
+    """
+    prompt = "\n".join(message["content"] for message in messages if message["role"] == "developer")
+    match = _SEARCH_STATE.search(prompt)
+    return ProviderSearchInputState.model_validate(json.loads(match.group(1)) if match else {"member_profile": {}, "provider_preferences": {}})
+
+
+def simulate_response(messages: List[dict], extract: Callable[[str], Dict[str, Any]]) -> ProviderSearchAgentResponse:
+    """
+        Returns the response of an LLM which extracts replies perfectly.  The search state is read back from the prompt,
+        the values extract() finds in the latest user message are applied to it, and the response asks about
+        the unanswered fields of the agents whose goals are in the prompt.
+    """
+    prompt = "\n".join(message["content"] for message in messages if message["role"] == "developer")
+    state = prompt_state(messages)
+    conversation = [message for message in messages if message["role"] != "developer"]
+    if conversation and conversation[-1]["role"] == "user":
+        for field, value in extract(conversation[-1]["content"]).items():
+            set_field(state, field, value)
+    unanswered = [field for field in agent_fields(prompt) if field_value(state, field) is None]
+    if unanswered:
+        text = f"Thank you. Could you tell me about your {' and '.join(field.split('.')[1] for field in unanswered)}?"
+    else:
+        text = "Thank you, I have everything I need for that."
+    return ProviderSearchAgentResponse(
+        assistant_response=text,
+        provider_search_information=state,
+        agent_state=AgentGoalState.MATCHED if unanswered else AgentGoalState.COMPLETE,
+    )
+
+
+def extract_any_persona(text: str) -> Dict[str, Any]:
+    values = {}
+    for persona in PERSONAS:
+        values.update(persona.extract(text))
+    return values
+
+
+def rule_responder(request: dict) -> ProviderSearchAgentResponse:
+    """
+        A FakeOpenAIServer responder which extracts the replies of every persona in PERSONAS
+    """
+    return simulate_response(request["messages"], extract_any_persona)
+
+
+class CheapModelResponder:
+    """
+        A FakeOpenAIServer responder which answers like rule_responder, except that a fraction of the requests
+        to any model but the large one get a mistake: one the cascade's consistency checks find (a collected field dropped,
+        COMPLETE while dropping the answer to the agent's question, or the specialties of a reason missed), or a wrong
+        specialty which no check can find.
+        Only mistakes which change the response are made, so the error rate is the fraction of responses which are wrong.
+    """
+    MISTAKES = ("regressed", "agent_state", "specialties", "wrong_specialty")
+
+    def __init__(self, large: str = "gpt-4o", error_rate: float = 0.2, seed: Optional[int] = None):
+        self.large = large
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.mistakes = {mistake: 0 for mistake in self.MISTAKES}
+
+    def __call__(self, request: dict) -> ProviderSearchAgentResponse:
+        response = rule_responder(request)
+        if request.get("model") == self.large or self.random.random() >= self.error_rate:
+            return response
+        state = response.provider_search_information
+        conversation = [message for message in request["messages"] if message["role"] != "developer"]
+        extracted = extract_any_persona(conversation[-1]["content"]) if conversation and conversation[-1]["role"] == "user" else {}
+        collected = [field for field in FIELDS if field_value(state, field) is not None and field not in extracted]
+        prompt = "\n".join(message["content"] for message in request["messages"] if message["role"] == "developer")
+        answered = [field for field in agent_fields(prompt) if field in extracted]
+        # only the mistakes which would change this response
+        mistakes = [
+            mistake for mistake, possible in zip(self.MISTAKES, (
+                collected,
+                answered,
+                "provider_preferences.specialties" in extracted,
+                "provider_preferences.specialties" in extracted,
+            )) if possible
+        ]
+        if not mistakes:
+            return response
+        mistake = self.random.choice(mistakes)
+        self.mistakes[mistake] += 1
+        if mistake == "regressed":
+            set_field(state, self.random.choice(collected), None)
+        elif mistake == "agent_state":
+            for field in answered:
+                set_field(state, field, None)
+            response.agent_state = AgentGoalState.COMPLETE
+        elif mistake == "specialties":
+            state.provider_preferences.specialties = None
+        else:
+            state.provider_preferences.specialties = [TreatmentSpecialty.STRESS]
+        return response
+
+
+def extraction_responder(request: dict) -> ProviderSearchInputState:
+    """
+        A FakeOpenAIServer responder for batch_extract.py, which extracts the replies of every persona in a whole transcript
+    """
+    state = ProviderSearchInputState(member_profile={}, provider_preferences={})
+    for message in request["messages"]:
+        if message["role"] == "user":
+            for field, value in extract_any_persona(message["content"]).items():
+                set_field(state, field, value)
+    return state
+
+
+def persona_transcript(persona: Persona, transcript_id: str) -> dict:
+    """
+        Returns a transcript in the batch_extract.py format, in which the persona answers one question per field
+    """
+    messages = []
+    for field in FIELDS:
+        messages.append({"role": "assistant", "content": f"Could you tell me about your {field.split('.')[1]}?"})
+        messages.append({"role": "user", "content": persona.reply([field])})
+    return {"id": transcript_id, "messages": messages}
+
+
+class SimulatedCompleter:
+    """
+        Stands in for StructuredChatCompleter with an LLM which extracts the persona's replies perfectly, see simulate_response()
+    """
+
+    def __init__(self, persona: Persona, latency: float = 0.0):
+        """
+            Parameters:
+                persona (Persona): the member whose replies are extracted
+                latency (float): seconds each completion takes
+        """
+        self.persona = persona
+        self.latency = latency
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def respond(self, messages: List[dict]) -> ProviderSearchAgentResponse:
+        return simulate_response(messages, self.persona.extract)
+
+    def complete_with_usage(self, messages: List[dict], response_model) -> Tuple[ProviderSearchAgentResponse, Usage]:
+        if self.latency:
+            time.sleep(self.latency)
+        response = self.respond(messages)
+        usage = Usage(estimate_message_tokens(messages), estimate_tokens(response.model_dump_json()))
+        self.calls += 1
+        self.prompt_tokens += usage.prompt_tokens
+        self.completion_tokens += usage.completion_tokens
+        return response, usage
+
+    def complete(self, messages: List[dict], response_model) -> ProviderSearchAgentResponse:
+        return self.complete_with_usage(messages, response_model)[0]
+
+
+def run_session(controller, persona: Persona, max_turns: int = 20, on_text: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    """
+        Runs a conversation like main.py until every field the persona answers is filled, or max_turns member replies
+
+        Parameters:
+            on_text (Callable[[str], None]): if given, responses are streamed to it
+
+        Returns:
+            the number of member turns, the seconds per turn, and whether the search state was completed
+    """
+    expected = [field for field in FIELDS if persona.answers[field][1] is not None]
+    turn_seconds = []
+    controller.get_next_assistant_response(on_text)
+    while len(turn_seconds) < max_turns and any(field_value(controller.search_input_state, field) is None for field in expected):
+        asked = [field for field in controller.agent.fields if field_value(controller.search_input_state, field) is None]
+        if not asked:
+            asked = [field for field in expected if field_value(controller.search_input_state, field) is None][:1]
+        controller.add_user_message(persona.reply(asked))
+        start = time.perf_counter()
+        controller.get_next_assistant_response(on_text)
+        turn_seconds.append(time.perf_counter() - start)
+    complete = all(field_value(controller.search_input_state, field) is not None for field in expected)
+    controller.end_session()
+    return {"turns": len(turn_seconds), "turn_seconds": turn_seconds, "complete": complete}
@@ -0,0 +1,84 @@
+import random
+from typing import Dict, List
+import numpy as np
+from matching import ENUM_COLUMNS, column_dtype
+from models import (
+    AppointmentType,
+    Gender,
+    Insurance,
+    Language,
+    MemberProfile,
+    Name,
+    ProviderInformation,
+    ProviderPreferences,
+    ProviderSearchInputState,
+    TherapyType,
+    TreatmentSpecialty,
+)
+
+FIRST_NAMES = ["Ana", "Ben", "Chen", "Dana", "Eli", "Fatima", "Gus", "Hana", "Ivan", "Jun", "Kim", "Luis"]
+LAST_NAMES = ["Garcia", "Nguyen", "Smith", "Khan", "Rossi", "Muller", "Ivanova", "Martin", "Lee", "Patel"]
+
+# Probability that a provider offers any given enum value, per column
+DENSITY = {
+    "specialties": 0.2,
+    "ages_treated": 0.5,
+    "insurance_accepted": 0.4,
+    "languages_spoken": 0.15,
+    "genders_treated": 0.8,
+    "appointment_types": 0.6,
+    "therapy_types": 0.4,
+}
+
+
+def random_columns(count: int, seed: int = 0) -> Dict[str, np.ndarray]:
+    """
+        Generates bitset columns for a synthetic roster without building ProviderInformation objects
+    """
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for name, enum_type in ENUM_COLUMNS.items():
+        dtype = column_dtype(enum_type)
+        bits = rng.random((count, len(enum_type))) < DENSITY[name]
+        # every provider offers at least one value in each column
+        bits[np.arange(count), rng.integers(0, len(enum_type), count)] = True
+        weights = (1 << np.arange(len(enum_type), dtype=np.uint64)).astype(dtype)
+        columns[name] = (bits.astype(dtype) * weights).sum(axis=1, dtype=dtype)
+    return columns
+
+
+def random_names(count: int, seed: int = 0) -> List[tuple]:
+    rng = random.Random(seed)
+    return [(rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)) for _ in range(count)]
+
+
+def random_providers(count: int, seed: int = 0) -> List[ProviderInformation]:
+    rng = random.Random(seed)
+
+    def sample(name, enum_type):
+        values = [value for value in enum_type if rng.random() < DENSITY[name]]
+        return values or [rng.choice(list(enum_type))]
+
+    return [
+        ProviderInformation(
+            name=Name(first=rng.choice(FIRST_NAMES), last=rng.choice(LAST_NAMES)),
+            **{name: sample(name, enum_type) for name, enum_type in ENUM_COLUMNS.items()},
+        )
+        for _ in range(count)
+    ]
+
+
+def random_search_state(rng: random.Random) -> ProviderSearchInputState:
+    return ProviderSearchInputState(
+        member_profile=MemberProfile(
+            gender=rng.choice(list(Gender)),
+            age=rng.randint(5, 80),
+            insurance=rng.choice(list(Insurance)),
+            language=rng.choice([Language.ENGLISH, Language.SPANISH, None]),
+        ),
+        provider_preferences=ProviderPreferences(
+            specialties=rng.sample(list(TreatmentSpecialty), rng.randint(1, 3)),
+            therapy_types=rng.sample(list(TherapyType), rng.randint(0, 2)) or None,
+            appointment_types=[rng.choice(list(AppointmentType))],
+        ),
+    )
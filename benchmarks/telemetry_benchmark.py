@@ -0,0 +1,93 @@
+"""
+    Measures the cost of the telemetry in ChatController and StructuredChatCompleter, and shows where a turn's time goes.
+
+    * the CPU time per turn of simulated sessions (no network) with telemetry disabled, enabled, and exporting a JSONL trace
+    * the cost of one span, disabled and enabled
+    * the mean time per turn in each span, for sessions against the local fake chat completions endpoint
+
+    From the project root directory:
+    > python3 -m benchmarks.telemetry_benchmark --sessions 20
+"""
+import argparse
+import os
+import tempfile
+import time
+from collections import defaultdict
+from openai import OpenAI
+from benchmarks.load_test import start_server
+from benchmarks.simulation import PERSONAS, SimulatedCompleter, run_session
+from controller import ChatController
+from structured_chat import StructuredChatCompleter
+from telemetry import DISABLED, JsonlSpanExporter, MemorySpanExporter, Telemetry
+
+
+def seconds_per_turn(sessions: int, make_telemetry) -> float:
+    turns = 0
+    start = time.perf_counter()
+    for _ in range(sessions):
+        for persona in PERSONAS:
+            telemetry = make_telemetry()
+            controller = ChatController(completer=SimulatedCompleter(persona), debug=False, telemetry=telemetry)
+            turns += run_session(controller, persona)["turns"] + 1
+    return (time.perf_counter() - start) / turns
+
+
+def seconds_per_span(telemetry: Telemetry, repeats: int = 100000) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        with telemetry.span("benchmark", agent="agent") as span:
+            span.set(tokens=1)
+    return (time.perf_counter() - start) / repeats
+
+
+def phase_breakdown(sessions: int, latency: float):
+    fake, port = start_server(["-m", "benchmarks.fake_openai", "--port", "0", "--latency", str(latency), "--responder", "rule"])
+    try:
+        exporter = MemorySpanExporter()
+        telemetry = Telemetry([exporter])
+        client = OpenAI(api_key="fake", base_url=f"http://127.0.0.1:{port}/v1", max_retries=0)
+        completer = StructuredChatCompleter(client=client, telemetry=telemetry)
+        for _ in range(sessions):
+            for persona in PERSONAS:
+                run_session(ChatController(completer=completer, debug=False, telemetry=telemetry), persona, on_text=lambda text: None)
+    finally:
+        fake.kill()
+        fake.wait()
+    totals = defaultdict(float)
+    for span in exporter.spans:
+        totals[span.name] += span.duration
+    turns = sum(1 for span in exporter.spans if span.name == "turn")
+    return {name: total / turns for name, total in totals.items()}, turns
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20, help="sessions per persona")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake completion latency in seconds")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        trace = os.path.join(directory, "trace.jsonl")
+        modes = [
+            ("disabled", lambda: DISABLED),
+            ("enabled", lambda: Telemetry()),
+            ("jsonl trace", lambda: Telemetry([JsonlSpanExporter(trace)])),
+        ]
+        print(f"{'telemetry':<12} {'CPU per turn':>14}")
+        baseline = None
+        for name, make_telemetry in modes:
+            # the best of three runs, to leave out warm up and scheduling noise
+            per_turn = min(seconds_per_turn(args.sessions, make_telemetry) for _ in range(3))
+            baseline = baseline or per_turn
+            print(f"{name:<12} {per_turn * 1e6:>11.0f}us {(per_turn - baseline) * 1e6:>+8.0f}us")
+
+    print(f"one span: disabled {seconds_per_span(DISABLED) * 1e9:.0f}ns, enabled {seconds_per_span(Telemetry()) * 1e6:.1f}us")
+
+    phases, turns = phase_breakdown(max(1, args.sessions // 4), args.latency)
+    print(f"mean time per turn by span, {turns} turns against the fake endpoint with {args.latency}s latency:")
+    for name, seconds in sorted(phases.items(), key=lambda item: -item[1]):
+        print(f"  {name:<14} {seconds * 1000:>8.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
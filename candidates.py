@@ -0,0 +1,133 @@
+from enum import Enum
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+from matching import DEFAULT_REQUIRED, ENUM_COLUMNS, ProviderIndex, bit_counts, search_criteria
+from models import ProviderSearchInputState
+
+# The roster column each ProviderSearchInputState field is matched against.  Provider gender preference
+# is not part of the roster, so it has none.
+FIELD_COLUMNS: Dict[str, str] = {
+    "member_profile.insurance": "insurance_accepted",
+    "member_profile.language": "languages_spoken",
+    "member_profile.gender": "genders_treated",
+    "member_profile.age": "ages_treated",
+    "provider_preferences.appointment_types": "appointment_types",
+    "provider_preferences.specialties": "specialties",
+    "provider_preferences.therapy_types": "therapy_types",
+}
+
+
+class CandidateSet:
+    """
+        This CandidateSet is the live set of providers matching a session's required criteria, kept up to date
+        as the search state changes one field at a time.  Each provider has a count of the criteria it fails, so
+        a changed criterion takes a pass over its own column rather than re-filtering every column, and a correction
+        can widen the set as well as narrow it.
+
+        Facet counts, the remaining candidates offering each value of a column, are computed when first asked for,
+        and then updated from the providers which entered or left the set, while those are fewer than the candidates.
+        Before any criterion they are the roster's own value counts, which sessions share.
+    """
+
+    def __init__(self, index: ProviderIndex, required: Sequence[str] = DEFAULT_REQUIRED):
+        """
+            Parameters:
+                index (ProviderIndex): the roster, shared by every session
+                required (Sequence[str]): the columns which must match, as in ProviderIndex.search()
+        """
+        self.index = index
+        self.required = tuple(required)
+        # column -> criterion mask, and the providers failing it
+        self.criteria: Dict[str, int] = {}
+        self.failed: Dict[str, np.ndarray] = {}
+        self.failures = np.zeros(len(index), dtype=np.uint8)
+        self.mask = np.ones(len(index), dtype=bool)
+        self.count = len(index)
+        self.facet_counts: Dict[str, np.ndarray] = {}
+        # criteria changed, and providers which entered or left the set, since the set was created
+        self.changes = 0
+        self.moved = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def update(self, input_state: ProviderSearchInputState) -> int:
+        """
+            Applies the required criteria of the search state which changed since the last update, and returns the count
+        """
+        criteria = {criterion.column: criterion.mask for criterion in search_criteria(input_state) if criterion.column in self.required}
+        for column in ENUM_COLUMNS:
+            if criteria.get(column) != self.criteria.get(column):
+                self.set_criterion(column, criteria.get(column))
+        return self.count
+
+    def set_criterion(self, column: str, mask: Optional[int]):
+        """
+            Sets the bitset criterion of a column, or removes it if mask is None
+        """
+        old = self.failed.pop(column, None)
+        self.criteria.pop(column, None)
+        new = None
+        if mask is not None:
+            new = (self.index.columns[column] & mask) == 0
+            self.criteria[column] = mask
+            self.failed[column] = new
+        if old is None and new is None:
+            return
+        if old is not None:
+            self.failures -= old.view(np.uint8)
+        if new is not None:
+            self.failures += new.view(np.uint8)
+        was, self.mask = self.mask, self.failures == 0
+        moved = was ^ self.mask
+        moves = int(np.count_nonzero(moved))
+        self.count = int(np.count_nonzero(self.mask))
+        self.changes += 1
+        self.moved += moves
+        if moves >= self.count:
+            # recounting the remaining candidates is cheaper
+            self.facet_counts.clear()
+        elif self.facet_counts:
+            entered, left = np.flatnonzero(moved & self.mask), np.flatnonzero(moved & was)
+            for name, counts in self.facet_counts.items():
+                values = self.index.columns[name]
+                counts += bit_counts(values[entered], len(counts)) - bit_counts(values[left], len(counts))
+
+    def positions(self) -> np.ndarray:
+        return np.flatnonzero(self.mask)
+
+    def facet_array(self, column: str) -> np.ndarray:
+        counts = self.facet_counts.get(column)
+        if counts is None:
+            if self.count == len(self.index):
+                counts = self.index.value_counts(column).copy()
+            else:
+                counts = bit_counts(self.index.columns[column][self.positions()], len(ENUM_COLUMNS[column]))
+            self.facet_counts[column] = counts
+        return counts
+
+    def facets(self, column: str) -> Dict[Enum, int]:
+        """
+            Returns the number of candidates offering each value of a column, for the values at least one offers
+        """
+        return {member: int(count) for member, count in zip(ENUM_COLUMNS[column], self.facet_array(column)) if count}
+
+    def narrows(self, column: str) -> bool:
+        """
+            Returns whether some answer for the column would remove candidates: some value is not offered by every candidate
+        """
+        return bool((self.facet_array(column) < self.count).any())
+
+    def question_matters(self, fields: Sequence[str], enough: int = 0) -> bool:
+        """
+            Returns whether asking about fields could change the result.  A question about a field which is not
+            a required column, such as specialties (which rank) or provider gender (which is not in the roster), always may.
+            A question about required columns does not once there are enough candidates or fewer, or when no answer
+            would remove a candidate.
+        """
+        columns: List[Optional[str]] = [FIELD_COLUMNS.get(field) for field in fields]
+        if not columns or any(column not in self.required for column in columns):
+            return True
+        if self.count <= enough:
+            return False
+        return any(self.narrows(column) for column in columns)
@@ -0,0 +1,244 @@
+import re
+import threading
+from collections import Counter
+from typing import TYPE_CHECKING, Any, Callable, Collection, Dict, Iterable, List, Optional, Tuple
+from fast_extract import FastPathExtractor, normalize
+from models import AgentGoalState, ProviderSearchAgentResponse, ProviderSearchInputState, TherapyType, TreatmentSpecialty
+from reason_match import SPECIALTY_PHRASES, THERAPY_TYPE_PHRASES, value_phrases
+from telemetry import DISABLED, Telemetry
+
+if TYPE_CHECKING:
+    # agents imports structured_chat, which imports this module
+    import agents
+
+# USD per million prompt, cached prompt and completion tokens
+MODEL_PRICES: Dict[str, Tuple[float, float, float]] = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+}
+
+
+def phrase_pattern(phrases: Iterable[str]) -> "re.Pattern":
+    """
+        Returns a pattern finding any of the phrases as whole words, or their plural
+    """
+    # the longest first, so a phrase is not cut short by another it starts with
+    alternatives = sorted({re.escape(phrase) for phrase in phrases}, key=len, reverse=True)
+    return re.compile(r"\b(?:" + "|".join(alternatives) + r")s?\b")
+
+
+# the specialty and therapy type names, and the reason matcher's curated phrases for them
+SPECIALTY_PATTERN = phrase_pattern(phrase for specialty in TreatmentSpecialty for phrase in value_phrases(specialty, SPECIALTY_PHRASES))
+THERAPY_TYPE_PATTERN = phrase_pattern(phrase for therapy_type in TherapyType for phrase in value_phrases(therapy_type, THERAPY_TYPE_PHRASES))
+# the words a member names each field with
+FIELD_TOPICS = {
+    "member_profile.gender": phrase_pattern(["gender"]),
+    "member_profile.age": phrase_pattern(["age"]),
+    "member_profile.insurance": phrase_pattern(["insurance", "insurer"]),
+    "member_profile.language": phrase_pattern(["language"]),
+    "provider_preferences.specialties": phrase_pattern(["specialty", "specialties"]),
+    "provider_preferences.therapy_types": phrase_pattern(["therapy type", "type of therapy", "kind of therapy"]),
+    "provider_preferences.gender": phrase_pattern(["gender"]),
+    "provider_preferences.appointment_types": phrase_pattern(["appointment", "appointment type"]),
+}
+# the phrases of the fast path's synonym tables, by field
+VALUE_PHRASES = {field: frozenset(table) for field, table in FastPathExtractor().tables.items()}
+# phrases which take back an earlier answer
+WITHDRAWAL_CUES = ("never mind", "nevermind", "forget", "scratch that", "doesn't matter", "does not matter", "don't care",
+                   "no preference", "rather not", "remove", "take back", "drop the")
+
+
+def completion_cost(model: str, usage) -> float:
+    """
+        Returns the price in USD of a completion's usage, or 0 for a model without a price or a cached result
+    """
+    if usage is None or model not in MODEL_PRICES:
+        return 0.0
+    prompt, cached, completion = MODEL_PRICES[model]
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None) or 0
+    return ((usage.prompt_tokens - cached_tokens) * prompt + cached_tokens * cached + usage.completion_tokens * completion) / 1e6
+
+
+def plain(text: str) -> str:
+    return " ".join(text.lower().replace("’", "'").replace("-", " ").replace("_", " ").split())
+
+
+def mentions_specialty(text: str) -> bool:
+    """
+        Returns whether a message names something a specialty treats, so a reason for the search was given
+    """
+    return SPECIALTY_PATTERN.search(plain(text)) is not None
+
+
+def mentions_value(text: str, fields: Iterable[str]) -> bool:
+    """
+        Returns whether a message names a value for one of the fields: a phrase of the fast path's synonym tables,
+        a number for the age, or a specialty or therapy type phrase.  A member who declines to answer names none.
+    """
+    words = normalize(text)
+    phrases = {" ".join(words[start:start + length]) for length in (1, 2, 3) for start in range(len(words) - length + 1)}
+    for field in fields:
+        if field == "member_profile.age":
+            found = any(word.isdigit() for word in words)
+        elif field == "provider_preferences.specialties":
+            found = mentions_specialty(text)
+        elif field == "provider_preferences.therapy_types":
+            # or by the problem it is for ("whatever works for panic")
+            found = THERAPY_TYPE_PATTERN.search(plain(text)) is not None or mentions_specialty(text)
+        else:
+            found = not phrases.isdisjoint(VALUE_PHRASES.get(field, ()))
+        if found:
+            return True
+    return False
+
+
+def withdraws(text: str, field: str, value: Any) -> bool:
+    """
+        Returns whether a message takes back the answer of a field: it has a withdrawal cue, and names the field or its value
+    """
+    text = plain(text)
+    if not any(cue in text for cue in WITHDRAWAL_CUES):
+        return False
+    names = phrase_pattern(plain(str(getattr(item, "value", item))) for item in (value if isinstance(value, list) else [value]))
+    return FIELD_TOPICS[field].search(text) is not None or names.search(text) is not None
+
+
+def state_fields(state: ProviderSearchInputState) -> Dict[str, object]:
+    return {
+        f"{section}.{name}": value
+        for section in ("member_profile", "provider_preferences")
+        for name, value in getattr(state, section)
+    }
+
+
+def consistency_problems(response: Optional[ProviderSearchAgentResponse], previous: ProviderSearchInputState,
+                         agent: "agents.ProviderSearchChatAgent", user_message: Optional[str], withdrawn: Collection[str] = ()) -> List[str]:
+    """
+        Returns the reasons a response can not be trusted, or an empty list.  The checks are local:
+        * refused - the model returned no response
+        * regressed:<field> - a field collected before the call is missing from the response, although it was not
+          cleared deliberately and the member did not take it back
+        * agent_state - COMPLETE while a field of the agent is still missing although the member named a value for it
+          (COMPLETE is the answer the agents are told to give when the member declines), or NO_MATCH while new values
+          were extracted for the agent's fields
+        * specialties - the member gave a reason for the search, but no specialties were extracted for it
+
+        Parameters:
+            response (ProviderSearchAgentResponse): the parsed response, None if the model refused
+            previous (ProviderSearchInputState): the search state sent with the request
+            agent (ProviderSearchChatAgent): the agent the request was built for
+            user_message (str): the member message the response answers, None at the start of the chat
+            withdrawn (Collection[str]): the fields the response cleared deliberately, with a null change of a delta response
+    """
+    if response is None:
+        return ["refused"]
+    problems = []
+    before, after = state_fields(previous), state_fields(response.provider_search_information)
+    for field, value in before.items():
+        if value not in (None, []) and after[field] in (None, []) and field not in withdrawn \
+                and not (user_message and withdraws(user_message, field, value)):
+            problems.append(f"regressed:{field}")
+    extracted = any(after[field] not in (None, []) and after[field] != before[field] for field in agent.fields)
+    missing = [field for field in agent.fields if after[field] in (None, [])]
+    if response.agent_state == AgentGoalState.COMPLETE and missing and user_message and mentions_value(user_message, missing):
+        problems.append("agent_state")
+    elif response.agent_state == AgentGoalState.NO_MATCH and extracted:
+        problems.append("agent_state")
+    if ("provider_preferences.specialties" in agent.fields and user_message and mentions_specialty(user_message)
+            and not after["provider_preferences.specialties"]):
+        problems.append("specialties")
+    return problems
+
+
+class CascadeStats:
+    """
+        Checked completions and escalations of a CascadePolicy, with the completions, cost and seconds spent by model.
+        escalation_rate is the fraction of checked completions sent again to the large model.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.completions = 0
+        self.escalations = 0
+        self.problems: Counter = Counter()
+        self.calls: Counter = Counter()
+        self.cost: Counter = Counter()
+        self.seconds: Counter = Counter()
+
+    @property
+    def escalation_rate(self) -> float:
+        return self.escalations / self.completions if self.completions else 0.0
+
+    @property
+    def total_cost(self) -> float:
+        return sum(self.cost.values())
+
+    def record(self, model: str, usage, seconds: float):
+        with self.lock:
+            self.calls[model] += 1
+            self.cost[model] += completion_cost(model, usage)
+            self.seconds[model] += seconds
+
+    def checked(self, problems: List[str]):
+        with self.lock:
+            self.completions += 1
+            if problems:
+                self.escalations += 1
+                self.problems.update(problem.split(":")[0] for problem in problems)
+
+
+class CascadePolicy:
+    """
+        This CascadePolicy sends each completion to a small model first, and sends it again to the large model
+        only if local checks of the small model's response fail.  Agents can be configured to use another model first,
+        and agents configured to use the large model are not checked.
+    """
+
+    def __init__(self, small: str = "gpt-4o-mini", large: str = "gpt-4o", agent_models: Optional[Dict[str, str]] = None):
+        """
+            Parameters:
+                small (str): the model tried first. Default is "gpt-4o-mini".
+                large (str): the model a response which fails its checks is escalated to. Default is "gpt-4o".
+                agent_models (Dict[str, str]): the model tried first for an agent, by agent class name. A batch of agents
+                    uses the large model if any of its agents does. Default is the small model for every agent.
+        """
+        self.small = small
+        self.large = large
+        self.agent_models = agent_models or {}
+        self.stats = CascadeStats()
+
+    def model_for(self, agent: "agents.ProviderSearchChatAgent") -> str:
+        models = [self.agent_models.get(name, self.small) for name in agent.name().split("+")]
+        if self.large in models:
+            return self.large
+        return models[0]
+
+    def checks(self, model: str) -> bool:
+        """
+            Returns whether the responses of model are checked: the large model's are used as they are
+        """
+        return model != self.large
+
+    def escalation(self, model: str, response, usage, seconds: float, check: Callable[..., List[str]],
+                   telemetry: Telemetry = DISABLED) -> Optional[str]:
+        """
+            Records a completion of model, and returns the model to send it again to: the large model if model is checked
+            and check finds problems with its response (None if the model refused), otherwise None
+        """
+        self.stats.record(model, usage, seconds)
+        if not self.checks(model):
+            return None
+        problems = check(response)
+        self.stats.checked(problems)
+        for problem in problems:
+            telemetry.count("escalations", model=model, problem=problem.split(":")[0])
+        return self.large if problems else None
+
+    def check(self, previous: ProviderSearchInputState, agent: "agents.ProviderSearchChatAgent",
+              user_message: Optional[str]) -> Callable[..., List[str]]:
+        """
+            Returns the consistency check of a completion for agent, sent with the search state previous.
+            It takes the response, and the fields the response cleared deliberately.
+        """
+        return lambda response, withdrawn=(): consistency_problems(response, previous, agent, user_message, withdrawn)
@@ -0,0 +1,240 @@
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pydantic import BaseModel
+from typing import Callable, Dict, List, Optional, Type
+
+
+@functools.lru_cache(maxsize=None)
+def schema_fingerprint(response_model: Type[BaseModel]) -> str:
+    """
+        Returns a stable hash of the JSON schema of a Pydantic model, computed once per model class
+    """
+    schema = json.dumps(response_model.model_json_schema(), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(schema.encode("utf-8")).hexdigest()
+
+
+def request_key(model: str, temperature: float, messages: List[dict], response_model: Type[BaseModel]) -> str:
+    """
+        Returns a content-addressed key for a structured completion request.
+        The key only depends on the request contents, not on dictionary ordering.
+    """
+    request = json.dumps(
+        {"model": model, "temperature": temperature, "messages": messages, "schema": schema_fingerprint(response_model)},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+
+class CacheStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.stores = 0
+
+    @property
+    def hits(self) -> int:
+        return self.memory_hits + self.disk_hits
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def increment(self, counter: str):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "hits": self.hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "stores": self.stores,
+            "hit_rate": self.hit_rate,
+        }
+
+
+class MemoryCache:
+    """
+        This MemoryCache is a bounded LRU of parsed Pydantic results with a time to live.
+        Results are copied on the way in and out, since callers modify the responses they are given.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = 3600, clock: Callable[[], float] = time.monotonic):
+        """
+            Parameters:
+                max_entries (int): the least recently used entry is evicted beyond this many entries
+                ttl (float): seconds an entry stays valid, or None for no expiry
+                clock (Callable): the time source, in seconds
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str, response_model: Type[BaseModel]) -> Optional[BaseModel]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if (expires is not None and expires <= self.clock()) or not isinstance(value, response_model):
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+        return value.model_copy(deep=True)
+
+    def put(self, key: str, value: BaseModel):
+        expires = self.clock() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            self.entries[key] = (expires, value.model_copy(deep=True))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class SqliteCache:
+    """
+        This SqliteCache stores parsed results as JSON in a sqlite file, so they survive restarts
+        and can be shared by processes on one machine.  The least recently used entries are
+        evicted when the stored JSON exceeds max_bytes.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024, ttl: Optional[float] = None, clock: Callable[[], float] = time.time):
+        """
+            Parameters:
+                path (str): the sqlite database file
+                max_bytes (int): the maximum total size of the stored JSON
+                ttl (float): seconds an entry stays valid, or None for no expiry
+                clock (Callable): the time source, in seconds since the epoch
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed)")
+        self.size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+
+    def get(self, key: str, response_model: Type[BaseModel]) -> Optional[BaseModel]:
+        now = self.clock()
+        with self.lock:
+            row = self.connection.execute("SELECT model, value, created FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            model, value, created = row
+            if model != response_model.__name__ or (self.ttl is not None and created + self.ttl <= now):
+                self._delete(key)
+                return None
+            self.connection.execute("UPDATE completions SET accessed = ? WHERE key = ?", (now, key))
+        return response_model.model_validate_json(value)
+
+    def put(self, key: str, value: BaseModel):
+        data = value.model_dump_json()
+        size = len(data.encode("utf-8"))
+        now = self.clock()
+        with self.lock:
+            self._delete(key)
+            self.connection.execute(
+                "INSERT INTO completions (key, model, value, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, type(value).__name__, data, size, now, now),
+            )
+            self.size += size
+            while self.size > self.max_bytes:
+                oldest = self.connection.execute("SELECT key FROM completions ORDER BY accessed LIMIT 1").fetchone()
+                if oldest is None:
+                    break
+                self._delete(oldest[0])
+
+    def _delete(self, key: str):
+        row = self.connection.execute("SELECT size FROM completions WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self.connection.execute("DELETE FROM completions WHERE key = ?", (key,))
+            self.size -= row[0]
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+
+class CompletionCache:
+    """
+        This CompletionCache looks up structured completion results by a hash of the request,
+        first in a memory tier and then in an optional disk tier.
+        Requests with a temperature above 0 are not cached unless cache_nondeterministic is set,
+        since repeating them is expected to give a different response.
+    """
+
+    def __init__(self, memory: Optional[MemoryCache] = None, disk: Optional[SqliteCache] = None, cache_nondeterministic: bool = False):
+        """
+            Parameters:
+                memory (MemoryCache): the memory tier. Default is a MemoryCache with default limits.
+                disk (SqliteCache): the optional disk tier. Default is None.
+                cache_nondeterministic (bool): also cache requests with a temperature above 0. Default is False.
+        """
+        self.memory = memory if memory is not None else MemoryCache()
+        self.disk = disk
+        self.cache_nondeterministic = cache_nondeterministic
+        self.stats = CacheStats()
+
+    def is_cacheable(self, temperature: float) -> bool:
+        return temperature == 0 or self.cache_nondeterministic
+
+    def lookup(self, model: str, temperature: float, messages: List[dict], response_model: Type[BaseModel]) -> Optional[BaseModel]:
+        """
+            Returns the cached result for the request, or None on a miss or when the request is not cacheable
+        """
+        if not self.is_cacheable(temperature):
+            self.stats.increment("bypassed")
+            return None
+        key = request_key(model, temperature, messages, response_model)
+        value = self.memory.get(key, response_model)
+        if value is not None:
+            self.stats.increment("memory_hits")
+            return value
+        if self.disk is not None:
+            value = self.disk.get(key, response_model)
+            if value is not None:
+                self.stats.increment("disk_hits")
+                self.memory.put(key, value)
+                return value
+        self.stats.increment("misses")
+        return None
+
+    def store(self, model: str, temperature: float, messages: List[dict], response_model: Type[BaseModel], value: Optional[BaseModel]):
+        if value is None or not self.is_cacheable(temperature):
+            return
+        key = request_key(model, temperature, messages, response_model)
+        self.memory.put(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+        self.stats.increment("stores")
@@ -1,11 +1,228 @@
 import agents
-from structured_chat import StructuredChatCompleter
-from models import ProviderSearchInputState, MemberProfile, ProviderPreferences, AgentGoalState, ProviderSearchAgentResponse
-from typing import Optional
+import asyncio
+import contextvars
+import inspect
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from candidates import CandidateSet
+from delta import apply_changes, field_value, full_response, state_changes, withdrawn_fields
+from fast_extract import FastPathExtractor, FastPathStats, apply_fields
+from history import ChatHistory
+from http_client import deadline
+from matching import ProviderIndex
+from structured_chat import AsyncStructuredChatCompleter, StructuredChatCompleter, show_text
+from telemetry import DISABLED, Telemetry
+from reason_match import ReasonMatcher, merged_values
+from models import ProviderSearchInputState, MemberProfile, ProviderPreferences, AgentGoalState, ProviderSearchAgentResponse, ProviderSearchAgentDeltaResponse
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple, Union
+
+
+# The instructions shared by every agent and every session.  Every request starts with them, followed by the
+# current agent's goal and constraints and then the search state, so the provider's prompt cache can reuse the prefix.
+PROMPT_PREFIX = inspect.cleandoc('''
+    You assist the user to find a mental health provider in the provider directory.
+    Your goal is to prompt the user to answer questions about themselves and their preferred provider
+    so you can populate fields in their member profile and in provider preferences.
+
+    You can ask one or two questions at a time.
+
+    <CONSTRAINTS>
+    MemberProfile must always be populated with a dictionary.
+    ProviderPreferences must always be populated with a dictionary.
+    MemberProfile and ProviderPreferences fields should be null or empty list if not specified by the user.
+
+    YOUR RESPONSE SHOULD NOT SAY "LASTLY" or "LAST" BECAUSE THIS IS NOT THE LAST QUESTION
+    </CONSTRAINTS>
+''')
+
+AGENT_PROMPT = '''{prefix}
+<GOAL>
+{goal}
+Note: you plan to collect additional information after you achieve this goal.
+</GOAL>
+<GOAL_CONSTRAINTS>
+{constraints}
+</GOAL_CONSTRAINTS>'''
+
+
+_agent_prompts: Dict[Hashable, str] = {}
+
+
+def agent_prompt(agent: agents.ProviderSearchChatAgent) -> str:
+    """
+        Returns the developer prompt of an agent: the shared prefix followed by the agent's goal and constraints.
+        It is built once per agent.prompt_key(), and is the same for every turn and session.
+    """
+    key = agent.prompt_key()
+    prompt = _agent_prompts.get(key)
+    if prompt is None:
+        prompt = AGENT_PROMPT.format(prefix=PROMPT_PREFIX, goal=inspect.cleandoc(agent.goal()), constraints=inspect.cleandoc(agent.constraints()))
+        _agent_prompts[key] = prompt
+    return prompt
+
+
+def batch_agent(batch: List[agents.ProviderSearchChatAgent]) -> agents.ProviderSearchChatAgent:
+    return batch[0] if len(batch) == 1 else agents.CompositeProviderSearchAgent(batch)
+
+
+class TokenUsage:
+    """
+        Token counts summed over completions.  cached_tokens is the part of prompt_tokens which the provider
+        read from its prompt cache.  Results from the completion cache have no usage and are not counted.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+
+    @property
+    def cached_fraction(self) -> float:
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def add(self, usage):
+        if usage is None:
+            return
+        self.calls += 1
+        self.prompt_tokens += usage.prompt_tokens
+        self.completion_tokens += usage.completion_tokens
+        details = getattr(usage, "prompt_tokens_details", None)
+        self.cached_tokens += getattr(details, "cached_tokens", None) or 0
+
+
+class SpeculationStats:
+    """
+        Counters for speculative next-agent completions.  A miss is a speculation for another agent than the one
+        selected next, and an unneeded speculation one discarded because the turn did not need a second agent;
+        only hits and misses count towards the hit rate.  Speculative completions which are not used still finish,
+        and their tokens are counted as wasted.
+    """
 
-class ChatController:
     def __init__(self):
-        self.completer = StructuredChatCompleter()
+        self.lock = threading.Lock()
+        self.launched = 0
+        self.hits = 0
+        self.misses = 0
+        self.unneeded = 0
+        self.wasted_prompt_tokens = 0
+        self.wasted_completion_tokens = 0
+
+    @property
+    def hit_rate(self) -> float:
+        decided = self.hits + self.misses
+        return self.hits / decided if decided else 0.0
+
+    def record_waste(self, usage):
+        if usage is None:
+            return
+        with self.lock:
+            self.wasted_prompt_tokens += usage.prompt_tokens
+            self.wasted_completion_tokens += usage.completion_tokens
+
+
+class Speculation:
+    """
+        A completion started for the agent predicted to be needed next, with the future or task running it
+        and the search state it was requested with.  The agent is identified by its prompt_key(), since batched
+        agents share a class.
+    """
+
+    def __init__(self, agent_key: Hashable, pending: Union[Future, asyncio.Task], state: ProviderSearchInputState):
+        self.agent_key = agent_key
+        self.pending = pending
+        self.state = state
+
+
+class HeldReply:
+    """
+        Passes the streamed reply of a turn's first completion on to on_text as it arrives, unless its agent_state
+        says COMPLETE, when the next agent is expected to write the turn's reply and the text is held back instead.
+        The response models put agent_state before the reply, so it is decoded before the first piece of text.
+    """
+
+    def __init__(self, on_text: Callable[[str], None]):
+        self.on_text = on_text
+        self.passing = False
+        self.shown = False
+        self.held: List[str] = []
+
+    def on_agent_state(self, value: str):
+        self.passing = value != AgentGoalState.COMPLETE.value
+
+    def __call__(self, text: str):
+        if not self.passing:
+            self.held.append(text)
+            return None
+        self.shown = True
+        return self.on_text(text)
+
+    def take(self) -> str:
+        """
+            Returns the text held back, and forgets it
+        """
+        text, self.held = "".join(self.held), []
+        return text
+
+
+class ChatController:
+    def __init__(self, completer: Optional[StructuredChatCompleter] = None, debug: bool = True, speculative: bool = False,
+                 history: Optional[ChatHistory] = None, fast_path: Optional[FastPathExtractor] = None, batch_size: int = 1,
+                 telemetry: Optional[Telemetry] = None, turn_timeout: Optional[float] = None, delta: bool = False,
+                 provider_index: Optional[ProviderIndex] = None, enough_candidates: int = 0,
+                 reason_matcher: Optional[ReasonMatcher] = None):
+        """
+            Parameters:
+                completer (StructuredChatCompleter): the completer to call agents with. Default is a new StructuredChatCompleter.
+                    If it has a CascadePolicy, each agent call is checked and escalated through complete_cascade(), and responses
+                    which may be escalated are shown whole once checked rather than streamed.
+                history (ChatHistory): the chat history, which moves older turns into a truncated transcript beyond its token budget. Default is a new ChatHistory.
+                debug (bool): print the extracted search state after each turn. Default is True.
+                speculative (bool): call the predicted next agent concurrently with the current agent, so a turn which
+                    moves to the next agent does not wait for a second completion in series. Default is False.
+                fast_path (FastPathExtractor): if given, a reply which is a single unambiguous value for the current agent's
+                    fields is applied to the search state locally, and the LLM is only called to ask the next question. Default is None.
+                batch_size (int): the most agents of the same batch group asked about in one turn. Default is 1, one agent per turn.
+                telemetry (Telemetry): records a span per turn, with spans for agent selection, prompt building and each agent call,
+                    and counts turns and LLM calls. Pass the same Telemetry to the completer for its completion spans. Default is disabled.
+                turn_timeout (float): the seconds every completion of a turn must finish within, retries included,
+                    or http_client.DeadlineExceeded is raised. Default is no deadline.
+                delta (bool): ask for ProviderSearchAgentDeltaResponse, only the fields which changed this turn, and apply it
+                    to the search state locally, instead of the model repeating the whole state. Default is False.
+                provider_index (ProviderIndex): if given, the session keeps a CandidateSet of the providers matching the search
+                    state, updated after every turn, and agents whose questions could not change it are skipped. Default is None.
+                enough_candidates (int): with provider_index, questions which only narrow the roster are skipped once this many
+                    providers or fewer match. Default is 0, only questions no answer of which would remove a provider.
+                reason_matcher (ReasonMatcher): if given, the specialties and therapy types most similar to the user's latest
+                    message are added to the agent's request as hints, and with its fill option, a reply every clause
+                    of which matches one confidently is applied locally like the fast path. Default is None.
+        """
+        self.completer = completer or StructuredChatCompleter()
+        # with a cascade, each agent call goes to the small model first, and is checked before it is used
+        self.cascade = getattr(self.completer, "cascade", None)
+        self.debug = debug
+        self.speculative = speculative
+        self.speculation: Optional[Speculation] = None
+        self.speculation_stats = SpeculationStats()
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.history = history or ChatHistory()
+        self.fast_path = fast_path
+        self.fast_path_stats = FastPathStats()
+        self.reason_matcher = reason_matcher
+        self.batch_size = batch_size
+        self.telemetry = telemetry or DISABLED
+        self.turn_timeout = turn_timeout
+        self.delta = delta
+        # the schema agents answer in; a delta response is merged into a ProviderSearchAgentResponse once it arrives
+        self.response_model = ProviderSearchAgentDeltaResponse if delta else ProviderSearchAgentResponse
+        self.candidates = CandidateSet(provider_index) if provider_index is not None else None
+        self.enough_candidates = enough_candidates
+        self.turns = 0
+        # token usage of the last turn, and of the whole session
+        self.turn_usage = TokenUsage()
+        self.usage = TokenUsage()
+        # the messages of the last completion request
         self.messages = [
             {"role": "developer", "content": "You are a helpful assistant."},
         ]
@@ -24,19 +241,57 @@ class ChatController:
             agents.MemberLanguangeProviderSearchAgent(),
             agents.MemberInsuranceProviderSearchAgent(),
         ]))
+        # timings of the last turn, in seconds
+        self.time_to_first_token: Optional[float] = None
+        self.turn_latency: Optional[float] = None
+        self.turn_start = 0.0
+        self.streamed = []
 
     def get_unused_agent(self) -> Optional[agents.ProviderSearchChatAgent]:
-        unused_agents = [agent for agent in self.unused_agents if agent.is_match(self.search_input_state)]
+        unused_agents = [agent for agent in self.unused_agents if agent.is_match(self.search_input_state) and self.worth_asking(agent)]
         if len(unused_agents) > 0:
-            self.agent = unused_agents.pop()
-            self.unused_agents.remove(self.agent)
+            batch = self.select_batch(unused_agents)
+            for agent in batch:
+                self.unused_agents.remove(agent)
+            self.agent = batch_agent(batch)
             return self.agent
         return None
 
+    def worth_asking(self, agent: agents.ProviderSearchChatAgent) -> bool:
+        """
+            Returns whether the agent's question could change the matching providers, always True without a provider index
+        """
+        if self.candidates is None:
+            return True
+        self.candidates.update(self.search_input_state)
+        return self.candidates.question_matters(agent.fields, self.enough_candidates)
+
+    def select_batch(self, candidates: List[agents.ProviderSearchChatAgent]) -> List[agents.ProviderSearchChatAgent]:
+        """
+            Returns the next agent from the matching unused agents, followed by up to batch_size - 1 more agents
+            of its batch group, in the order they would be selected
+        """
+        batch = [candidates[-1]]
+        if batch[0].batch_group is None:
+            return batch
+        for agent in reversed(candidates[:-1]):
+            if len(batch) >= self.batch_size:
+                break
+            if agent.batch_group == batch[0].batch_group:
+                batch.append(agent)
+        return batch
+
     def get_agent(self) -> agents.ProviderSearchChatAgent:
         if self.agent == None:
             self.agent = agents.GeneralProviderSearchAgent()
-        if self.agent_state == AgentGoalState.MATCHED and self.agent.is_match(self.search_input_state):
+        if isinstance(self.agent, agents.CompositeProviderSearchAgent):
+            # each batched agent is done independently, and the ones which still match are batched again, unless the
+            # batch is COMPLETE: its fields which are still unset are questions the member declined, and are not asked again
+            if self.agent_state != AgentGoalState.COMPLETE:
+                self.unused_agents.extend(reversed([agent for agent in self.agent.agents if agent.is_match(self.search_input_state)]))
+            if self.get_unused_agent() is None:
+                self.agent = agents.GeneralProviderSearchAgent()
+        elif self.agent_state == AgentGoalState.MATCHED and self.agent.is_match(self.search_input_state):
             pass
         elif self.get_unused_agent() is not None:
             pass
@@ -45,53 +300,448 @@ class ChatController:
         return self.agent
 
     def get_prompt(self) -> Optional[str]:
-        agent = self.get_agent()
-        return f'''
-                You assist the user to find a mental health provider in the provider directory.
-                Your goal is to prompt the user to answer questions about themselves and their preferred provider
-                so you can populate fields in their member profile and in provider preferences.
+        return self.get_agent_prompt(self.get_agent())
 
-                You can ask one or two questions at a time.
-    
-            <GOAL>
-                {agent.goal()}
-                Note: you plan to collect additional information after you achieve this goal.
-            </GOAL>
-            <CONSTRAINTS>
-                MemberProfile must always be populated with a dictionary.
-                ProviderPreferences must always be populated with a dictionary.
-                MemberProfile and ProviderPreferences fields should be null or empty list if not specified by the user.
-
-                YOUR RESPONSE SHOULD NOT SAY "LASTLY" or "LAST" BECAUSE THIS IS NOT THE LAST QUESTION
-                {agent.constraints()}
-            </CONSTRAINTS>
-        '''
-
-    def get_response_from_matching_agent(self) -> ProviderSearchAgentResponse:
-        prompt = self.get_prompt()
-        self.messages[0] = {"role": "developer", "content": prompt}
-        return self.completer.complete(self.messages, ProviderSearchAgentResponse)
-
-    def get_next_assistant_response(self) -> ProviderSearchAgentResponse:
-        # TODO - summarize chat history before input length exceeds max input token count
-        
-        # call the current agent to extract any new provider search information
-        response = self.get_response_from_matching_agent()
+    def get_agent_prompt(self, agent: agents.ProviderSearchChatAgent) -> str:
+        return agent_prompt(agent)
+
+    def get_state_prompt(self) -> str:
+        """
+            Returns the search state for the developer prompt.  It follows the agent's prompt, which does not change,
+            and it mostly changes when the agent does, so the prompt and the conversation after it stay a stable prefix.
+        """
+        if self.delta:
+            instruction = ("Return in provider_search_changes only the fields the user's latest message sets or changes, "
+                           "with a null value for an answer the user withdrew.")
+        else:
+            instruction = "Keep these values unless the user changes them."
+        return f'''<CURRENT_SEARCH_STATE>
+provider_search_information collected so far, omitting fields which are still null. {instruction}
+{self.search_input_state.model_dump_json(exclude_none=True)}
+</CURRENT_SEARCH_STATE>'''
+
+    def get_hint_prompt(self, agent: agents.ProviderSearchChatAgent) -> Optional[str]:
+        """
+            Returns the reason matcher's hints for the user's latest message, if the agent asks about the fields they are for
+        """
+        if self.reason_matcher is None or not self.history.messages or self.history.messages[-1]["role"] != "user":
+            return None
+        hints = self.reason_matcher.hints(self.history.messages[-1]["content"], agent.fields)
+        return None if hints is None else f"<REASON_HINTS>\n{hints}\n</REASON_HINTS>"
+
+    def get_agent_messages(self, agent: agents.ProviderSearchChatAgent) -> List[dict]:
+        messages = self.history.render(f"{self.get_agent_prompt(agent)}\n{self.get_state_prompt()}")
+        # the hints change with every message, so they follow the conversation rather than break its cached prefix
+        hints = self.get_hint_prompt(agent)
+        if hints is not None:
+            messages.append({"role": "developer", "content": hints})
+        return messages
+
+    def prepare_agent_call(self) -> agents.ProviderSearchChatAgent:
+        """
+            Selects the agent to call and builds its messages
+        """
+        with self.telemetry.span("select_agent"):
+            agent = self.get_agent()
+        with self.telemetry.span("build_prompt"):
+            self.messages = self.get_agent_messages(agent)
+        return agent
+
+    def get_response_from_matching_agent(self, on_text: Optional[Callable[[str], None]] = None, speculate: bool = False) -> ProviderSearchAgentResponse:
+        agent = self.prepare_agent_call()
+        state = self.search_input_state
+        with self.telemetry.span("agent_call", agent=agent.name()) as span:
+            speculation = self.take_speculation()
+            span.set(speculation_hit=speculation is not None)
+            if speculation is not None:
+                response, usages = speculation.pending.result()
+                self.record_usage(*usages)
+                response = self.rebase_speculation(response, speculation.state)
+                if on_text is not None:
+                    on_text(response.assistant_response)
+                return response
+            if speculate:
+                self.start_speculation()
+            if on_text is None or self.checked(agent):
+                response, usages = self.complete_agent(agent, self.messages, self.consistency_check(agent), state)
+                self.record_usage(*usages)
+                if on_text is not None:
+                    # a response which may be escalated is only shown once it passed its checks
+                    on_text(response.assistant_response)
+                return response
+            on_fields = {"agent_state": on_text.on_agent_state} if isinstance(on_text, HeldReply) else None
+            model = self.agent_model(agent)
+            stream = self.completer.complete_streaming(self.messages, self.response_model, "assistant_response", on_text, model,
+                                                       on_fields=on_fields)
+            self.record_usage(stream.usage)
+            return self.merge_response(stream.result, state)
+
+    def agent_model(self, agent: agents.ProviderSearchChatAgent) -> Optional[str]:
+        """
+            Returns the model the cascade sends the agent's calls to first, or None for the completer's model
+        """
+        return None if self.cascade is None else self.cascade.model_for(agent)
+
+    def checked(self, agent: agents.ProviderSearchChatAgent) -> bool:
+        """
+            Returns whether the cascade checks the agent's responses, which are then not streamed
+        """
+        return self.cascade is not None and self.cascade.checks(self.cascade.model_for(agent))
+
+    def consistency_check(self, agent: agents.ProviderSearchChatAgent) -> Optional[Callable]:
+        """
+            Returns the cascade's check of a response of the agent to the current search state and user message
+        """
+        if self.cascade is None:
+            return None
+        user_message = None
+        if self.history.messages and self.history.messages[-1]["role"] == "user":
+            user_message = self.history.messages[-1]["content"]
+        return self.cascade.check(self.search_input_state, agent, user_message)
+
+    def complete_agent(self, agent: agents.ProviderSearchChatAgent, messages: List[dict], check: Optional[Callable],
+                       state: ProviderSearchInputState) -> Tuple[ProviderSearchAgentResponse, list]:
+        """
+            Returns the agent's response to messages, sent with the search state, and the usage of each completion it took
+        """
+        if check is None:
+            response, usage = self.completer.complete_with_usage(messages, self.response_model)
+            return self.merge_response(response, state), [usage]
+        response, usages = self.completer.complete_cascade(messages, self.response_model, self.merged_check(check, state),
+                                                           self.agent_model(agent))
+        return self.merge_response(response, state), usages
+
+    def merge_response(self, response, state: ProviderSearchInputState) -> Optional[ProviderSearchAgentResponse]:
+        """
+            Returns the full-state response of a completion sent with the search state, applying a delta response to it
+        """
+        return full_response(response, state) if self.delta else response
+
+    def merged_check(self, check: Callable, state: ProviderSearchInputState) -> Callable:
+        if not self.delta:
+            return check
+        # a null change is a deliberate clear, which is not a regression
+        return lambda response: check(full_response(response, state), withdrawn_fields(response))
+
+    def record_usage(self, *usages):
+        for usage in usages:
+            self.turn_usage.add(usage)
+            self.usage.add(usage)
+
+    def get_next_assistant_response(self, on_text: Optional[Callable[[str], None]] = None) -> ProviderSearchAgentResponse:
+        """
+        Calls the matching agent(s) for the next assistant response.
+
+        Parameters:
+            on_text (Callable[[str], None]): if given, on_text is called with the text of the turn's reply as it arrives.
+                The first agent's reply is streamed unless the agent says COMPLETE; then it is held back, and the
+                second agent's reply is streamed instead, so only the final agent's text is shown and kept.  A first
+                reply which was shown is the turn's reply even if the agent's fields were answered, and the next
+                agent is selected on the next turn.
+
+        Returns:
+            ProviderSearchAgentResponse: the validated response, once the last completion has finished
+        """
+        on_stream_text = self.start_turn(on_text)
+        with deadline(self.turn_timeout), self.telemetry.span("turn") as span:
+            # a single unambiguous value is applied locally, and one completion asks the next question
+            resolved = self.resolve_locally()
+            if resolved is not None:
+                agent = self.agent
+                response = self.get_response_from_matching_agent(on_stream_text)
+                response = self.keep_resolved(response, resolved, agent)
+            else:
+                # call the current agent to extract any new provider search information
+                held = HeldReply(on_stream_text) if on_stream_text is not None else None
+                response = self.get_response_from_matching_agent(held, speculate=self.speculative)
+
+                # if the extracted state no longer matches the current agent, then find the next matching agent
+                if self.needs_next_agent(response) and not (held is not None and held.shown):
+                    response = self.get_response_from_matching_agent(on_stream_text)
+                elif held is not None and held.held:
+                    on_stream_text(held.take())
+                # a speculation which the second agent did not take was discarded when it was selected
+                self.discard_speculation(needed=False)
+            response = self.finish_turn(response)
+            self.record_turn(span, resolved is not None)
+        return response
+
+    def record_turn(self, span, fast_path: bool):
+        self.turns += 1
+        if not self.telemetry.enabled:
+            return
+        usage = self.turn_usage
+        span.set(agent=self.agent.name(), fast_path=fast_path, llm_calls=usage.calls, prompt_tokens=usage.prompt_tokens,
+                 cached_tokens=usage.cached_tokens, completion_tokens=usage.completion_tokens)
+        self.telemetry.count("turns", fast_path=fast_path)
+        self.telemetry.observe("llm_calls_per_turn", usage.calls)
+
+    def end_session(self):
+        """
+            Records the LLM calls and turns of the session, once the conversation is over, and stops the speculation thread
+        """
+        if self.executor is not None:
+            # a pending speculation finishes on its own, and its tokens are still counted as wasted
+            self.discard_speculation(needed=False)
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        self.telemetry.count("sessions")
+        self.telemetry.observe("llm_calls_per_session", self.usage.calls)
+        self.telemetry.observe("turns_per_session", self.turns)
+
+    def resolve_locally(self) -> Optional[Dict[str, Any]]:
+        """
+            Applies the last user message to the search state without a completion, if the fast path extractor
+            resolves it to a single value for one of the current agent's fields, or a filling reason matcher confidently
+            matches every clause of it to specialties or therapy types the current agent asks about, which are added to
+            the ones collected before
+
+            Returns:
+                the applied {field: value}, or None if the message has to be extracted by the LLM
+        """
+        if (self.fast_path is None and self.reason_matcher is None) or self.agent is None or not self.history.messages:
+            return None
+        message = self.history.messages[-1]
+        if message["role"] != "user":
+            return None
+        resolved = None
+        if self.fast_path is not None:
+            self.fast_path_stats.turns += 1
+            resolved = self.fast_path.extract(message["content"], self.agent.fields)
+            if resolved is not None:
+                self.fast_path_stats.resolved += 1
+        if resolved is None and self.reason_matcher is not None and self.reason_matcher.fill:
+            resolved = self.reason_matcher.extract(message["content"], self.agent.fields)
+            if resolved is not None:
+                resolved = {field: merged_values(field_value(self.search_input_state, field), values) for field, values in resolved.items()}
+        if resolved is None:
+            return None
+        self.search_input_state = apply_fields(self.search_input_state, resolved)
+        return resolved
+
+    def keep_resolved(self, response: ProviderSearchAgentResponse, resolved: Dict[str, Any],
+                      agent: agents.ProviderSearchChatAgent) -> ProviderSearchAgentResponse:
+        """
+            Keeps the locally resolved values in the response, in case the completion dropped them
+        """
+        response.provider_search_information = apply_fields(response.provider_search_information, resolved)
+        # without the fast path, moving on from an agent takes an extraction and a question completion
+        if not agent.is_match(response.provider_search_information):
+            self.fast_path_stats.llm_calls_saved += 1
+        return response
+
+    def predict_next_agent(self) -> Optional[agents.ProviderSearchChatAgent]:
+        """
+            Returns the unused agent get_agent() would choose if the current agent finished this turn
+        """
+        # the current agent's fields are expected to be answered, so agents asking about them will not match
+        answered = set(self.agent.fields) if self.agent is not None else set()
+        candidates = [
+            agent for agent in self.unused_agents
+            if agent.is_match(self.search_input_state) and not answered.intersection(agent.fields) and self.worth_asking(agent)
+        ]
+        if len(candidates) == 0:
+            return None
+        return batch_agent(self.select_batch(candidates))
+
+    def speculative_messages(self) -> Optional[tuple]:
+        """
+            Returns the predicted next agent and the messages to call it with, or None if there is nothing to predict
+        """
+        agent = self.predict_next_agent()
+        if agent is None:
+            return None
+        return agent, self.get_agent_messages(agent)
+
+    def start_speculation(self):
+        speculative = self.speculative_messages()
+        if speculative is None:
+            return
+        agent, messages = speculative
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="speculation")
+        # the speculative completion's spans belong to the turn which started it
+        pending = self.executor.submit(contextvars.copy_context().run, self.complete_agent, agent, messages, self.consistency_check(agent),
+                                       self.search_input_state)
+        self.speculation = Speculation(agent.prompt_key(), pending, self.search_input_state)
+        self.speculation_stats.launched += 1
+
+    def take_speculation(self) -> Optional[Speculation]:
+        """
+            Returns the pending speculation if it was started for the agent now selected, otherwise discards it
+        """
+        speculation = self.speculation
+        if speculation is None:
+            return None
+        if speculation.agent_key != self.agent.prompt_key():
+            self.discard_speculation()
+            return None
+        self.speculation = None
+        self.speculation_stats.hits += 1
+        return speculation
+
+    def rebase_speculation(self, response: Optional[ProviderSearchAgentResponse],
+                           state: ProviderSearchInputState) -> Optional[ProviderSearchAgentResponse]:
+        """
+            Applies the changes a speculative response made to the search state it was requested with onto the
+            current search state, so the fields the first agent of the turn extracted are kept, as they would be
+            by a second completion sent with them
+        """
+        if response is not None:
+            response.provider_search_information = apply_changes(self.search_input_state, state_changes(state, response.provider_search_information))
+        return response
+
+    def discard_speculation(self, needed: bool = True):
+        """
+            Discards the pending speculation: a miss if a second agent was needed but another one was selected,
+            otherwise unneeded
+        """
+        if self.speculation is None:
+            return
+        if needed:
+            self.speculation_stats.misses += 1
+        else:
+            self.speculation_stats.unneeded += 1
+
+        def record_waste(pending):
+            if not pending.cancelled() and pending.exception() is None:
+                for usage in pending.result()[1]:
+                    self.speculation_stats.record_waste(usage)
+        self.speculation.pending.add_done_callback(record_waste)
+        self.speculation = None
+
+    def start_turn(self, on_text: Optional[Callable[[str], None]]) -> Optional[Callable[[str], None]]:
+        """
+            Starts timing a turn, and wraps on_text to record the time to first token and the streamed text
+        """
+        start = time.perf_counter()
+        self.turn_start = start
+        self.streamed = []
+        self.time_to_first_token = None
+        self.turn_usage = TokenUsage()
+        if on_text is None:
+            return None
+
+        def on_stream_text(text: str):
+            if self.time_to_first_token is None:
+                self.time_to_first_token = time.perf_counter() - start
+            self.streamed.append(text)
+            return on_text(text)
+        return on_stream_text
+
+    def needs_next_agent(self, response: ProviderSearchAgentResponse) -> bool:
+        """
+            Applies the state and agent state of the first completion of a turn, and returns whether
+            a second completion from the next matching agent is needed
+        """
         self.search_input_state = response.provider_search_information
+        # a COMPLETE agent is not selected again for the second completion
+        self.agent_state = response.agent_state
+        return (not self.agent.is_match(self.search_input_state)) or response.agent_state == AgentGoalState.COMPLETE
+
+    def finish_turn(self, response: ProviderSearchAgentResponse) -> ProviderSearchAgentResponse:
+        if self.streamed:
+            response.assistant_response = "".join(self.streamed)
+        self.turn_latency = time.perf_counter() - self.turn_start
 
-        # if the extracted state no longer matches the current agent, then find the next matching agent
-        if (not self.agent.is_match(self.search_input_state)) or response.agent_state == AgentGoalState.COMPLETE:
-            response = self.get_response_from_matching_agent()
-    
         self.search_input_state = response.provider_search_information
         self.agent_state = response.agent_state
-        self.messages.append({"role": "assistant", "content": response.model_dump_json()})
-        # For debugging
-        print(response.provider_search_information.model_dump_json())
+        # the search state is sent in the prompt, so only the text of the response is kept in the history
+        self.history.add_assistant_message(response.assistant_response)
+        if self.candidates is not None:
+            with self.telemetry.span("update_candidates") as span:
+                span.set(candidates=self.candidates.update(self.search_input_state))
+        if self.debug:
+            print(response.provider_search_information.model_dump_json())
         if response.agent_state == AgentGoalState.COMPLETE and self.get_unused_agent is None:
             return response
         response.agent_state = AgentGoalState.MATCHED
         return response        
     
     def add_user_message(self, user_input: str):
-        self.messages.append({"role": "user", "content": user_input})
+        self.history.add_user_message(user_input)
+
+
+class AsyncChatController(ChatController):
+    """
+        The asyncio variant of ChatController.  Sessions should share one AsyncStructuredChatCompleter,
+        so they share its client and its bound on in-flight requests.
+    """
+
+    def __init__(self, completer: AsyncStructuredChatCompleter, debug: bool = False, speculative: bool = False,
+                 history: Optional[ChatHistory] = None, fast_path: Optional[FastPathExtractor] = None, batch_size: int = 1,
+                 telemetry: Optional[Telemetry] = None, turn_timeout: Optional[float] = None, delta: bool = False,
+                 provider_index: Optional[ProviderIndex] = None, enough_candidates: int = 0, reason_matcher: Optional[ReasonMatcher] = None):
+        super().__init__(completer, debug, speculative, history, fast_path=fast_path, batch_size=batch_size, telemetry=telemetry,
+                         turn_timeout=turn_timeout, delta=delta, provider_index=provider_index, enough_candidates=enough_candidates,
+                         reason_matcher=reason_matcher)
+
+    async def get_response_from_matching_agent(self, on_text: Optional[Callable[[str], None]] = None, speculate: bool = False) -> ProviderSearchAgentResponse:
+        agent = self.prepare_agent_call()
+        state = self.search_input_state
+        with self.telemetry.span("agent_call", agent=agent.name()) as span:
+            speculation = self.take_speculation()
+            span.set(speculation_hit=speculation is not None)
+            if speculation is not None:
+                response, usages = await speculation.pending
+                self.record_usage(*usages)
+                response = self.rebase_speculation(response, speculation.state)
+                if on_text is not None:
+                    await show_text(on_text, response.assistant_response)
+                return response
+            if speculate:
+                self.start_speculation()
+            if on_text is None or self.checked(agent):
+                response, usages = await self.complete_agent(agent, self.messages, self.consistency_check(agent), state)
+                self.record_usage(*usages)
+                if on_text is not None:
+                    await show_text(on_text, response.assistant_response)
+                return response
+            on_fields = {"agent_state": on_text.on_agent_state} if isinstance(on_text, HeldReply) else None
+            model = self.agent_model(agent)
+            stream = await self.completer.complete_streaming(self.messages, self.response_model, "assistant_response", on_text, model,
+                                                             on_fields=on_fields)
+            self.record_usage(stream.usage)
+            return self.merge_response(stream.result, state)
+
+    async def complete_agent(self, agent: agents.ProviderSearchChatAgent, messages: List[dict], check: Optional[Callable],
+                             state: ProviderSearchInputState) -> Tuple[ProviderSearchAgentResponse, list]:
+        if check is None:
+            response, usage = await self.completer.complete_with_usage(messages, self.response_model)
+            return self.merge_response(response, state), [usage]
+        response, usages = await self.completer.complete_cascade(messages, self.response_model, self.merged_check(check, state),
+                                                                 self.agent_model(agent))
+        return self.merge_response(response, state), usages
+
+    async def get_next_assistant_response(self, on_text: Optional[Callable[[str], None]] = None) -> ProviderSearchAgentResponse:
+        """
+        Calls the matching agent(s) for the next assistant response, like ChatController.get_next_assistant_response().
+        on_text may be a coroutine function, which is awaited for each piece of text.
+        """
+        on_stream_text = self.start_turn(on_text)
+        with deadline(self.turn_timeout), self.telemetry.span("turn") as span:
+            resolved = self.resolve_locally()
+            if resolved is not None:
+                agent = self.agent
+                response = await self.get_response_from_matching_agent(on_stream_text)
+                response = self.keep_resolved(response, resolved, agent)
+            else:
+                held = HeldReply(on_stream_text) if on_stream_text is not None else None
+                response = await self.get_response_from_matching_agent(held, speculate=self.speculative)
+                if self.needs_next_agent(response) and not (held is not None and held.shown):
+                    response = await self.get_response_from_matching_agent(on_stream_text)
+                elif held is not None and held.held:
+                    await show_text(on_stream_text, held.take())
+                self.discard_speculation(needed=False)
+            response = self.finish_turn(response)
+            self.record_turn(span, resolved is not None)
+        return response
+
+    def start_speculation(self):
+        speculative = self.speculative_messages()
+        if speculative is None:
+            return
+        agent, messages = speculative
+        pending = asyncio.ensure_future(self.complete_agent(agent, messages, self.consistency_check(agent), self.search_input_state))
+        self.speculation = Speculation(agent.prompt_key(), pending, self.search_input_state)
+        self.speculation_stats.launched += 1
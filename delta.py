@@ -0,0 +1,66 @@
+from typing import Any, List, Optional, get_args
+from fast_extract import apply_fields
+from models import ProviderSearchAgentDeltaResponse, ProviderSearchAgentResponse, ProviderSearchInputState, StateChange
+
+# "section.field" -> the change model of that field
+CHANGE_MODELS = {get_args(change.model_fields["field"].annotation)[0]: change for change in get_args(StateChange)}
+
+
+def field_value(state: ProviderSearchInputState, field: str) -> Any:
+    section, name = field.split(".")
+    return getattr(getattr(state, section), name)
+
+
+def apply_changes(state: ProviderSearchInputState, changes: List[StateChange]) -> ProviderSearchInputState:
+    """
+        Returns a copy of the search state with the changes applied.  A null value clears the field, and a list
+        replaces the whole list; an empty list is taken as no answer, since the prompt allows it for a field the user
+        did not answer.  Fields without a change keep their value.  A later change of the same field wins.
+    """
+    values = {change.field: change.value for change in changes if change.value != []}
+    return apply_fields(state, values) if values else state
+
+
+def state_changes(before: ProviderSearchInputState, after: ProviderSearchInputState) -> List[StateChange]:
+    """
+        Returns the changes which turn the search state before into after
+    """
+    changes = []
+    for field, model in CHANGE_MODELS.items():
+        old, new = field_value(before, field), field_value(after, field) or None
+        if new != (old or None):
+            changes.append(model(field=field, value=new))
+    return changes
+
+
+def withdrawn_fields(response: Optional[ProviderSearchAgentDeltaResponse]) -> List[str]:
+    """
+        Returns the fields a delta response cleared with a null change
+    """
+    if response is None:
+        return []
+    return [change.field for change in response.provider_search_changes if change.value is None]
+
+
+def full_response(response: Optional[ProviderSearchAgentDeltaResponse], state: ProviderSearchInputState) -> Optional[ProviderSearchAgentResponse]:
+    """
+        Returns the full-state response of a delta response to a request sent with the search state, or None if the model refused
+    """
+    if response is None:
+        return None
+    return ProviderSearchAgentResponse(
+        assistant_response=response.assistant_response,
+        provider_search_information=apply_changes(state, response.provider_search_changes),
+        agent_state=response.agent_state,
+    )
+
+
+def delta_response(response: ProviderSearchAgentResponse, state: ProviderSearchInputState) -> ProviderSearchAgentDeltaResponse:
+    """
+        Returns the delta response equivalent to a full-state response to a request sent with the search state
+    """
+    return ProviderSearchAgentDeltaResponse(
+        assistant_response=response.assistant_response,
+        provider_search_changes=state_changes(state, response.provider_search_information),
+        agent_state=response.agent_state,
+    )
@@ -0,0 +1,154 @@
+import re
+from enum import Enum
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+from models import AppointmentType, Gender, Insurance, Language, ProviderSearchInputState
+
+# Curated synonyms, in addition to each enum value spelled out in lowercase words
+INSURANCE_SYNONYMS = {
+    Insurance.NO_INSURANCE: ["none", "uninsured", "self pay", "cash"],
+    Insurance.AETNA: ["aetna"],
+    Insurance.UNITED_HEALTHCARE: ["united", "uhc", "united health", "united health care", "unitedhealthcare"],
+    Insurance.BLUE_CROSS: ["blue cross", "blue cross blue shield", "bcbs", "blue shield", "anthem"],
+    Insurance.CIGNA: ["cigna"],
+    Insurance.HUMANA: ["humana"],
+    Insurance.MEDICARE: ["medicare"],
+}
+LANGUAGE_SYNONYMS = {
+    Language.ARABIC: ["arabic"],
+    Language.SPANISH: ["spanish", "espanol", "español", "castellano"],
+    Language.ENGLISH: ["english"],
+    Language.FRENCH: ["french", "francais", "français"],
+    Language.ITALIAN: ["italian", "italiano"],
+    Language.GERMAN: ["german", "deutsch"],
+    Language.RUSSIAN: ["russian"],
+    Language.VIETNAMESE: ["vietnamese"],
+    Language.MANDORIN: ["mandarin", "mandarin chinese", "putonghua"],
+    Language.CANTONESE: ["cantonese"],
+    Language.HINDI: ["hindi"],
+}
+# No pronouns or single letters: once filler words are removed, "she is" or "it's him" would match them, and a reply
+# about someone else ("she said I should call") is not an answer
+GENDER_SYNONYMS = {
+    Gender.MALE: ["male", "man", "guy", "masculine"],
+    Gender.FEMALE: ["female", "woman", "lady", "feminine"],
+    Gender.OTHER: ["other", "non binary", "nonbinary", "nb", "genderqueer"],
+}
+APPOINTMENT_TYPE_SYNONYMS = {
+    AppointmentType.IN_PERSON: ["in person", "inperson", "office", "in the office", "in office", "face to face", "onsite"],
+    AppointmentType.ONLINE: ["online", "virtual", "virtually", "video", "telehealth", "telemedicine", "remote", "remotely", "zoom"],
+}
+
+# Words which carry no answer, removed before matching: "I have Aetna, please" matches like "aetna"
+FILLER_WORDS = {
+    "a", "an", "the", "i", "im", "i'm", "am", "is", "it", "its", "it's", "my", "have", "has", "got", "use", "speak",
+    "prefer", "would", "like", "want", "please", "thanks", "thank", "you", "yes", "yeah", "sure", "ok", "okay",
+    "just", "only", "be", "plan", "insurance", "language", "preferably", "preferred", "through", "with",
+    "years", "year", "old", "yrs", "yo", "age", "aged", "provider", "therapist", "appointment", "appointments",
+    "session", "sessions", "best", "fine", "great", "identify", "as", "one",
+}
+# Answers which mean more than one value, or a refusal, always go to the LLM.  A bare "no" declines to answer as often
+# as it means no insurance ("No thanks"), and "no insurance" normalizes to it, since "insurance" is a filler word.
+AMBIGUOUS_WORDS = {"or", "either", "both", "and", "not", "don't", "dont", "maybe", "but", "no", "nope", "nah"}
+
+_WORD = re.compile(r"[\w']+")
+
+
+def normalize(text: str) -> List[str]:
+    """
+        Returns the lowercase words of text which may carry an answer
+    """
+    return [word for word in _WORD.findall(text.lower().replace("-", " ")) if word not in FILLER_WORDS]
+
+
+def synonym_table(synonyms: Dict[Enum, Sequence[str]]) -> Dict[str, Enum]:
+    """
+        Builds a lookup from normalized phrase to enum value, including each enum value itself.
+        Phrases which would map to more than one value are left out, so they are never matched.
+    """
+    table: Dict[str, Enum] = {}
+    ambiguous = set()
+    for value, phrases in synonyms.items():
+        for phrase in [value.value.lower().replace("_", " "), *phrases]:
+            key = " ".join(normalize(phrase))
+            if key in table and table[key] != value:
+                ambiguous.add(key)
+            table[key] = value
+    for key in ambiguous:
+        del table[key]
+    return table
+
+
+class FastPathExtractor:
+    """
+        This FastPathExtractor resolves a user reply locally when it is a single unambiguous value
+        for one of the fields the current agent asked about, e.g. "Aetna", "Spanish", "female", "34" or "online".
+        Anything else returns None and is left to the LLM.
+    """
+
+    def __init__(self):
+        self.tables: Dict[str, Dict[str, Enum]] = {
+            "member_profile.insurance": synonym_table(INSURANCE_SYNONYMS),
+            "member_profile.language": synonym_table(LANGUAGE_SYNONYMS),
+            "member_profile.gender": synonym_table(GENDER_SYNONYMS),
+            "provider_preferences.gender": synonym_table(GENDER_SYNONYMS),
+            "provider_preferences.appointment_types": synonym_table(APPOINTMENT_TYPE_SYNONYMS),
+        }
+        self.list_fields = {"provider_preferences.appointment_types"}
+
+    def extract(self, text: str, fields: Iterable[str]) -> Optional[Dict[str, Any]]:
+        """
+            Returns {field: value} when the reply is exactly one value for exactly one of the fields, otherwise None
+
+            Parameters:
+                text (str): the user's reply
+                fields (Iterable[str]): the fields the reply is expected to answer, as in ProviderSearchChatAgent.fields
+        """
+        words = normalize(text)
+        if not words or len(words) > 4 or AMBIGUOUS_WORDS.intersection(words):
+            return None
+        phrase = " ".join(words)
+        matches = {}
+        for field in fields:
+            if field == "member_profile.age":
+                age = self.extract_age(words)
+                if age is not None:
+                    matches[field] = age
+                continue
+            table = self.tables.get(field)
+            if table is None or phrase not in table:
+                continue
+            value = table[phrase]
+            matches[field] = [value] if field in self.list_fields else value
+        if len(matches) != 1:
+            return None
+        return matches
+
+    def extract_age(self, words: List[str]) -> Optional[int]:
+        if len(words) != 1 or not words[0].isdigit():
+            return None
+        age = int(words[0])
+        return age if 1 <= age <= 120 else None
+
+
+def apply_fields(input_state: ProviderSearchInputState, values: Dict[str, Any]) -> ProviderSearchInputState:
+    """
+        Returns a copy of the search input state with the given "section.field" values set
+    """
+    sections = {}
+    for field, value in values.items():
+        section, name = field.split(".")
+        sections.setdefault(section, {})[name] = value
+    return input_state.model_copy(update={
+        section: getattr(input_state, section).model_copy(update=updates) for section, updates in sections.items()
+    })
+
+
+class FastPathStats:
+    def __init__(self):
+        self.turns = 0
+        self.resolved = 0
+        self.llm_calls_saved = 0
+
+    @property
+    def resolved_fraction(self) -> float:
+        return self.resolved / self.turns if self.turns else 0.0
@@ -0,0 +1,102 @@
+import math
+import re
+from typing import List, Optional
+
+# Per-message overhead of the chat format, in tokens
+MESSAGE_OVERHEAD_TOKENS = 4
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+        Estimates the number of model tokens in text without a tokenizer: each punctuation mark is a token,
+        and each word is a token per four characters
+    """
+    return sum(math.ceil(len(piece) / 4) for piece in _TOKEN_PATTERN.findall(text))
+
+
+def estimate_message_tokens(messages: List[dict]) -> int:
+    return sum(estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+
+class ChatHistory:
+    """
+        This ChatHistory holds the user messages and the assistant_response text of earlier turns.
+        When the turns exceed the token budget, the oldest messages are moved into a truncated transcript: a shortened
+        quote of each message, sent in the developer prompt along with the current search state.  It is not a summary;
+        once the transcript exceeds its own budget its oldest quotes are dropped, and the search state is what keeps
+        the information extracted from those turns.
+    """
+
+    def __init__(self, token_budget: int = 1500, keep_recent: int = 4, transcript_budget: int = 300, quote_characters: int = 160):
+        """
+            Parameters:
+                token_budget (int): the estimated tokens allowed for the transcript and the turns. Default is 1500.
+                keep_recent (int): the number of most recent messages which are never moved into the transcript. Default is 4.
+                transcript_budget (int): the estimated tokens allowed for the truncated transcript, at most half the token budget;
+                    its oldest quotes are dropped beyond it. Default is 300.
+                quote_characters (int): each message in the transcript is shortened to this many characters. Default is 160.
+        """
+        self.token_budget = token_budget
+        self.keep_recent = keep_recent
+        self.transcript_budget = min(transcript_budget, token_budget // 2)
+        self.quote_characters = quote_characters
+        self.messages: List[dict] = []
+        self.message_tokens: List[int] = []
+        self.transcript_lines: List[str] = []
+        self.transcript_tokens = 0
+
+    def add_user_message(self, content: str):
+        self.add({"role": "user", "content": content})
+
+    def add_assistant_message(self, content: str):
+        self.add({"role": "assistant", "content": content})
+
+    def add(self, message: dict):
+        self.messages.append(message)
+        self.message_tokens.append(estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS)
+        self.compact()
+
+    def tokens(self) -> int:
+        return self.transcript_tokens + sum(self.message_tokens)
+
+    def compact(self):
+        """
+            Moves the oldest messages into the truncated transcript until the history fits the token budget
+        """
+        while self.tokens() > self.token_budget and len(self.messages) > self.keep_recent:
+            message = self.messages.pop(0)
+            self.message_tokens.pop(0)
+            self.add_to_transcript(message)
+
+    def add_to_transcript(self, message: dict):
+        """
+            Adds a shortened quote of a message to the truncated transcript, and drops its oldest quotes beyond transcript_budget
+        """
+        content = " ".join(message["content"].split())
+        if len(content) > self.quote_characters:
+            content = content[:self.quote_characters].rsplit(" ", 1)[0] + "..."
+        speaker = "member" if message["role"] == "user" else "assistant"
+        line = f'- {speaker}: "{content}"'
+        self.transcript_lines.append(line)
+        self.transcript_tokens += estimate_tokens(line) + 1
+        while self.transcript_tokens > self.transcript_budget and len(self.transcript_lines) > 1:
+            self.transcript_tokens -= estimate_tokens(self.transcript_lines.pop(0)) + 1
+
+    def transcript(self) -> Optional[str]:
+        """
+            Returns the truncated transcript of older messages, or None if no message was moved into it
+        """
+        if not self.transcript_lines:
+            return None
+        return "\n".join(self.transcript_lines)
+
+    def render(self, developer_prompt: str) -> List[dict]:
+        """
+            Returns the messages for a completion: the developer prompt, followed by the truncated transcript
+            of older turns if there is one, followed by the recent turns
+        """
+        transcript = self.transcript()
+        if transcript is not None:
+            developer_prompt = f"{developer_prompt}\n<EARLIER_CONVERSATION>\n{transcript}\n</EARLIER_CONVERSATION>\n"
+        return [{"role": "developer", "content": developer_prompt}] + list(self.messages)
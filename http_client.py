@@ -0,0 +1,469 @@
+import asyncio
+import collections
+import contextlib
+import contextvars
+import functools
+import inspect
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from telemetry import DISABLED, Telemetry
+from typing import TYPE_CHECKING, Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+# openai takes longer to import than everything else before the first request, so it is imported when a client is built
+if TYPE_CHECKING:
+    import openai
+    from openai import AsyncOpenAI, OpenAI
+
+T = TypeVar("T")
+
+_deadline: contextvars.ContextVar = contextvars.ContextVar("deadline", default=None)
+
+
+@functools.lru_cache(maxsize=None)
+def retryable_errors() -> Tuple[type, ...]:
+    """
+        Returns the transient failures: connection errors and timeouts, 429 and 5xx responses
+    """
+    import openai
+    return openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError
+
+
+def once(function: Callable[..., T]) -> Callable[..., T]:
+    """
+        Calls function once per process, and returns its result to every later call: the arguments of the first call
+        configure the result.  Concurrent first calls wait for one result rather than each building their own.
+        A later call which passes an argument with another value than the first call's raises ValueError,
+        rather than silently returning a result which ignores it.
+    """
+    signature = inspect.signature(function)
+    lock = threading.Lock()
+    built: dict = {}
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        passed = signature.bind(*args, **kwargs)
+        with lock:
+            if "result" not in built:
+                arguments = signature.bind(*args, **kwargs)
+                arguments.apply_defaults()
+                built["arguments"] = arguments.arguments
+                built["result"] = function(*args, **kwargs)
+            conflicts = {name: value for name, value in passed.arguments.items() if built["arguments"][name] != value}
+            if conflicts:
+                raise ValueError(f"{function.__name__}() was already called with {built['arguments']}, not {conflicts}")
+            return built["result"]
+    wrapper.cache_clear = built.clear
+    return wrapper
+
+
+def client_options(max_connections: int, max_keepalive_connections: int, keepalive_expiry: float, connect_timeout: float) -> dict:
+    from openai import DEFAULT_CONNECTION_LIMITS, Timeout
+    # the httpx Limits class of the installed openai client
+    Limits = type(DEFAULT_CONNECTION_LIMITS)
+    return dict(
+        limits=Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections, keepalive_expiry=keepalive_expiry),
+        timeout=Timeout(600.0, connect=connect_timeout),
+    )
+
+
+@once
+def shared_client(max_connections: int = 100, max_keepalive_connections: int = 20, keepalive_expiry: float = 30.0,
+                  connect_timeout: float = 5.0) -> "OpenAI":
+    """
+        Returns the OpenAI client shared by every StructuredChatCompleter in the process, configured from the environment,
+        so every completer reuses the same pool of keep-alive connections.  The first call builds it with its limits;
+        later calls, like the completers', pass no limits and get the same client.  The client does not retry:
+        the completers retry through their RequestPolicy, within the deadline of the turn.
+
+        Parameters:
+            max_connections (int): the most connections open at once. Default is 100.
+            max_keepalive_connections (int): the most idle connections kept open. Default is 20.
+            keepalive_expiry (float): seconds an idle connection is kept open. Default is 30.
+            connect_timeout (float): seconds to wait for a new connection. Default is 5.
+
+        Raises:
+            ValueError: if the client was already built with other limits
+    """
+    from openai import DefaultHttpxClient, OpenAI
+    return OpenAI(max_retries=0, http_client=DefaultHttpxClient(
+        **client_options(max_connections, max_keepalive_connections, keepalive_expiry, connect_timeout)))
+
+
+@once
+def shared_async_client(max_connections: int = 100, max_keepalive_connections: int = 20, keepalive_expiry: float = 30.0,
+                        connect_timeout: float = 5.0) -> "AsyncOpenAI":
+    """
+        The asyncio variant of shared_client().  Its connections belong to the event loop which opened them,
+        so it is meant for processes which run one event loop, like session_server.py.
+    """
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+    return AsyncOpenAI(max_retries=0, http_client=DefaultAsyncHttpxClient(
+        **client_options(max_connections, max_keepalive_connections, keepalive_expiry, connect_timeout)))
+
+
+# set while no warm-up is in progress
+_warmed_up = threading.Event()
+_warmed_up.set()
+
+
+def warm_up(connect_timeout: float = 5.0) -> Optional[threading.Thread]:
+    """
+        Builds the shared client, importing openai, and starts a daemon thread which opens a keep-alive connection
+        to the API with a request listing the models, so the TCP connection and TLS session are ready in the pool
+        before the first completion.  The client is built in the calling thread, since importing openai holds the GIL
+        and would only slow down whatever runs alongside it; the handshakes are network round trips, which overlap
+        with the rest of startup.  It is best effort: if it fails, the first completion connects itself, and reports
+        any error.
+
+        Parameters:
+            connect_timeout (float): seconds allowed for the connection request. Default is 5.
+
+        Returns:
+            threading.Thread: the started thread, or None if the client could not be built
+    """
+    try:
+        client = shared_client()
+    except Exception:
+        return None
+    _warmed_up.clear()
+
+    def run():
+        try:
+            client.with_options(timeout=connect_timeout).models.list()
+        except Exception:
+            # an error response still leaves the connection open
+            pass
+        finally:
+            _warmed_up.set()
+
+    thread = threading.Thread(target=run, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def wait_for_warm_up(timeout: Optional[float] = None) -> bool:
+    """
+        Waits for a warm-up in progress, so the first completion reuses its connection rather than opening another,
+        and returns whether no warm-up is in progress any more
+    """
+    return _warmed_up.wait(timeout)
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+        Raised when a request cannot complete before the deadline of the current turn
+    """
+
+
+@contextlib.contextmanager
+def deadline(seconds: Optional[float]):
+    """
+        Requests sent within the block, in this thread or asyncio task or in the ones it starts with a copy of its
+        context, must complete within seconds.  A deadline within another deadline cannot extend it.
+        With seconds None the block has no deadline of its own.
+    """
+    if seconds is None:
+        yield
+        return
+    end = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(end if current is None else min(current, end))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """
+        Returns the seconds left before the current deadline, or None if there is no deadline
+    """
+    end = _deadline.get()
+    return None if end is None else end - time.monotonic()
+
+
+def retry_after(error: "openai.APIStatusError") -> Optional[float]:
+    """
+        Returns the seconds the API asked to wait before retrying, from the retry-after-ms or retry-after header
+    """
+    headers = error.response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+class LatencyTracker:
+    """
+        Keeps the latencies of the last window successful requests of each kind, to estimate their percentiles
+    """
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self.lock = threading.Lock()
+        self.latencies: Dict[str, Deque[float]] = {}
+
+    def record(self, kind: str, seconds: float):
+        with self.lock:
+            latencies = self.latencies.get(kind)
+            if latencies is None:
+                latencies = self.latencies[kind] = collections.deque(maxlen=self.window)
+            latencies.append(seconds)
+
+    def count(self, kind: str) -> int:
+        with self.lock:
+            return len(self.latencies.get(kind, ()))
+
+    def percentile(self, kind: str, fraction: float) -> Optional[float]:
+        with self.lock:
+            ordered = sorted(self.latencies.get(kind, ()))
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class RequestStats:
+    """
+        Counters of the requests sent through a RequestPolicy.  requests counts every attempt, hedges included.
+        The counters are incremented from the threads of concurrent requests, under the lock.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.deadline_exceeded = 0
+
+    @property
+    def hedge_win_rate(self) -> float:
+        return self.hedge_wins / self.hedges if self.hedges else 0.0
+
+    def increment(self, counter: str):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+
+class RequestPolicy:
+    """
+        This RequestPolicy sends a request with a timeout for each attempt, retries transient failures with
+        exponential backoff, and keeps every attempt within the deadline of the current turn (see deadline()).
+        With hedge, a request which has not answered after the hedge_percentile latency of recent requests of its kind
+        is sent again, and the first answer is used: the tail latency of one slow server instead costs a duplicate request.
+        Hedged requests of call() run in a pool of two threads per hedge_concurrency, one for the request and one for its
+        duplicate.  The slower of the two is not interrupted: it occupies its thread until it answers or times out, and
+        while every thread is busy, new hedged requests wait for one.  close() stops the pool.
+    """
+
+    def __init__(self, timeout: float = 60.0, max_retries: int = 2, backoff: float = 0.25, max_backoff: float = 4.0, hedge: bool = False,
+                 hedge_percentile: float = 0.95, hedge_min_samples: int = 20, hedge_min_delay: float = 0.05,
+                 hedge_concurrency: int = 16, telemetry: Optional[Telemetry] = None):
+        """
+            Parameters:
+                timeout (float): seconds allowed for each attempt, cut to the time left before the deadline. Default is 60.
+                max_retries (int): retries of a transient failure. Default is 2.
+                backoff (float): seconds before the first retry, doubled for each retry, unless the API asks for a wait. Default is 0.25.
+                max_backoff (float): the longest wait between retries. Default is 4.
+                hedge (bool): send a duplicate of a non-streamed request which is slower than usual. Default is False.
+                hedge_percentile (float): the latency percentile of recent requests after which the duplicate is sent. Default is 0.95.
+                hedge_min_samples (int): requests of a kind are not hedged until this many latencies are known. Default is 20.
+                hedge_min_delay (float): the shortest wait before a duplicate is sent. Default is 0.05 seconds.
+                hedge_concurrency (int): the hedged requests of call() in flight at once, each with a thread for the request
+                    and one for its duplicate. Default is 16.
+                telemetry (Telemetry): counts attempts, retries, timeouts and hedges, and observes request latency. Default is disabled.
+        """
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_concurrency = hedge_concurrency
+        self.telemetry = telemetry or DISABLED
+        self.latency = LatencyTracker()
+        self.stats = RequestStats()
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.executor_lock = threading.Lock()
+
+    def close(self):
+        """
+            Stops the threads of hedged requests.  Requests still running in them finish, and their responses are dropped.
+        """
+        with self.executor_lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+                self.executor = None
+
+    def hedge_executor(self) -> ThreadPoolExecutor:
+        with self.executor_lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=2 * self.hedge_concurrency, thread_name_prefix="hedge")
+            return self.executor
+
+    def attempt_timeout(self, kind: str) -> float:
+        """
+            Returns the timeout of the next attempt, or raises DeadlineExceeded if the deadline has passed
+        """
+        left = remaining()
+        if left is None:
+            return self.timeout
+        if left <= 0:
+            self.stats.increment("deadline_exceeded")
+            self.telemetry.count("deadline_exceeded", kind=kind)
+            raise DeadlineExceeded(f"the deadline passed before the {kind} request was sent")
+        return min(self.timeout, left)
+
+    def hedge_delay(self, kind: str, timeout: float) -> Optional[float]:
+        """
+            Returns the seconds to wait before a duplicate request, or None if the request should not be hedged
+        """
+        if not self.hedge or self.latency.count(kind) < self.hedge_min_samples:
+            return None
+        delay = max(self.hedge_min_delay, self.latency.percentile(kind, self.hedge_percentile))
+        return delay if delay < timeout else None
+
+    def retry_delay(self, error: Exception, attempt: int, kind: str) -> float:
+        """
+            Returns the seconds to wait before retrying after error, or raises it if it should not be retried
+        """
+        import openai
+        if isinstance(error, openai.APITimeoutError):
+            self.stats.increment("timeouts")
+            self.telemetry.count("request_timeouts", kind=kind)
+        if not isinstance(error, retryable_errors()) or attempt == self.max_retries:
+            raise error
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+        if isinstance(error, openai.RateLimitError):
+            delay = retry_after(error) or delay
+        left = remaining()
+        if left is not None and delay >= left:
+            self.stats.increment("deadline_exceeded")
+            self.telemetry.count("deadline_exceeded", kind=kind)
+            raise DeadlineExceeded(f"no time is left before the deadline to retry the {kind} request") from error
+        self.stats.increment("retries")
+        self.telemetry.count("request_retries", kind=kind)
+        return delay
+
+    def sent(self, kind: str, hedge: bool):
+        self.stats.increment("requests")
+        self.telemetry.count("requests", kind=kind, hedge=hedge)
+
+    def answered(self, kind: str, seconds: float):
+        self.latency.record(kind, seconds)
+        self.telemetry.observe("request_seconds", seconds, kind=kind)
+
+    def hedge_won(self, kind: str):
+        self.stats.increment("hedge_wins")
+        self.telemetry.count("hedge_wins", kind=kind)
+
+    def call(self, send: Callable[[float], T], kind: str = "completion", hedge: bool = True) -> T:
+        """
+            Calls send(timeout) until it returns, retrying transient failures.
+
+            Parameters:
+                send (Callable[[float], T]): sends the request with a timeout in seconds, and returns its response
+                kind (str): the kind of request, whose latencies decide when it is hedged
+                hedge (bool): False for requests which must not be sent twice, like streamed completions
+
+            Returns:
+                T: the response of the first attempt to succeed
+        """
+        attempt = 0
+        while True:
+            timeout = self.attempt_timeout(kind)
+            try:
+                return self.attempt(send, timeout, kind, self.hedge_delay(kind, timeout) if hedge else None)
+            except Exception as error:
+                delay = self.retry_delay(error, attempt, kind)
+            time.sleep(delay)
+            attempt += 1
+
+    def timed(self, send: Callable[[float], T], timeout: float, kind: str, hedge: bool) -> T:
+        self.sent(kind, hedge)
+        start = time.perf_counter()
+        response = send(timeout)
+        self.answered(kind, time.perf_counter() - start)
+        return response
+
+    def attempt(self, send: Callable[[float], T], timeout: float, kind: str, hedge_delay: Optional[float]) -> T:
+        if hedge_delay is None:
+            return self.timed(send, timeout, kind, False)
+        executor = self.hedge_executor()
+        primary = executor.submit(self.timed, send, timeout, kind, False)
+        done, _ = wait([primary], timeout=hedge_delay)
+        if done:
+            return primary.result()
+        self.stats.increment("hedges")
+        self.telemetry.count("hedges", kind=kind)
+        # the slower request is not interrupted, it finishes or times out in its thread, and its response is dropped
+        duplicate = executor.submit(self.timed, send, timeout - hedge_delay, kind, True)
+        pending = {primary, duplicate}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is duplicate:
+                        self.hedge_won(kind)
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    async def call_async(self, send: Callable[[float], Awaitable[T]], kind: str = "completion", hedge: bool = True) -> T:
+        """
+            The asyncio variant of call(), where send(timeout) returns an awaitable.  The slower of two hedged
+            requests is cancelled.
+        """
+        attempt = 0
+        while True:
+            timeout = self.attempt_timeout(kind)
+            try:
+                return await self.attempt_async(send, timeout, kind, self.hedge_delay(kind, timeout) if hedge else None)
+            except Exception as error:
+                delay = self.retry_delay(error, attempt, kind)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def timed_async(self, send: Callable[[float], Awaitable[T]], timeout: float, kind: str, hedge: bool) -> T:
+        self.sent(kind, hedge)
+        start = time.perf_counter()
+        response = await send(timeout)
+        self.answered(kind, time.perf_counter() - start)
+        return response
+
+    async def attempt_async(self, send: Callable[[float], Awaitable[T]], timeout: float, kind: str, hedge_delay: Optional[float]) -> T:
+        if hedge_delay is None:
+            return await self.timed_async(send, timeout, kind, False)
+        primary = asyncio.ensure_future(self.timed_async(send, timeout, kind, False))
+        pending = {primary}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=hedge_delay)
+            if done:
+                return primary.result()
+            self.stats.increment("hedges")
+            self.telemetry.count("hedges", kind=kind)
+            duplicate = asyncio.ensure_future(self.timed_async(send, timeout - hedge_delay, kind, True))
+            pending.add(duplicate)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is duplicate:
+                            self.hedge_won(kind)
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
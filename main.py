@@ -1,14 +1,103 @@
+import argparse
+import sys
+from http_client import RequestPolicy, shared_client, warm_up
+
+parser = argparse.ArgumentParser(description="Console provider search chat")
+parser.add_argument("--no-stream", action="store_true", help="wait for each complete response instead of streaming it")
+parser.add_argument("--timing", action="store_true", help="print time to first token, total latency and prompt tokens of each turn")
+parser.add_argument("--speculative", action="store_true", help="call the predicted next agent concurrently with the current agent")
+parser.add_argument("--no-fast-path", action="store_true", help="send every reply to the LLM, even a single unambiguous value")
+parser.add_argument("--batch-size", type=int, default=1, help="ask up to this many related questions in one turn")
+parser.add_argument("--trace", help="append the spans of every turn to this JSON lines file")
+parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics at http://127.0.0.1:PORT/metrics")
+parser.add_argument("--turn-timeout", type=float, help="seconds each turn's completions must finish within, retries included")
+parser.add_argument("--hedge", action="store_true", help="send a duplicate of a completion request slower than the recent p95")
+parser.add_argument("--delta", action="store_true", help="agents return only the changed fields, which are applied to the search state locally")
+parser.add_argument("--cascade", action="store_true", help="call the small model first, and the large model for responses which fail their checks")
+parser.add_argument("--small-model", default="gpt-4o-mini", help="the model the cascade tries first")
+parser.add_argument("--large-model", default="gpt-4o", help="the model the cascade escalates to")
+parser.add_argument("--agent-model", action="append", default=[], metavar="AGENT=MODEL",
+                    help="the model the cascade tries first for an agent class, such as GeneralProviderSearchAgent=gpt-4o")
+parser.add_argument("--roster", help="a roster compiled with roster.py, to show the matching providers after each turn")
+parser.add_argument("--enough-candidates", type=int, default=0, help="with --roster, stop asking questions which only narrow the roster once this many providers match")
+parser.add_argument("--no-reason-match", action="store_true", help="do not match specialty and therapy type replies locally, or hint them to the agent")
+parser.add_argument("--reason-fill", action="store_true", help="fill specialty and therapy type replies which match confidently without the LLM, instead of only hinting them")
+parser.add_argument("--reason-index", help="a reason index precomputed with reason_match.py, instead of building it at startup")
+parser.add_argument("--max-connections", type=int, help="the most connections to the API open at once (default 100)")
+parser.add_argument("--max-keepalive-connections", type=int, help="the most idle connections to the API kept open (default 20)")
+parser.add_argument("--keepalive-expiry", type=float, help="seconds an idle connection to the API is kept open (default 30)")
+parser.add_argument("--no-warm-up", action="store_true", help="do not connect to the API in the background while starting up")
+args = parser.parse_args()
+
+# the shared client is built with any connection limits given, before anything builds it with the defaults
+limits = {name: value for name, value in (("max_connections", args.max_connections), ("keepalive_expiry", args.keepalive_expiry),
+                                          ("max_keepalive_connections", args.max_keepalive_connections)) if value is not None}
+if limits:
+    shared_client(**limits)
+
+# then the connection to the API is opened on another thread while the rest starts up
+if not args.no_warm_up:
+    warm_up()
+
 from models import AgentGoalState
+from cascade import CascadePolicy
 from controller import ChatController
+from fast_extract import FastPathExtractor
+from reason_match import ReasonMatcher
+from roster import load_roster
+from structured_chat import StructuredChatCompleter
+from telemetry import JsonlSpanExporter, Telemetry, serve_metrics
+
+telemetry = None
+if args.trace or args.metrics_port:
+    telemetry = Telemetry([JsonlSpanExporter(args.trace)] if args.trace else [])
+    if args.metrics_port:
+        serve_metrics(telemetry, port=args.metrics_port)
+
+cascade = None
+if args.cascade:
+    cascade = CascadePolicy(small=args.small_model, large=args.large_model,
+                            agent_models=dict(agent_model.split("=", 1) for agent_model in args.agent_model))
+
+
+def print_text(text):
+    print(text, end="", flush=True)
+
 
-controller = ChatController()
+policy = RequestPolicy(hedge=args.hedge, telemetry=telemetry)
+controller = ChatController(
+    completer=StructuredChatCompleter(telemetry=telemetry, policy=policy, cascade=cascade),
+    speculative=args.speculative,
+    fast_path=None if args.no_fast_path else FastPathExtractor(),
+    batch_size=args.batch_size,
+    telemetry=telemetry,
+    turn_timeout=args.turn_timeout,
+    delta=args.delta,
+    provider_index=load_roster(args.roster) if args.roster else None,
+    enough_candidates=args.enough_candidates,
+    reason_matcher=None if args.no_reason_match else (
+        ReasonMatcher.load(args.reason_index, fill=args.reason_fill) if args.reason_index else ReasonMatcher(fill=args.reason_fill)),
+)
 agent_state = AgentGoalState.MATCHED
 while(agent_state == AgentGoalState.MATCHED):
-    response = controller.get_next_assistant_response()
     print()
-    print(response.assistant_response)
+    if args.no_stream:
+        controller.time_to_first_token = None
+        response = controller.get_next_assistant_response()
+        print(response.assistant_response)
+    else:
+        response = controller.get_next_assistant_response(on_text=print_text)
+        print()
     print()
+    if controller.candidates is not None:
+        print(f"{controller.candidates.count} providers match so far")
+    if args.timing:
+        first_token = "-" if controller.time_to_first_token is None else f"{controller.time_to_first_token:.2f}s"
+        usage = controller.turn_usage
+        print(f"[first token {first_token}, total {controller.turn_latency:.2f}s, prompt {usage.prompt_tokens} tokens, {usage.cached_tokens} cached]", file=sys.stderr)
     agent_state = response.agent_state
     if agent_state == AgentGoalState.MATCHED:
         user_input = input()
         controller.add_user_message(user_input)
+controller.end_session()
+policy.close()
@@ -0,0 +1,275 @@
+from enum import Enum
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple, Type
+import numpy as np
+from models import (
+    AppointmentType,
+    Gender,
+    Insurance,
+    Language,
+    Name,
+    ProviderInformation,
+    ProviderSearchInputState,
+    TherapyType,
+    TreatmentAge,
+    TreatmentSpecialty,
+)
+
+# Each enum-list field of ProviderInformation is stored as one packed bitset per provider.
+# Bit i is set when the provider lists the i-th member of the enum (in declaration order).
+ENUM_COLUMNS: Dict[str, Type[Enum]] = {
+    "specialties": TreatmentSpecialty,
+    "ages_treated": TreatmentAge,
+    "insurance_accepted": Insurance,
+    "languages_spoken": Language,
+    "genders_treated": Gender,
+    "appointment_types": AppointmentType,
+    "therapy_types": TherapyType,
+}
+
+# Criteria which are required by default; the rest only contribute to the ranking score
+DEFAULT_REQUIRED = ("insurance_accepted", "languages_spoken", "genders_treated", "ages_treated", "appointment_types")
+
+DEFAULT_WEIGHTS: Dict[str, float] = {
+    "specialties": 2.0,
+    "therapy_types": 1.0,
+    "insurance_accepted": 1.0,
+    "languages_spoken": 1.0,
+    "genders_treated": 1.0,
+    "ages_treated": 1.0,
+    "appointment_types": 1.0,
+}
+
+
+def column_dtype(enum_type: Type[Enum]) -> np.dtype:
+    """
+        Returns the smallest unsigned integer dtype with one bit per member of the enum
+    """
+    size = len(enum_type)
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if size <= np.dtype(dtype).itemsize * 8:
+            return np.dtype(dtype)
+    raise ValueError(f"{enum_type.__name__} has too many members for a bitset column")
+
+
+def enum_bits(enum_type: Type[Enum]) -> Dict[Enum, int]:
+    return {member: 1 << position for position, member in enumerate(enum_type)}
+
+
+_BITS = {name: enum_bits(enum_type) for name, enum_type in ENUM_COLUMNS.items()}
+_DTYPES = {name: column_dtype(enum_type) for name, enum_type in ENUM_COLUMNS.items()}
+
+
+def encode(field: str, values: Optional[Sequence[Enum]]) -> int:
+    """
+        Packs a list of enum values for a ProviderInformation field into a bitset
+    """
+    bits = _BITS[field]
+    mask = 0
+    for value in values or ():
+        mask |= bits[value]
+    return mask
+
+
+def decode(field: str, mask: int) -> List[Enum]:
+    """
+        Unpacks a bitset back into the list of enum values, in declaration order
+    """
+    mask = int(mask)
+    return [member for member, bit in _BITS[field].items() if mask & bit]
+
+
+def treatment_age(age: int) -> TreatmentAge:
+    """
+        Maps a member age in years to the TreatmentAge bucket providers list in ages_treated
+    """
+    if age < 4:
+        return TreatmentAge.TODDLER
+    if age < 13:
+        return TreatmentAge.CHILD
+    if age < 18:
+        return TreatmentAge.ADOLESCENT
+    if age < 65:
+        return TreatmentAge.ADULT
+    return TreatmentAge.ELDER
+
+
+if hasattr(np, "bitwise_count"):
+    popcount = np.bitwise_count
+else:
+    _POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def popcount(values: np.ndarray) -> np.ndarray:
+        values = np.ascontiguousarray(values)
+        counts = _POPCOUNT_TABLE[values.view(np.uint8)]
+        return counts.reshape(values.shape + (values.dtype.itemsize,)).sum(axis=-1, dtype=np.uint8)
+
+
+# the bits set in each byte value, least significant first
+_BYTE_BITS = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1, bitorder="little").astype(np.int64)
+
+
+def bit_counts(values: np.ndarray, size: int) -> np.ndarray:
+    """
+        Returns the number of bitsets in values with each of the first size bits set.  Each byte of the bitsets
+        is counted by value, and the 256 counts are turned into bit counts with a lookup table.
+    """
+    values = np.ascontiguousarray(values, dtype=values.dtype.newbyteorder("<"))
+    data = values.view(np.uint8).reshape(len(values), values.dtype.itemsize)
+    counts = np.concatenate([np.bincount(data[:, byte], minlength=256) @ _BYTE_BITS for byte in range(data.shape[1])])
+    return counts[:size]
+
+
+class Criterion(NamedTuple):
+    column: str
+    mask: int
+
+
+def search_criteria(input_state: ProviderSearchInputState) -> List[Criterion]:
+    """
+        Translates a ProviderSearchInputState into bitset criteria over the provider columns.
+        Values within a list field are OR-ed together; criteria are AND-ed when required.
+        Preferred provider gender is not part of the roster, so it is not a criterion.
+    """
+    member = input_state.member_profile
+    preferences = input_state.provider_preferences
+    criteria = []
+    if member.insurance is not None:
+        criteria.append(Criterion("insurance_accepted", encode("insurance_accepted", [member.insurance])))
+    if member.language is not None:
+        criteria.append(Criterion("languages_spoken", encode("languages_spoken", [member.language])))
+    if member.gender is not None:
+        criteria.append(Criterion("genders_treated", encode("genders_treated", [member.gender])))
+    if member.age is not None:
+        criteria.append(Criterion("ages_treated", encode("ages_treated", [treatment_age(member.age)])))
+    if preferences.appointment_types:
+        criteria.append(Criterion("appointment_types", encode("appointment_types", preferences.appointment_types)))
+    if preferences.specialties:
+        criteria.append(Criterion("specialties", encode("specialties", preferences.specialties)))
+    if preferences.therapy_types:
+        criteria.append(Criterion("therapy_types", encode("therapy_types", preferences.therapy_types)))
+    return criteria
+
+
+class ProviderMatch(NamedTuple):
+    position: int
+    score: float
+    provider: ProviderInformation
+
+
+class ProviderIndex:
+    """
+        This ProviderIndex holds the provider roster as packed bitset columns, one per enum-list field
+        of ProviderInformation, so a ProviderSearchInputState can be matched with vectorized bitwise operations.
+        ProviderInformation objects are only built for the providers which are returned.
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray], names: Sequence[Tuple[Optional[str], Optional[str]]]):
+        """
+            Parameters:
+                columns (Dict[str, np.ndarray]): a bitset array for each field in ENUM_COLUMNS, all the same length
+                names (Sequence): a (first, last) name pair for each provider, indexable by position
+        """
+        missing = set(ENUM_COLUMNS) - set(columns)
+        if missing:
+            raise ValueError(f"missing provider columns: {sorted(missing)}")
+        self.columns = {name: columns[name] for name in ENUM_COLUMNS}
+        self.size = len(names)
+        for name, column in self.columns.items():
+            if len(column) != self.size:
+                raise ValueError(f"column {name} has {len(column)} rows, expected {self.size}")
+        self.names = names
+        self._value_counts: Dict[str, np.ndarray] = {}
+
+    @classmethod
+    def from_providers(cls, providers: Sequence[ProviderInformation]) -> "ProviderIndex":
+        columns = {
+            name: np.fromiter(
+                (encode(name, getattr(provider, name)) for provider in providers),
+                dtype=_DTYPES[name],
+                count=len(providers),
+            )
+            for name in ENUM_COLUMNS
+        }
+        names = [(provider.name.first, provider.name.last) for provider in providers]
+        return cls(columns, names)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def provider(self, position: int) -> ProviderInformation:
+        """
+            Builds the ProviderInformation for the provider at the given position
+        """
+        first, last = self.names[position]
+        fields = {name: decode(name, column[position]) for name, column in self.columns.items()}
+        return ProviderInformation(name=Name(first=first, last=last), **fields)
+
+    def value_counts(self, column: str) -> np.ndarray:
+        """
+            Returns the number of providers offering each value of a column, in enum declaration order, counted once
+        """
+        counts = self._value_counts.get(column)
+        if counts is None:
+            counts = bit_counts(self.columns[column], len(ENUM_COLUMNS[column]))
+            self._value_counts[column] = counts
+        return counts
+
+    def filter(self, criteria: Sequence[Criterion]) -> np.ndarray:
+        """
+            Returns a boolean mask of the providers satisfying every criterion
+        """
+        mask = np.ones(self.size, dtype=bool)
+        for criterion in criteria:
+            mask &= (self.columns[criterion.column] & criterion.mask) != 0
+        return mask
+
+    def score(self, criteria: Sequence[Criterion], positions: np.ndarray, weights: Dict[str, float] = DEFAULT_WEIGHTS) -> np.ndarray:
+        """
+            Returns a score for each provider position: for every criterion, the weighted fraction
+            of the requested values the provider offers.
+        """
+        scores = np.zeros(len(positions), dtype=np.float32)
+        for criterion in criteria:
+            requested = bin(criterion.mask).count("1")
+            matched = popcount(self.columns[criterion.column][positions] & criterion.mask)
+            scores += np.float32(weights.get(criterion.column, 1.0) / requested) * matched
+        return scores
+
+    def search(
+        self,
+        input_state: ProviderSearchInputState,
+        k: int = 10,
+        required: Sequence[str] = DEFAULT_REQUIRED,
+        weights: Dict[str, float] = DEFAULT_WEIGHTS,
+    ) -> List[ProviderMatch]:
+        """
+            Returns the top k providers for the search input state.
+
+            Parameters:
+                input_state (ProviderSearchInputState): the member profile and provider preferences collected so far
+                k (int): the maximum number of matches to return
+                required (Sequence[str]): columns which must match; other columns only contribute to the score
+                weights (Dict[str, float]): score weight per column
+
+            Returns:
+                a list of ProviderMatch, best score first, ties broken by roster position
+        """
+        criteria = search_criteria(input_state)
+        hard = [criterion for criterion in criteria if criterion.column in required]
+        soft = [criterion for criterion in criteria if criterion.column not in required]
+        positions = np.flatnonzero(self.filter(hard)) if hard else np.arange(self.size)
+        if len(positions) == 0 or k <= 0:
+            return []
+        scores = self.score(soft, positions, weights)
+        if len(positions) > k:
+            # positions are ascending, so taking the first ties keeps the earliest roster entries
+            kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+            above = np.flatnonzero(scores > kth)
+            ties = np.flatnonzero(scores == kth)[: k - len(above)]
+            top = np.concatenate((above, ties))
+            positions, scores = positions[top], scores[top]
+        order = np.lexsort((positions, -scores))
+        return [
+            ProviderMatch(int(positions[i]), float(scores[i]), self.provider(int(positions[i])))
+            for i in order
+        ]
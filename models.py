@@ -1,6 +1,6 @@
 from enum import Enum
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import List, Literal, Optional, Union
 
 class TreatmentSpecialty(str, Enum):
     ADHD = "ADHD"
@@ -129,9 +129,88 @@ class AgentGoalState(str, Enum):
     MATCHED = "MATCHED"
     COMPLETE = "COMPLETE"
 
+# agent_state comes first in both response models, so the controller knows whether the reply is the turn's reply before it is streamed
 class ProviderSearchAgentResponse(BaseModel):
+    agent_state: AgentGoalState = Field(..., description="whether the user message is relevant to this agent, and if so, whether the goal is complete")
     assistant_response: str
     provider_search_information: ProviderSearchInputState = Field(..., description="all user responses relevant to provider search")
+    class Config:
+        extra = "forbid"  # This ensures additionalProperties is set to false
+
+
+
+class MemberGenderChange(BaseModel):
+    field: Literal["member_profile.gender"]
+    value: Optional[Gender] = Field(..., description="member gender, or null if the user withdrew it")
+    class Config:
+        extra = "forbid"  # This ensures additionalProperties is set to false
+
+
+class MemberAgeChange(BaseModel):
+    field: Literal["member_profile.age"]
+    value: Optional[int] = Field(..., description="member age in years, or null if the user withdrew it")
+    class Config:
+        extra = "forbid"  # This ensures additionalProperties is set to false
+
+
+class MemberInsuranceChange(BaseModel):
+    field: Literal["member_profile.insurance"]
+    value: Optional[Insurance] = Field(..., description="member's insurance, or null if the user withdrew it")
+    class Config:
+        extra = "forbid"  # This ensures additionalProperties is set to false
+
+
+class MemberLanguageChange(BaseModel):
+    field: Literal["member_profile.language"]
+    value: Optional[Language] = Field(..., description="member's preferred language, or null if the user withdrew it")
+    class Config:
+        extra = "forbid"  # This ensures additionalProperties is set to false
+
+
+class ProviderSpecialtiesChange(BaseModel):
+    field: Literal["provider_preferences.specialties"]
+    value: Optional[List[TreatmentSpecialty]] = Field(..., description="the complete list of treatment specialties, or null if the user withdrew it")
+    class Config:
+        extra = "forbid"  # This ensures additionalProperties is set to false
+
+
+class ProviderTherapyTypesChange(BaseModel):
+    field: Literal["provider_preferences.therapy_types"]
+    value: Optional[List[TherapyType]] = Field(..., description="the complete list of therapy types, or null if the user withdrew it")
+    class Config:
+        extra = "forbid"  # This ensures additionalProperties is set to false
+
+
+class ProviderGenderChange(BaseModel):
+    field: Literal["provider_preferences.gender"]
+    value: Optional[Gender] = Field(..., description="preference for provider gender, or null if the user withdrew it")
+    class Config:
+        extra = "forbid"  # This ensures additionalProperties is set to false
+
+
+class ProviderAppointmentTypesChange(BaseModel):
+    field: Literal["provider_preferences.appointment_types"]
+    value: Optional[List[AppointmentType]] = Field(..., description="the complete list of appointment types, or null if the user withdrew it")
+    class Config:
+        extra = "forbid"  # This ensures additionalProperties is set to false
+
+
+# A change of one ProviderSearchInputState field: its new value, or null to clear it
+StateChange = Union[
+    MemberGenderChange,
+    MemberAgeChange,
+    MemberInsuranceChange,
+    MemberLanguageChange,
+    ProviderSpecialtiesChange,
+    ProviderTherapyTypesChange,
+    ProviderGenderChange,
+    ProviderAppointmentTypesChange,
+]
+
+
+class ProviderSearchAgentDeltaResponse(BaseModel):
     agent_state: AgentGoalState = Field(..., description="whether the user message is relevant to this agent, and if so, whether the goal is complete")
+    assistant_response: str
+    provider_search_changes: List[StateChange] = Field(..., description="only the fields the user set, changed or withdrew in their latest message")
     class Config:
         extra = "forbid"  # This ensures additionalProperties is set to false
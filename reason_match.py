@@ -0,0 +1,388 @@
+"""
+    Local similarity matching of free-text reasons for seeking a provider to TreatmentSpecialty and TherapyType.
+
+    To precompute the index at build time, from the project root directory:
+    > python3 reason_match.py reason_index.npz
+"""
+import argparse
+import math
+import re
+from collections import Counter
+from enum import Enum
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Type
+import numpy as np
+from models import TherapyType, TreatmentSpecialty
+
+# Curated phrases, in addition to each enum value spelled out in lowercase words
+SPECIALTY_PHRASES: Dict[TreatmentSpecialty, List[str]] = {
+    TreatmentSpecialty.ADHD: [
+        "attention deficit", "hyperactivity", "can't focus", "cannot concentrate", "easily distracted",
+        "trouble paying attention", "restless and fidgety", "lose focus at work",
+    ],
+    TreatmentSpecialty.ANXIETY: [
+        "anxious", "always on edge", "constant worry", "worrying all the time", "nervous", "overthinking everything",
+        "social anxiety", "can't relax", "feel tense and uneasy",
+    ],
+    TreatmentSpecialty.AUTISM: [
+        "autistic", "on the spectrum", "asperger", "sensory overload", "struggle with social cues",
+    ],
+    TreatmentSpecialty.BIPOLAR: [
+        "bipolar disorder", "manic episodes", "mania", "mood swings between highs and lows", "manic depression",
+        "extreme highs and lows",
+    ],
+    TreatmentSpecialty.STRESS: [
+        "stressed out", "overwhelmed", "burnout", "burned out at work", "too much pressure", "work stress",
+        "stressful job",
+    ],
+    TreatmentSpecialty.BORDERLINE_PERSONALITY: [
+        "borderline personality disorder", "bpd", "unstable relationships", "fear of abandonment", "intense emotions",
+        "emotional dysregulation",
+    ],
+    TreatmentSpecialty.DEPRESSION: [
+        "depressed", "feeling down", "sad all the time", "hopeless", "no motivation", "lost interest in things",
+        "empty inside", "can't get out of bed", "feeling low",
+    ],
+    TreatmentSpecialty.INSOMNIA: [
+        "can't sleep", "cannot sleep", "trouble sleeping", "sleepless nights", "wake up at night", "sleep problems",
+        "awake all night", "can't fall asleep",
+    ],
+    TreatmentSpecialty.OCD: [
+        "obsessive compulsive disorder", "obsessive thoughts", "compulsions", "checking things over and over",
+        "intrusive thoughts", "counting rituals", "washing my hands constantly",
+    ],
+    TreatmentSpecialty.PTSD: [
+        "post traumatic stress", "trauma", "traumatic experience", "flashbacks", "nightmares about what happened",
+        "assault", "combat veteran", "abuse in my past",
+    ],
+    TreatmentSpecialty.PSYCHOSIS: [
+        "psychotic", "hearing voices", "hallucinations", "seeing things that are not there", "paranoid delusions",
+        "schizophrenia",
+    ],
+    TreatmentSpecialty.ADDICTION: [
+        "addicted", "substance abuse", "alcohol", "drinking too much", "drug use", "gambling", "sober", "relapse",
+        "recovery",
+    ],
+    TreatmentSpecialty.SELF_HARM: [
+        "hurting myself", "cutting", "self injury", "harming myself", "burning myself",
+    ],
+    TreatmentSpecialty.DEMENTIA: [
+        "alzheimer's", "memory loss", "forgetting things", "cognitive decline", "confused and forgetful",
+    ],
+    TreatmentSpecialty.DYSLEXIA: [
+        "trouble reading", "reading difficulties", "letters get mixed up", "learning disability", "spelling problems",
+    ],
+    TreatmentSpecialty.DIVORCE: [
+        "getting divorced", "separation", "divorcing", "custody", "ex husband", "ex wife", "splitting up",
+    ],
+    TreatmentSpecialty.PANIC_ATTACKS: [
+        "panic attack", "panic", "heart racing", "can't breathe", "sudden fear", "chest tightness",
+    ],
+    TreatmentSpecialty.EATING_DISORDER: [
+        "anorexia", "bulimia", "binge eating", "not eating", "body image", "purging", "obsessed with my weight",
+    ],
+    TreatmentSpecialty.MARRIAGE_COUNSELING: [
+        "marriage", "marriage problems", "marital problems", "spouse", "married couple",
+        "our relationship is falling apart",
+    ],
+    TreatmentSpecialty.LIFE_COACHING: [
+        "life coach", "career goals", "figure out my life", "personal growth", "find direction", "achieve my goals",
+        "motivation to change",
+    ],
+}
+THERAPY_TYPE_PHRASES: Dict[TherapyType, List[str]] = {
+    TherapyType.COGNITIVE_BEHAVIORAL: [
+        "cbt", "cognitive behavioral therapy", "cognitive therapy", "change my thinking patterns", "practical tools",
+        "skills and homework",
+    ],
+    TherapyType.FAMILY: [
+        "family therapy", "my kids", "my children", "my parents", "family conflict", "the whole family", "my son",
+        "my daughter",
+    ],
+    TherapyType.TRAUMA: [
+        "trauma therapy", "trauma focused", "emdr", "ptsd treatment", "process what happened",
+    ],
+    TherapyType.COUPLES: [
+        "couples therapy", "couples counseling", "together as a couple", "with my partner", "my partner and i",
+        "relationship counseling",
+    ],
+}
+# Values which are listed alongside another, since providers list either
+ALIASES: Dict[Enum, List[Enum]] = {
+    TreatmentSpecialty.BIPOLAR: [TreatmentSpecialty.BIPOLAR_DISORDER],
+}
+
+STOP_WORDS = {
+    "a", "an", "the", "i", "i'm", "im", "me", "my", "am", "is", "are", "be", "been", "have", "has", "had", "it", "its",
+    "it's", "to", "of", "for", "in", "on", "at", "so", "that", "this", "really", "very", "just", "feel", "feeling",
+    "lately", "like", "want", "need", "help", "with", "some", "someone", "about", "because", "since",
+}
+_WORD = re.compile(r"[\w']+")
+# Clauses of a reason, each of which may name a different specialty.  "and I" joins people rather than reasons.
+_CLAUSE = re.compile(r"[,;.!?]|\b(?:and(?!\s+i\b)|but|also|plus|or)\b")
+# Negations and hedges, which a similarity score can not tell apart from the value they deny ("I'm not anxious",
+# "I used to drink"), so a clause with one is never filled
+_NEGATION = re.compile(r"\b(?:not|no|never|nor|cannot|without|used\s+to)\b|n't\b")
+# Curated phrases which name a symptom with a negation ("can't sleep", "no motivation"), whose negation denies nothing
+_NEGATED_PHRASE = re.compile(r"\b(?:" + "|".join(sorted(
+    (re.escape(phrase) for table in (SPECIALTY_PHRASES, THERAPY_TYPE_PHRASES) for phrases in table.values()
+     for phrase in phrases if _NEGATION.search(phrase)), key=len, reverse=True)) + r")\b")
+
+
+def words(text: str) -> List[str]:
+    return [word for word in _WORD.findall(text.lower().replace("’", "'")) if word not in STOP_WORDS]
+
+
+def features(text: str) -> Counter:
+    """
+        Returns the counts of the word unigrams and bigrams, and of the character 3 to 5-grams of each word, of text
+    """
+    tokens = words(text)
+    grams = [f"w:{word}" for word in tokens]
+    grams += [f"b:{first} {second}" for first, second in zip(tokens, tokens[1:])]
+    for word in tokens:
+        padded = f" {word} "
+        grams += [f"c:{padded[start:start + size]}" for size in (3, 4, 5) for start in range(len(padded) - size + 1)]
+    return Counter(grams)
+
+
+def clauses(text: str) -> List[str]:
+    return [clause for clause in _CLAUSE.split(text) if words(clause)]
+
+
+def negated(clause: str) -> bool:
+    """
+        Returns whether a clause has a negation or hedge outside the curated phrases which contain one
+    """
+    return _NEGATION.search(_NEGATED_PHRASE.sub(" ", clause.lower().replace("’", "'"))) is not None
+
+
+def value_phrases(member: Enum, phrases: Dict[Enum, Sequence[str]]) -> List[str]:
+    """
+        Returns an enum value spelled out in lowercase words, followed by its curated phrases
+    """
+    return [member.value.lower().replace("_", " "), *phrases.get(member, ())]
+
+
+def add_value(values: List[Enum], value: Enum):
+    for value in [value, *ALIASES.get(value, ())]:
+        if value not in values:
+            values.append(value)
+
+
+def merged_values(collected: Optional[List[Enum]], values: List[Enum]) -> List[Enum]:
+    """
+        Returns the values collected before followed by the new ones, each once
+    """
+    merged = list(collected or [])
+    for value in values:
+        add_value(merged, value)
+    return merged
+
+
+class Candidate(NamedTuple):
+    value: Enum
+    score: float
+
+
+class SimilarityIndex:
+    """
+        This SimilarityIndex holds the TF-IDF vectors of curated phrases for the values of an enum, as a dense
+        feature x phrase matrix.  A text is scored against every phrase with one gather and one matrix-vector product,
+        and each value scores as its best matching phrase.
+    """
+
+    def __init__(self, enum_type: Type[Enum], vocabulary: Dict[str, int], idf: np.ndarray, matrix: np.ndarray, phrase_values: np.ndarray):
+        """
+            Parameters:
+                enum_type (Type[Enum]): the enum whose values are matched
+                vocabulary (Dict[str, int]): feature -> row of matrix
+                idf (np.ndarray): the inverse document frequency of each feature
+                matrix (np.ndarray): the L2-normalized TF-IDF vector of each phrase, one column per phrase
+                phrase_values (np.ndarray): the position in enum_type of each phrase's value, in ascending order
+        """
+        self.enum_type = enum_type
+        self.members = list(enum_type)
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.matrix = matrix
+        self.phrase_values = phrase_values
+        # the first phrase of each value, for the per-value maximum
+        self.values, self.starts = np.unique(phrase_values, return_index=True)
+
+    @classmethod
+    def build(cls, enum_type: Type[Enum], phrases: Dict[Enum, Sequence[str]]) -> "SimilarityIndex":
+        documents = []
+        for position, member in enumerate(enum_type):
+            for phrase in value_phrases(member, phrases):
+                documents.append((position, features(phrase)))
+        frequencies = Counter(feature for _, counts in documents for feature in counts)
+        vocabulary = {feature: row for row, feature in enumerate(sorted(frequencies))}
+        idf = np.array([math.log((1 + len(documents)) / (1 + frequencies[feature])) + 1 for feature in sorted(frequencies)], dtype=np.float32)
+        matrix = np.zeros((len(vocabulary), len(documents)), dtype=np.float32)
+        for column, (_, counts) in enumerate(documents):
+            for feature, count in counts.items():
+                matrix[vocabulary[feature], column] = (1 + math.log(count)) * idf[vocabulary[feature]]
+        matrix /= np.linalg.norm(matrix, axis=0, keepdims=True)
+        return cls(enum_type, vocabulary, idf, matrix, np.array([position for position, _ in documents], dtype=np.int32))
+
+    def scores(self, text: str) -> np.ndarray:
+        """
+            Returns the cosine similarity of text to the best phrase of each value with phrases, in the order of self.values
+        """
+        lookup = self.vocabulary.get
+        rows, counts = [], []
+        for feature, count in features(text).items():
+            row = lookup(feature)
+            if row is not None:
+                rows.append(row)
+                counts.append(count)
+        if not rows:
+            return np.zeros(len(self.values), dtype=np.float32)
+        weights = (1 + np.log(np.array(counts, dtype=np.float32))) * self.idf[rows]
+        similarities = weights @ self.matrix[rows] / np.sqrt(weights @ weights)
+        return np.maximum.reduceat(similarities, self.starts)
+
+    def rank(self, text: str, k: int = 3) -> List[Candidate]:
+        """
+            Returns the k values most similar to text, best first, scoring each clause of text on its own
+        """
+        parts = clauses(text)
+        if not parts:
+            return []
+        scores = np.max([self.scores(part) for part in parts], axis=0)
+        order = np.argsort(-scores, kind="stable")[:k]
+        return [Candidate(self.members[self.values[i]], float(scores[i])) for i in order if scores[i] > 0]
+
+    def best(self, clause: str) -> Candidate:
+        """
+            Returns the value most similar to a single clause
+        """
+        scores = self.scores(clause)
+        best = int(np.argmax(scores))
+        return Candidate(self.members[self.values[best]], float(scores[best]))
+
+    def match(self, text: str, threshold: float) -> Optional[List[Enum]]:
+        """
+            Returns the best value of each clause of text, if every clause has a value scoring at least threshold and
+            none is negated or hedged, otherwise None
+        """
+        matched: List[Enum] = []
+        for part in clauses(text):
+            if negated(part):
+                return None
+            candidate = self.best(part)
+            if candidate.score < threshold:
+                return None
+            add_value(matched, candidate.value)
+        return matched or None
+
+    def arrays(self, prefix: str) -> Dict[str, np.ndarray]:
+        features_by_row = sorted(self.vocabulary, key=self.vocabulary.get)
+        return {
+            f"{prefix}_members": np.array([member.value for member in self.members]),
+            f"{prefix}_features": np.array(features_by_row),
+            f"{prefix}_idf": self.idf,
+            f"{prefix}_matrix": self.matrix,
+            f"{prefix}_phrase_values": self.phrase_values,
+        }
+
+    @classmethod
+    def from_arrays(cls, enum_type: Type[Enum], arrays, prefix: str) -> "SimilarityIndex":
+        if arrays[f"{prefix}_members"].tolist() != [member.value for member in enum_type]:
+            raise ValueError(f"the index was built for other {enum_type.__name__} values, build it again")
+        vocabulary = {feature: row for row, feature in enumerate(arrays[f"{prefix}_features"].tolist())}
+        return cls(enum_type, vocabulary, arrays[f"{prefix}_idf"], arrays[f"{prefix}_matrix"], arrays[f"{prefix}_phrase_values"])
+
+
+class ReasonStats:
+    def __init__(self):
+        self.queries = 0
+        self.filled = 0
+
+
+class ReasonMatcher:
+    """
+        This ReasonMatcher maps a member's free-text reason to TreatmentSpecialty and TherapyType values with
+        a SimilarityIndex each.  Its candidates are hints for the agent prompt, and with fill, when every clause of
+        a reply matches above fill_threshold and none is negated or hedged, the values fill the fields directly.
+    """
+    FIELDS = {
+        "provider_preferences.specialties": "specialties",
+        "provider_preferences.therapy_types": "therapy_types",
+    }
+
+    def __init__(self, specialties: Optional[SimilarityIndex] = None, therapy_types: Optional[SimilarityIndex] = None,
+                 fill: bool = False, fill_threshold: float = 0.7, hint_threshold: float = 0.25):
+        """
+            Parameters:
+                specialties (SimilarityIndex): the TreatmentSpecialty index. Default is built from SPECIALTY_PHRASES.
+                therapy_types (SimilarityIndex): the TherapyType index. Default is built from THERAPY_TYPE_PHRASES.
+                fill (bool): whether the controller applies confident matches without the LLM. Default is hints only.
+                fill_threshold (float): the similarity every clause of a reply needs for its values to fill a field
+                hint_threshold (float): the similarity a candidate needs to be given to the agent as a hint
+        """
+        self.specialties = specialties or SimilarityIndex.build(TreatmentSpecialty, SPECIALTY_PHRASES)
+        self.therapy_types = therapy_types or SimilarityIndex.build(TherapyType, THERAPY_TYPE_PHRASES)
+        self.fill = fill
+        self.fill_threshold = fill_threshold
+        self.hint_threshold = hint_threshold
+        self.stats = ReasonStats()
+
+    def index(self, field: str) -> SimilarityIndex:
+        return getattr(self, self.FIELDS[field])
+
+    def hints(self, text: str, fields: Iterable[str]) -> Optional[str]:
+        """
+            Returns the likely values of the fields for a reply as prompt text, or None if there are none
+        """
+        lines = []
+        for field in fields:
+            if field not in self.FIELDS:
+                continue
+            candidates = [candidate for candidate in self.index(field).rank(text) if candidate.score >= self.hint_threshold]
+            if candidates:
+                lines.append(f"{field}: " + ", ".join(f"{candidate.value.value} {candidate.score:.2f}" for candidate in candidates))
+        if not lines:
+            return None
+        return "Likely values for the user's latest message, by similarity score. Use them only if they fit what the user said.\n" + "\n".join(lines)
+
+    def extract(self, text: str, fields: Iterable[str]) -> Optional[Dict[str, Any]]:
+        """
+            Returns {field: values} of the fields asked about, if every clause of the reply matches a value of one of them
+            at fill_threshold or above and none is negated or hedged, otherwise None.  Each clause goes to the field
+            whose value it is most similar to.
+        """
+        fields = [field for field in fields if field in self.FIELDS]
+        if not fields:
+            return None
+        self.stats.queries += 1
+        resolved: Dict[str, List[Enum]] = {}
+        for part in clauses(text):
+            if negated(part):
+                return None
+            field, candidate = max(((field, self.index(field).best(part)) for field in fields), key=lambda match: match[1].score)
+            if candidate.score < self.fill_threshold:
+                return None
+            add_value(resolved.setdefault(field, []), candidate.value)
+        if not resolved:
+            return None
+        self.stats.filled += 1
+        return resolved
+
+    def save(self, path: str):
+        np.savez(path, **self.specialties.arrays("specialties"), **self.therapy_types.arrays("therapy_types"))
+
+    @classmethod
+    def load(cls, path: str, **options) -> "ReasonMatcher":
+        """
+            Loads the indexes precomputed with save(), refusing them if the enums have changed since
+        """
+        with np.load(path) as arrays:
+            return cls(SimilarityIndex.from_arrays(TreatmentSpecialty, arrays, "specialties"),
+                       SimilarityIndex.from_arrays(TherapyType, arrays, "therapy_types"), **options)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute the reason similarity indexes")
+    parser.add_argument("output", help="the .npz file to write")
+    ReasonMatcher().save(parser.parse_args().output)
@@ -0,0 +1,168 @@
+"""
+    Compiles a provider roster into a compact columnar file which is memory-mapped read-only,
+    so every worker process shares one page-cached copy of the roster.
+
+    From the project root directory:
+    > python3 roster.py providers.jsonl roster.bin
+"""
+import argparse
+import json
+import mmap
+import struct
+from typing import Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+from matching import ENUM_COLUMNS, ProviderIndex, column_dtype, encode
+from models import ProviderInformation
+
+MAGIC = b"PSROSTR1"
+VERSION = 1
+ALIGNMENT = 8
+# bits of the name flags column recording whether first and last name are present
+FIRST_PRESENT = 1
+LAST_PRESENT = 2
+
+
+class StringTable:
+    """
+        This StringTable holds the (first, last) name of each provider as utf-8 strings in one buffer.
+        Names are decoded only when indexed.
+    """
+
+    def __init__(self, offsets: np.ndarray, data: memoryview, flags: np.ndarray):
+        """
+            Parameters:
+                offsets (np.ndarray): 2 * count + 1 offsets into data, first and last name interleaved
+                data (memoryview): the utf-8 encoded names
+                flags (np.ndarray): FIRST_PRESENT / LAST_PRESENT bits per provider, so None and "" can be told apart
+        """
+        self.offsets = offsets
+        self.data = data
+        self.flags = flags
+
+    def __len__(self) -> int:
+        return len(self.flags)
+
+    def _string(self, position: int) -> str:
+        start, end = int(self.offsets[position]), int(self.offsets[position + 1])
+        return str(self.data[start:end], "utf-8")
+
+    def __getitem__(self, position: int) -> Tuple[Optional[str], Optional[str]]:
+        if position < 0:
+            position += len(self)
+        flags = int(self.flags[position])
+        first = self._string(2 * position) if flags & FIRST_PRESENT else None
+        last = self._string(2 * position + 1) if flags & LAST_PRESENT else None
+        return first, last
+
+
+def _aligned(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def read_providers(path: str) -> Iterator[ProviderInformation]:
+    """
+        Reads ProviderInformation entries from a JSON array file or a JSONL file with one provider per line
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        first = f.read(1)
+        f.seek(0)
+        if first == "[":
+            for entry in json.load(f):
+                yield ProviderInformation.model_validate(entry)
+        else:
+            for line in f:
+                if line.strip():
+                    yield ProviderInformation.model_validate_json(line)
+
+
+def compile_roster(providers: Iterable[ProviderInformation], path: str) -> int:
+    """
+        Writes the providers to a columnar roster file
+
+        Parameters:
+            providers (Iterable[ProviderInformation]): the validated roster entries
+            path (str): the output file
+
+        Returns:
+            the number of providers written
+    """
+    codes = {name: [] for name in ENUM_COLUMNS}
+    flags: List[int] = []
+    strings: List[bytes] = []
+    for provider in providers:
+        for name in ENUM_COLUMNS:
+            codes[name].append(encode(name, getattr(provider, name)))
+        flags.append((FIRST_PRESENT if provider.name.first is not None else 0) |
+                     (LAST_PRESENT if provider.name.last is not None else 0))
+        strings.append((provider.name.first or "").encode("utf-8"))
+        strings.append((provider.name.last or "").encode("utf-8"))
+
+    count = len(flags)
+    offsets = np.zeros(2 * count + 1, dtype=np.uint64)
+    np.cumsum([len(s) for s in strings], out=offsets[1:])
+    sections = [(name, np.asarray(codes[name], dtype=column_dtype(enum_type))) for name, enum_type in ENUM_COLUMNS.items()]
+    sections.append(("name_flags", np.asarray(flags, dtype=np.uint8)))
+    sections.append(("name_offsets", offsets))
+    sections.append(("name_data", np.frombuffer(b"".join(strings), dtype=np.uint8)))
+
+    layout = {}
+    position = 0
+    for name, array in sections:
+        layout[name] = {"dtype": array.dtype.str, "offset": position, "length": len(array)}
+        position = _aligned(position + array.nbytes)
+    header = json.dumps({
+        "version": VERSION,
+        "count": count,
+        "enums": {name: [member.value for member in enum_type] for name, enum_type in ENUM_COLUMNS.items()},
+        "sections": layout,
+    }).encode("utf-8")
+    data_start = _aligned(len(MAGIC) + 4 + len(header))
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        for name, array in sections:
+            f.seek(data_start + layout[name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(data_start + position)
+    return count
+
+
+def load_roster(path: str) -> ProviderIndex:
+    """
+        Memory-maps a compiled roster file read-only and returns a ProviderIndex over it.
+        The columns are views onto the mapping, so nothing is copied or validated at load time.
+
+        Raises:
+            ValueError: if the file is not a roster, or was compiled against different enums
+    """
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if buffer[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a compiled provider roster")
+    (header_length,) = struct.unpack_from("<I", buffer, len(MAGIC))
+    header_start = len(MAGIC) + 4
+    header = json.loads(buffer[header_start:header_start + header_length])
+    if header["version"] != VERSION:
+        raise ValueError(f"{path} has roster version {header['version']}, expected {VERSION}")
+    for name, enum_type in ENUM_COLUMNS.items():
+        if header["enums"].get(name) != [member.value for member in enum_type]:
+            raise ValueError(f"{path} was compiled with different {enum_type.__name__} values, recompile the roster")
+    data_start = _aligned(header_start + header_length)
+
+    def section(name):
+        entry = header["sections"][name]
+        return np.frombuffer(buffer, dtype=np.dtype(entry["dtype"]), count=entry["length"], offset=data_start + entry["offset"])
+
+    names = StringTable(section("name_offsets"), memoryview(section("name_data")), section("name_flags"))
+    return ProviderIndex({name: section(name) for name in ENUM_COLUMNS}, names)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile a provider roster (JSON array or JSONL of ProviderInformation) into a columnar roster file")
+    parser.add_argument("source")
+    parser.add_argument("destination")
+    args = parser.parse_args()
+    written = compile_roster(read_providers(args.source), args.destination)
+    print(f"compiled {written} providers into {args.destination}")
@@ -0,0 +1,218 @@
+"""
+    A small HTTP server which multiplexes many chat sessions on one asyncio event loop,
+    streaming each assistant response to the client with server-sent events.
+
+    From the project root directory:
+    > python3 session_server.py --port 8080
+
+    POST /sessions                      creates a session and returns {"session_id": ...}
+    POST /sessions/{id}/turns           body {"message": "..."} (omit message for the opening turn),
+                                        responds with "text" events as assistant_response is generated,
+                                        then one "response" event with the full ProviderSearchAgentResponse
+    DELETE /sessions/{id}               ends a session
+    GET /metrics                        counters and histograms in the Prometheus text format, with --telemetry
+
+    With --store, every turn is appended to a SessionStore, and a session which is not in memory is resumed from it,
+    so sessions survive a restart and can move between server processes sharing the store.
+"""
+import argparse
+import asyncio
+import json
+import uuid
+from typing import Dict, Optional, Tuple
+from controller import AsyncChatController
+from http_client import RequestPolicy, shared_async_client
+from session_store import SessionStore
+from structured_chat import AsyncStructuredChatCompleter
+from telemetry import DISABLED, JsonlSpanExporter, Telemetry
+
+REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 429: "Too Many Requests", 503: "Service Unavailable"}
+
+
+async def read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+    """
+        Reads one HTTP/1.1 request, returning (method, path, headers, body), or None when the connection closed
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, value = line.decode("latin-1").split(":", 1)
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    body = await reader.readexactly(length) if length else b""
+    return method, path, headers, body
+
+
+def response_head(status: int, headers: Dict[str, str]) -> bytes:
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}"]
+    lines.extend(f"{name}: {value}" for name, value in headers.items())
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def json_response(status: int, payload: dict, keep_alive: bool = True) -> bytes:
+    body = json.dumps(payload).encode("utf-8")
+    return response_head(status, {
+        "Content-Type": "application/json",
+        "Content-Length": str(len(body)),
+        "Connection": "keep-alive" if keep_alive else "close",
+    }) + body
+
+
+def sse_event(event: str, data: str) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data) if event == 'text' else data}\n\n".encode("utf-8")
+
+
+class SessionServer:
+    """
+        This SessionServer holds one AsyncChatController per session.  All sessions share one
+        AsyncStructuredChatCompleter, and turns within a session run one at a time.
+    """
+
+    def __init__(self, completer: AsyncStructuredChatCompleter, max_sessions: int = 10000, telemetry: Optional[Telemetry] = None,
+                 store: Optional[SessionStore] = None, turn_timeout: Optional[float] = None):
+        self.completer = completer
+        self.max_sessions = max_sessions
+        self.telemetry = telemetry or DISABLED
+        self.turn_timeout = turn_timeout
+        self.store = store
+        self.sessions: Dict[str, AsyncChatController] = {}
+        self.locks: Dict[str, asyncio.Lock] = {}
+
+    def create_session(self) -> Optional[str]:
+        if len(self.sessions) >= self.max_sessions:
+            return None
+        session_id = uuid.uuid4().hex
+        self.sessions[session_id] = AsyncChatController(self.completer, telemetry=self.telemetry, turn_timeout=self.turn_timeout)
+        self.locks[session_id] = asyncio.Lock()
+        if self.store is not None:
+            self.store.create(session_id)
+        return session_id
+
+    def get_session(self, session_id: str) -> Optional[AsyncChatController]:
+        """
+            Returns the session's controller, resuming it from the store if it is not in memory
+        """
+        controller = self.sessions.get(session_id)
+        if controller is not None or self.store is None or len(self.sessions) >= self.max_sessions:
+            return controller
+        controller = self.store.rehydrate(session_id, AsyncChatController(self.completer, telemetry=self.telemetry, turn_timeout=self.turn_timeout))
+        if controller is not None:
+            self.sessions[session_id] = controller
+            self.locks[session_id] = asyncio.Lock()
+        return controller
+
+    def end_session(self, session_id: str) -> bool:
+        self.locks.pop(session_id, None)
+        controller = self.sessions.pop(session_id, None)
+        if self.store is not None:
+            self.store.delete(session_id)
+        if controller is None:
+            return False
+        controller.end_session()
+        return True
+
+    async def run_turn(self, session_id: str, message: Optional[str], writer: asyncio.StreamWriter):
+        controller = self.sessions[session_id]
+        async with self.locks[session_id]:
+            if message is not None:
+                controller.add_user_message(message)
+                if self.store is not None:
+                    self.store.append_user_message(session_id, message)
+            writer.write(response_head(200, {
+                "Content-Type": "text/event-stream",
+                "Cache-Control": "no-cache",
+                "Connection": "close",
+            }))
+
+            async def send_text(text: str):
+                writer.write(sse_event("text", text))
+                # waits for a slow client to read the event before the next piece of the completion is read
+                await writer.drain()
+            try:
+                response = await controller.get_next_assistant_response(on_text=send_text)
+                if self.store is not None:
+                    self.store.checkpoint_turn(session_id, controller)
+                writer.write(sse_event("response", response.model_dump_json()))
+            except Exception as e:
+                writer.write(sse_event("error", json.dumps({"error": str(e)})))
+            await writer.drain()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                parts = path.strip("/").split("/")
+                if parts == ["metrics"] and method == "GET" and self.telemetry.enabled:
+                    body = self.telemetry.prometheus_text().encode("utf-8")
+                    writer.write(response_head(200, {"Content-Type": "text/plain; version=0.0.4", "Content-Length": str(len(body))}) + body)
+                elif parts == ["sessions"] and method == "POST":
+                    session_id = self.create_session()
+                    if session_id is None:
+                        writer.write(json_response(503, {"error": "too many sessions"}))
+                    else:
+                        writer.write(json_response(201, {"session_id": session_id}))
+                elif len(parts) >= 2 and parts[0] == "sessions" and self.get_session(parts[1]) is None:
+                    writer.write(json_response(404, {"error": "unknown session"}))
+                elif len(parts) == 2 and method == "DELETE":
+                    self.end_session(parts[1])
+                    writer.write(json_response(200, {}))
+                elif len(parts) == 3 and parts[2] == "turns" and method == "POST":
+                    try:
+                        message = json.loads(body or b"{}").get("message")
+                    except ValueError:
+                        writer.write(json_response(400, {"error": "body must be JSON"}, keep_alive=False))
+                        break
+                    await self.run_turn(parts[1], message, writer)
+                    break
+                else:
+                    writer.write(json_response(404 if method in ("GET", "POST", "DELETE") else 405, {"error": "not found"}))
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int) -> asyncio.AbstractServer:
+        return await asyncio.start_server(self.handle, host, port, backlog=4096)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Serve provider search chat sessions over HTTP with server-sent events")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-concurrency", type=int, default=64, help="maximum completion requests in flight")
+    parser.add_argument("--max-sessions", type=int, default=10000)
+    parser.add_argument("--telemetry", action="store_true", help="record spans and metrics, served at GET /metrics")
+    parser.add_argument("--trace", help="append the spans of every turn to this JSON lines file (implies --telemetry)")
+    parser.add_argument("--store", help="the sqlite file to persist sessions in")
+    parser.add_argument("--turn-timeout", type=float, help="seconds each turn's completions must finish within, retries included")
+    parser.add_argument("--request-timeout", type=float, default=60.0, help="seconds allowed for each completion request")
+    parser.add_argument("--hedge", action="store_true", help="send a duplicate of a completion request slower than the recent p95")
+    args = parser.parse_args()
+    telemetry = None
+    if args.telemetry or args.trace:
+        telemetry = Telemetry([JsonlSpanExporter(args.trace)] if args.trace else [])
+    policy = RequestPolicy(timeout=args.request_timeout, hedge=args.hedge, telemetry=telemetry)
+    # one pooled connection for each completion request which may be in flight
+    client = shared_async_client(max_connections=args.max_concurrency, max_keepalive_connections=args.max_concurrency)
+    completer = AsyncStructuredChatCompleter(max_concurrency=args.max_concurrency, client=client, telemetry=telemetry, policy=policy)
+    store = SessionStore(args.store) if args.store else None
+    server = await SessionServer(completer, args.max_sessions, telemetry, store, args.turn_timeout).serve(args.host, args.port)
+    print(f"listening on port {server.sockets[0].getsockname()[1]}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
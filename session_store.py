@@ -0,0 +1,161 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Union
+import agents
+from models import AgentGoalState, ProviderSearchInputState
+
+# agents are stored by class name
+AGENT_CLASSES: Dict[str, type] = {
+    cls.__name__: cls for cls in vars(agents).values()
+    if isinstance(cls, type) and issubclass(cls, agents.ProviderSearchChatAgent)
+    and cls not in (agents.ProviderSearchChatAgent, agents.CompositeProviderSearchAgent)
+}
+
+
+def agent_spec(agent: Optional[agents.ProviderSearchChatAgent]) -> Union[None, str, List[str]]:
+    """
+        Returns the stored form of an agent: its class name, or the class names of a composite agent's agents
+    """
+    if agent is None:
+        return None
+    if isinstance(agent, agents.CompositeProviderSearchAgent):
+        return [type(batched).__name__ for batched in agent.agents]
+    return type(agent).__name__
+
+
+def agent_from_spec(spec: Union[None, str, List[str]]) -> Optional[agents.ProviderSearchChatAgent]:
+    if spec is None:
+        return None
+    if isinstance(spec, list):
+        return agents.CompositeProviderSearchAgent([AGENT_CLASSES[name]() for name in spec])
+    return AGENT_CLASSES[spec]()
+
+
+def dumps(data: dict) -> str:
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+class SessionStore:
+    """
+        This SessionStore persists ChatController sessions in sqlite as an append-only log of events, so a session
+        can be resumed by any worker process, or after a restart.  Each event is one row, and nothing is rewritten:
+        * user - a user message
+        * turn - the assistant's reply, the search state (without null fields), the current agent, the agent state
+          and the unused agents by class name, and the turn's token usage
+
+        The latest turn event holds all the state except the chat history, which is replayed from the messages.
+    """
+
+    def __init__(self, path: str, synchronous: str = "NORMAL", clock: Callable[[], float] = time.time):
+        """
+            Parameters:
+                path (str): the sqlite database file
+                synchronous (str): the sqlite synchronous setting. NORMAL may lose the last events on a power failure
+                    but not on a process crash; FULL syncs every event to disk. Default is NORMAL.
+                clock (Callable): the time source, in seconds since the epoch
+        """
+        self.path = path
+        self.clock = clock
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(f"PRAGMA synchronous={synchronous}")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS session_events ("
+            "session_id TEXT NOT NULL, seq INTEGER NOT NULL, kind TEXT NOT NULL, data TEXT NOT NULL, created REAL NOT NULL, "
+            "PRIMARY KEY (session_id, seq)) WITHOUT ROWID"
+        )
+
+    def create(self, session_id: Optional[str] = None) -> str:
+        session_id = session_id or uuid.uuid4().hex
+        self.append(session_id, "start", {})
+        return session_id
+
+    def append(self, session_id: str, kind: str, data: dict):
+        """
+            Appends one event to a session.  The sequence number is assigned in the same statement, so workers
+            appending to different sessions never conflict.
+        """
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO session_events (session_id, seq, kind, data, created) "
+                "SELECT ?, COALESCE(MAX(seq), 0) + 1, ?, ?, ? FROM session_events WHERE session_id = ?",
+                (session_id, kind, dumps(data), self.clock(), session_id),
+            )
+
+    def append_user_message(self, session_id: str, content: str):
+        self.append(session_id, "user", {"content": content})
+
+    def checkpoint_turn(self, session_id: str, controller):
+        """
+            Appends the state of a controller after its get_next_assistant_response()
+        """
+        usage = controller.turn_usage
+        self.append(session_id, "turn", {
+            "assistant": controller.history.messages[-1]["content"] if controller.history.messages else "",
+            "state": json.loads(controller.search_input_state.model_dump_json(exclude_none=True)),
+            "agent": agent_spec(controller.agent),
+            "agent_state": controller.agent_state.value,
+            "unused": [agent_spec(agent) for agent in controller.unused_agents],
+            "usage": [usage.calls, usage.prompt_tokens, usage.cached_tokens, usage.completion_tokens],
+        })
+
+    def events(self, session_id: str) -> List[tuple]:
+        with self.lock:
+            return self.connection.execute(
+                "SELECT kind, data FROM session_events WHERE session_id = ? ORDER BY seq", (session_id,)
+            ).fetchall()
+
+    def rehydrate(self, session_id: str, controller):
+        """
+            Restores a stored session into a new controller, which brings its own completer and settings
+
+            Returns:
+                the controller, or None if the session is not stored
+        """
+        events = self.events(session_id)
+        if not events:
+            return None
+        last_turn = None
+        for kind, data in events:
+            if kind == "user":
+                controller.history.add_user_message(json.loads(data)["content"])
+            elif kind == "turn":
+                last_turn = json.loads(data)
+                controller.history.add_assistant_message(last_turn["assistant"])
+                controller.turns += 1
+                calls, prompt_tokens, cached_tokens, completion_tokens = last_turn["usage"]
+                controller.usage.calls += calls
+                controller.usage.prompt_tokens += prompt_tokens
+                controller.usage.cached_tokens += cached_tokens
+                controller.usage.completion_tokens += completion_tokens
+        if last_turn is not None:
+            controller.search_input_state = ProviderSearchInputState.model_validate(last_turn["state"])
+            controller.agent = agent_from_spec(last_turn["agent"])
+            controller.agent_state = AgentGoalState(last_turn["agent_state"])
+            controller.unused_agents = [agent_from_spec(spec) for spec in last_turn["unused"]]
+        return controller
+
+    def delete(self, session_id: str):
+        with self.lock:
+            self.connection.execute("DELETE FROM session_events WHERE session_id = ?", (session_id,))
+
+    def __contains__(self, session_id: str) -> bool:
+        with self.lock:
+            return self.connection.execute(
+                "SELECT 1 FROM session_events WHERE session_id = ? LIMIT 1", (session_id,)
+            ).fetchone() is not None
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(DISTINCT session_id) FROM session_events").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
@@ -1,6 +1,315 @@
-from pydantic import BaseModel
-from openai import OpenAI
-from typing import List
+import asyncio
+import enum
+import functools
+import hashlib
+import inspect
+import json
+import os
+import re
+import sys
+import time
+import typing
+from pydantic import VERSION as PYDANTIC_VERSION, BaseModel
+from cascade import CascadePolicy
+from completion_cache import CompletionCache
+from http_client import RequestPolicy, shared_async_client, shared_client, wait_for_warm_up
+from telemetry import DISABLED, Telemetry
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+# openai is imported when the first client or response format is built, see http_client.py
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
+    from openai.types import CompletionUsage
+
+# Where response formats are kept across runs, if set.  Building one takes a few milliseconds, so they are only
+# built once per process unless SCHEMA_CACHE_DIR is set.
+SCHEMA_CACHE_DIR = os.environ.get("SCHEMA_CACHE_DIR", "")
+
+
+class JsonStringFieldReader:
+    """
+        This JsonStringFieldReader incrementally decodes one string field from JSON text
+        which arrives in chunks, so the field can be shown before the JSON document is complete.
+        The field is expected to be the first key with its name in the document.
+    """
+    _ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+    def __init__(self, field: str):
+        self.key_pattern = re.compile(r'"' + re.escape(field) + r'"\s*:\s*"')
+        self.buffer = ""
+        self.position = None
+        self.done = False
+
+    def feed(self, chunk: str) -> str:
+        """
+            Adds a chunk of JSON text and returns any newly decoded characters of the field value
+        """
+        if self.done:
+            return ""
+        self.buffer += chunk
+        if self.position is None:
+            match = self.key_pattern.search(self.buffer)
+            if match is None:
+                return ""
+            self.position = match.end()
+        decoded = []
+        buffer, position = self.buffer, self.position
+        while position < len(buffer):
+            char = buffer[position]
+            if char == '"':
+                self.done = True
+                position += 1
+                break
+            if char != '\\':
+                decoded.append(char)
+                position += 1
+                continue
+            # wait for the rest of an escape sequence which is split across chunks
+            if position + 1 >= len(buffer):
+                break
+            escape = buffer[position + 1]
+            if escape != 'u':
+                decoded.append(self._ESCAPES.get(escape, escape))
+                position += 2
+                continue
+            if position + 6 > len(buffer):
+                break
+            code = int(buffer[position + 2:position + 6], 16)
+            if 0xD800 <= code < 0xDC00:
+                # a surrogate pair is two \uXXXX escapes
+                if position + 12 > len(buffer):
+                    break
+                low = int(buffer[position + 8:position + 12], 16)
+                decoded.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                position += 12
+            else:
+                decoded.append(chr(code))
+                position += 6
+        self.position = position
+        return "".join(decoded)
+
+
+def model_types(annotation, seen: Set[type]):
+    """
+        Adds the Pydantic models and enums an annotation refers to, and those their fields refer to, to seen
+    """
+    if isinstance(annotation, type) and issubclass(annotation, (BaseModel, enum.Enum)):
+        if annotation in seen:
+            return
+        seen.add(annotation)
+        if issubclass(annotation, BaseModel):
+            for field in annotation.model_fields.values():
+                model_types(field.annotation, seen)
+        return
+    for argument in typing.get_args(annotation):
+        model_types(argument, seen)
+
+
+def schema_cache_path(response_model: BaseModel, cache_dir: str) -> Optional[str]:
+    """
+        Returns the cache file of a model's response format.  Its name hashes the source files of the model and of
+        every model and enum it refers to, and the pydantic and openai versions, so any change builds it again.
+        Models defined without a source file, such as in an interactive session, are not cached.
+    """
+    import openai
+    types: Set[type] = set()
+    model_types(response_model, types)
+    paths = {getattr(sys.modules.get(cls.__module__), "__file__", None) for cls in types}
+    if None in paths:
+        return None
+    digest = hashlib.sha256(f"{response_model.__qualname__}:{PYDANTIC_VERSION}:{openai.__version__}".encode("utf-8"))
+    try:
+        for path in sorted(paths):
+            with open(path, "rb") as source:
+                digest.update(source.read())
+    except OSError:
+        return None
+    return os.path.join(cache_dir, f"{response_model.__name__}-{digest.hexdigest()[:16]}.json")
+
+
+def build_response_format(response_model: BaseModel) -> dict:
+    """
+        Builds the strict json_schema response_format for a Pydantic model, as the parse() helper sends it.
+        openai.pydantic_function_tool() is the public helper which applies the same strict schema transform,
+        and is available from openai 1.40, the first release with structured outputs.
+    """
+    import openai
+    if not hasattr(openai, "pydantic_function_tool"):
+        raise ImportError(f"structured outputs need openai 1.40 or later, found {openai.__version__}")
+    function = openai.pydantic_function_tool(response_model)["function"]
+    return {"type": "json_schema", "json_schema": {"schema": function["parameters"], "name": function["name"], "strict": True}}
+
+
+@functools.lru_cache(maxsize=None)
+def response_format(response_model: BaseModel) -> dict:
+    """
+        Returns the strict json_schema response_format for a Pydantic model, as the parse() helper sends it.
+        The schema is built once per model class; the parse() helper would rebuild it on every request.
+        With SCHEMA_CACHE_DIR set, built formats are kept there, so later runs read them instead.
+    """
+    path = schema_cache_path(response_model, SCHEMA_CACHE_DIR) if SCHEMA_CACHE_DIR else None
+    if path is not None:
+        try:
+            with open(path, encoding="utf-8") as cached:
+                return json.load(cached)
+        except (OSError, ValueError):
+            pass
+    built = build_response_format(response_model)
+    if path is not None:
+        try:
+            os.makedirs(SCHEMA_CACHE_DIR, exist_ok=True)
+            # written to a temporary file and renamed, so concurrent runs never read a partial file
+            temporary = f"{path}.{os.getpid()}.tmp"
+            with open(temporary, "w", encoding="utf-8") as cached:
+                json.dump(built, cached)
+            os.replace(temporary, path)
+        except OSError:
+            pass
+    return built
+
+
+def parse_completion(completion, response_model: BaseModel) -> Optional[BaseModel]:
+    """
+        Validates the content of a non-streamed structured completion, or returns None if the model refused
+    """
+    message = completion.choices[0].message
+    if message.content is None:
+        return None
+    return response_model.model_validate_json(message.content)
+
+
+def record_completion(telemetry: Telemetry, span, model: str, usage: Optional["CompletionUsage"], cache_hit: bool):
+    """
+        Tags a completion span with its token usage, and counts the completion and its tokens by model
+    """
+    if not telemetry.enabled:
+        return
+    telemetry.count("completions", model=model, cache_hit=cache_hit)
+    if usage is None:
+        span.set(cache_hit=cache_hit)
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None) or 0
+    span.set(cache_hit=cache_hit, prompt_tokens=usage.prompt_tokens, cached_tokens=cached_tokens, completion_tokens=usage.completion_tokens)
+    telemetry.count("prompt_tokens", usage.prompt_tokens, model=model)
+    telemetry.count("cached_tokens", cached_tokens, model=model)
+    telemetry.count("completion_tokens", usage.completion_tokens, model=model)
+
+
+class StructuredStream:
+    """
+        This StructuredStream iterates over the text of one string field of a structured completion
+        as it is generated.  After iteration the validated model is available in result
+        (None if the model refused to answer).
+    """
+
+    def __init__(self, chunks, response_model: BaseModel, text_field: str, telemetry: Telemetry = DISABLED,
+                 on_fields: Optional[Dict[str, Callable[[str], None]]] = None):
+        """
+            Parameters:
+                chunks: the chat completion chunk stream, or for AsyncStructuredStream a function which sends the request,
+                    returning an awaitable of the stream
+                response_model (BaseModel): the Pydantic model to validate the completed JSON with
+                text_field (str): the top level string field of response_model to decode as it arrives
+                telemetry (Telemetry): times the validation of the completed JSON. Default is disabled.
+                on_fields (Dict[str, Callable[[str], None]]): top level string field -> called with its value once it
+                    has been decoded, before the text of text_field which follows it. Default is none.
+        """
+        self.chunks = chunks
+        self.telemetry = telemetry
+        self.response_model = response_model
+        self.reader = JsonStringFieldReader(text_field)
+        self.field_readers = [(JsonStringFieldReader(field), [], callback) for field, callback in (on_fields or {}).items()]
+        self.content = []
+        self.result: Optional[BaseModel] = None
+        self.usage = None
+        self.time_to_first_token: Optional[float] = None
+        self.total_latency: Optional[float] = None
+        self.cached = False
+
+    @classmethod
+    def from_cache(cls, result: BaseModel, text_field: str) -> "StructuredStream":
+        """
+            Returns a finished stream for a cached result, which was not streamed
+        """
+        stream = cls(None, type(result), text_field)
+        stream.result = result
+        stream.cached = True
+        stream.time_to_first_token = 0.0
+        stream.total_latency = 0.0
+        return stream
+
+    def on_chunk(self, chunk, start: float) -> str:
+        if chunk.usage is not None:
+            self.usage = chunk.usage
+        if not chunk.choices or not chunk.choices[0].delta.content:
+            return ""
+        self.content.append(chunk.choices[0].delta.content)
+        for reader, decoded, callback in self.field_readers:
+            if not reader.done:
+                decoded.append(reader.feed(chunk.choices[0].delta.content))
+                if reader.done:
+                    callback("".join(decoded))
+        text = self.reader.feed(chunk.choices[0].delta.content)
+        if text and self.time_to_first_token is None:
+            self.time_to_first_token = time.perf_counter() - start
+        return text
+
+    def finish(self, start: float):
+        self.total_latency = time.perf_counter() - start
+        if self.content:
+            with self.telemetry.span("parse"):
+                self.result = self.response_model.model_validate_json("".join(self.content))
+
+    def __iter__(self) -> Iterator[str]:
+        start = time.perf_counter()
+        with self.chunks as chunks:
+            for chunk in chunks:
+                text = self.on_chunk(chunk, start)
+                if text:
+                    yield text
+        self.finish(start)
+
+
+class AsyncStructuredStream(StructuredStream):
+    """
+        The asyncio variant of StructuredStream, iterated with async for
+    """
+
+    def __init__(self, chunks, response_model: BaseModel, text_field: str, semaphore: asyncio.Semaphore, telemetry: Telemetry = DISABLED,
+                 on_fields: Optional[Dict[str, Callable[[str], None]]] = None):
+        super().__init__(chunks, response_model, text_field, telemetry, on_fields)
+        self.semaphore = semaphore
+
+    async def receive(self, queue: asyncio.Queue, start: float):
+        """
+            Receives the response within a slot of the semaphore, putting its text on queue, then None
+        """
+        try:
+            async with self.semaphore:
+                async with await self.chunks() as chunks:
+                    async for chunk in chunks:
+                        text = self.on_chunk(chunk, start)
+                        if text:
+                            queue.put_nowait(text)
+        finally:
+            queue.put_nowait(None)
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        # the response is received by another task, so the slot is released once it has arrived, however slowly its text is read
+        start = time.perf_counter()
+        queue: asyncio.Queue = asyncio.Queue()
+        receiving = asyncio.ensure_future(self.receive(queue, start))
+        try:
+            while True:
+                text = await queue.get()
+                if text is None:
+                    break
+                yield text
+            await receiving
+        finally:
+            receiving.cancel()
+        self.finish(start)
 
 
 class StructuredChatCompleter:
@@ -9,7 +318,8 @@ class StructuredChatCompleter:
         which returns structured JSON from the openai chat completions endpoint
     """
 
-    def __init__(self, temperature=0.65, model="gpt-4o-mini"):
+    def __init__(self, temperature=0.65, model="gpt-4o-mini", cache: Optional[CompletionCache] = None, client: Optional["OpenAI"] = None,
+                 telemetry: Optional[Telemetry] = None, policy: Optional[RequestPolicy] = None, cascade: Optional[CascadePolicy] = None):
         """
             Initializes an OpenAI client to the specified model with the specified temperature
             The API key must be specified in OPENAI_API_KEY
@@ -17,10 +327,29 @@ class StructuredChatCompleter:
             Parameters:
                 temperature (float): Controls randomness of the model's responses. Default is 0.7.
                 model (str): Specifies the model to be used for the completion request. Default is "gpt-4o-mini".
+                cache (CompletionCache): Looks up identical requests before calling the API. Default is no cache.
+                client (OpenAI): The client to use. Default is the process-wide pooled client of http_client.shared_client().
+                telemetry (Telemetry): Records a span per completion, with request and parse spans. Default is disabled.
+                policy (RequestPolicy): The timeouts, retries and hedging of each request. Default is a RequestPolicy
+                    with retries and no hedging, reporting to telemetry.
+                cascade (CascadePolicy): The small and large models of complete_cascade(). Default is no cascade.
         """
-        self.client = OpenAI()
+        # the shared client is built on first use, so constructing a completer does not import openai
+        self._client = client
         self.temperature = temperature
         self.model = model
+        self.cache = cache
+        self.telemetry = telemetry or DISABLED
+        self.policy = policy or RequestPolicy(telemetry=self.telemetry)
+        self.cascade = cascade
+
+    @property
+    def client(self) -> "OpenAI":
+        if self._client is None:
+            self._client = shared_client()
+            # a connection which is nearly open is quicker to wait for than a new one
+            wait_for_warm_up()
+        return self._client
 
     def complete(self, messages, response_model: BaseModel):
         """
@@ -37,10 +366,269 @@ class StructuredChatCompleter:
             dict or str: If the response is valid, returns the structured JSON as a Pydantic model instance.
                         If the response does not match the expected format, returns a validation error message.
         """
-        completion = self.client.beta.chat.completions.parse(
-            model=self.model,
+        return self.complete_with_usage(messages, response_model)[0]
+
+    def complete_with_usage(self, messages, response_model: BaseModel, model: Optional[str] = None) -> Tuple[Optional[BaseModel], Optional["CompletionUsage"]]:
+        """
+        Sends a list of messages like complete(), also returning the token usage reported by the API.
+
+        Parameters:
+            model (str): the model to send this request to. Default is the completer's model.
+
+        Returns:
+            (BaseModel, CompletionUsage): the Pydantic model instance, and the usage block of the completion
+                (None when the result came from the cache)
+        """
+        model = model or self.model
+        with self.telemetry.span("completion", model=model, streamed=False) as span:
+            if self.cache is not None:
+                cached = self.cache.lookup(model, self.temperature, messages, response_model)
+                if cached is not None:
+                    record_completion(self.telemetry, span, model, None, cache_hit=True)
+                    return cached, None
+            with self.telemetry.span("request"):
+                completion = self.policy.call(lambda timeout: self.client.chat.completions.create(
+                    model=model,
+                    temperature=self.temperature,
+                    messages=messages,
+                    response_format=response_format(response_model),
+                    timeout=timeout,
+                ), model)
+            with self.telemetry.span("parse"):
+                parsed = parse_completion(completion, response_model)
+            if self.cache is not None:
+                self.cache.store(model, self.temperature, messages, response_model, parsed)
+            record_completion(self.telemetry, span, model, completion.usage, cache_hit=False)
+            return parsed, completion.usage
+
+    def complete_cascade(self, messages, response_model: BaseModel, check: Callable[[Optional[BaseModel]], List[str]],
+                         model: Optional[str] = None) -> Tuple[Optional[BaseModel], List[Optional["CompletionUsage"]]]:
+        """
+        Sends a list of messages to the cascade's small model, and again to its large model if check finds problems
+        with the small model's response.
+
+        Parameters:
+            check (Callable): returns the problems of a parsed response (None if the model refused), or an empty list
+            model (str): the model to try first. Default is the cascade's small model; the large model is not checked.
+
+        Returns:
+            (BaseModel, List[CompletionUsage]): the response which is used, and the usage of each completion
+        """
+        model = model or self.cascade.small
+        start = time.perf_counter()
+        parsed, usage = self.complete_with_usage(messages, response_model, model)
+        escalation = self.cascade.escalation(model, parsed, usage, time.perf_counter() - start, check, self.telemetry)
+        if escalation is None:
+            return parsed, [usage]
+        start = time.perf_counter()
+        escalated, escalated_usage = self.complete_with_usage(messages, response_model, escalation)
+        self.cascade.stats.record(escalation, escalated_usage, time.perf_counter() - start)
+        return escalated, [usage, escalated_usage]
+
+    def stream(self, messages, response_model: BaseModel, text_field: str, model: Optional[str] = None,
+               on_fields: Optional[Dict[str, Callable[[str], None]]] = None) -> StructuredStream:
+        """
+        Streams a structured completion, yielding the text of one string field as it is generated.
+
+        Parameters:
+            messages (List[dict]): A list of message objects, where each message is a dictionary with 'role' and 'content'.
+            response_model (BaseModel): A Pydantic model that defines the expected structure of the API response.
+            text_field (str): The name of a top level string field of response_model to stream.
+            on_fields (Dict[str, Callable[[str], None]]): other top level string fields, called with their value once decoded.
+
+        Returns:
+            StructuredStream: iterate it for the text, then read result for the validated Pydantic model instance.
+        """
+        model = model or self.model
+        # a stream is retried until its response starts, and is never hedged since its text is shown as it arrives
+        chunks = self.policy.call(lambda timeout: self.client.chat.completions.create(
+            model=model,
             temperature=self.temperature,
             messages=messages,
-            response_format=response_model,
-        )
-        return completion.choices[0].message.parsed
+            response_format=response_format(response_model),
+            stream=True,
+            stream_options={"include_usage": True},
+            timeout=timeout,
+        ), f"{model} stream", hedge=False)
+        return StructuredStream(chunks, response_model, text_field, self.telemetry, on_fields)
+
+    def complete_streaming(self, messages, response_model: BaseModel, text_field: str, on_text: Callable[[str], None], model: Optional[str] = None,
+                           on_fields: Optional[Dict[str, Callable[[str], None]]] = None):
+        """
+        Sends a list of messages like complete(), calling on_text with each piece of text_field as it arrives,
+        and each of on_fields with the value of its field once it has been decoded.
+
+        Returns:
+            StructuredStream: the finished stream, with result and timings
+        """
+        model = model or self.model
+        with self.telemetry.span("completion", model=model, streamed=True) as span:
+            if self.cache is not None:
+                cached = self.cache.lookup(model, self.temperature, messages, response_model)
+                if cached is not None:
+                    announce_fields(cached, on_fields)
+                    on_text(getattr(cached, text_field))
+                    record_completion(self.telemetry, span, model, None, cache_hit=True)
+                    return StructuredStream.from_cache(cached, text_field)
+            # the streamed response is received in the request span, and validated in its parse span
+            with self.telemetry.span("request"):
+                stream = self.stream(messages, response_model, text_field, model, on_fields)
+                for text in stream:
+                    on_text(text)
+            if self.cache is not None:
+                self.cache.store(model, self.temperature, messages, response_model, stream.result)
+            span.set(time_to_first_token=stream.time_to_first_token)
+            record_completion(self.telemetry, span, model, stream.usage, cache_hit=False)
+            return stream
+
+
+def announce_fields(result: BaseModel, on_fields: Optional[Dict[str, Callable[[str], None]]]):
+    """
+        Calls on_fields with the values of a result which was not streamed, enum values by their value
+    """
+    for field, callback in (on_fields or {}).items():
+        value = getattr(result, field)
+        callback(getattr(value, "value", value))
+
+
+async def show_text(on_text: Callable[[str], Optional[Awaitable[None]]], text: str):
+    """
+        Calls on_text with text, and awaits it if it is a coroutine function, such as one which waits for a slow reader
+    """
+    shown = on_text(text)
+    if inspect.isawaitable(shown):
+        await shown
+
+
+class AsyncStructuredChatCompleter:
+    """
+        The asyncio variant of StructuredChatCompleter.
+        One instance is meant to be shared by every session in the process: it holds one AsyncOpenAI client,
+        and a semaphore bounds the number of completion requests in flight across all sessions.
+    """
+
+    def __init__(self, temperature=0.65, model="gpt-4o-mini", max_concurrency=64, client: Optional["AsyncOpenAI"] = None,
+                 cache: Optional[CompletionCache] = None, telemetry: Optional[Telemetry] = None, policy: Optional[RequestPolicy] = None,
+                 cascade: Optional[CascadePolicy] = None):
+        """
+            Parameters:
+                temperature (float): Controls randomness of the model's responses. Default is 0.65.
+                model (str): Specifies the model to be used for the completion request. Default is "gpt-4o-mini".
+                max_concurrency (int): The maximum number of completion requests in flight. Default is 64.
+                client (AsyncOpenAI): The client to use. Default is the process-wide pooled client of http_client.shared_async_client().
+                cache (CompletionCache): Looks up identical requests before calling the API. Default is no cache.
+                telemetry (Telemetry): Records a span per completion, with request and parse spans. Default is disabled.
+                policy (RequestPolicy): The timeouts, retries and hedging of each request. Default is a RequestPolicy
+                    with retries and no hedging, reporting to telemetry.
+                cascade (CascadePolicy): The small and large models of complete_cascade(). Default is no cascade.
+        """
+        self.client = client or shared_async_client()
+        self.temperature = temperature
+        self.model = model
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.cache = cache
+        self.telemetry = telemetry or DISABLED
+        self.policy = policy or RequestPolicy(telemetry=self.telemetry)
+        self.cascade = cascade
+
+    async def complete(self, messages, response_model: BaseModel):
+        """
+        Sends a list of messages to the OpenAI Chat Completion API and returns the structured JSON response,
+        like StructuredChatCompleter.complete()
+        """
+        return (await self.complete_with_usage(messages, response_model))[0]
+
+    async def complete_with_usage(self, messages, response_model: BaseModel, model: Optional[str] = None) -> Tuple[Optional[BaseModel], Optional["CompletionUsage"]]:
+        """
+        Sends a list of messages like complete(), also returning the token usage reported by the API
+        """
+        model = model or self.model
+        with self.telemetry.span("completion", model=model, streamed=False) as span:
+            if self.cache is not None:
+                cached = self.cache.lookup(model, self.temperature, messages, response_model)
+                if cached is not None:
+                    record_completion(self.telemetry, span, model, None, cache_hit=True)
+                    return cached, None
+            async with self.semaphore:
+                with self.telemetry.span("request"):
+                    completion = await self.policy.call_async(lambda timeout: self.client.chat.completions.create(
+                        model=model,
+                        temperature=self.temperature,
+                        messages=messages,
+                        response_format=response_format(response_model),
+                        timeout=timeout,
+                    ), model)
+            with self.telemetry.span("parse"):
+                parsed = parse_completion(completion, response_model)
+            if self.cache is not None:
+                self.cache.store(model, self.temperature, messages, response_model, parsed)
+            record_completion(self.telemetry, span, model, completion.usage, cache_hit=False)
+            return parsed, completion.usage
+
+    async def complete_cascade(self, messages, response_model: BaseModel, check: Callable[[Optional[BaseModel]], List[str]],
+                               model: Optional[str] = None) -> Tuple[Optional[BaseModel], List[Optional["CompletionUsage"]]]:
+        """
+        Sends a list of messages to the cascade's small model, and again to its large model if check finds problems,
+        like StructuredChatCompleter.complete_cascade()
+        """
+        model = model or self.cascade.small
+        start = time.perf_counter()
+        parsed, usage = await self.complete_with_usage(messages, response_model, model)
+        escalation = self.cascade.escalation(model, parsed, usage, time.perf_counter() - start, check, self.telemetry)
+        if escalation is None:
+            return parsed, [usage]
+        start = time.perf_counter()
+        escalated, escalated_usage = await self.complete_with_usage(messages, response_model, escalation)
+        self.cascade.stats.record(escalation, escalated_usage, time.perf_counter() - start)
+        return escalated, [usage, escalated_usage]
+
+    def stream(self, messages, response_model: BaseModel, text_field: str, model: Optional[str] = None,
+               on_fields: Optional[Dict[str, Callable[[str], None]]] = None) -> AsyncStructuredStream:
+        """
+        Streams a structured completion like StructuredChatCompleter.stream(), iterated with async for
+        """
+        model = model or self.model
+        # a stream is retried until its response starts, and is never hedged since its text is shown as it arrives;
+        # the request is sent once the stream has a slot of the semaphore
+
+        def send():
+            return self.policy.call_async(lambda timeout: self.client.chat.completions.create(
+                model=model,
+                temperature=self.temperature,
+                messages=messages,
+                response_format=response_format(response_model),
+                stream=True,
+                stream_options={"include_usage": True},
+                timeout=timeout,
+            ), f"{model} stream", hedge=False)
+        return AsyncStructuredStream(send, response_model, text_field, self.semaphore, self.telemetry, on_fields)
+
+    async def complete_streaming(self, messages, response_model: BaseModel, text_field: str, on_text: Callable[[str], Optional[Awaitable[None]]],
+                                 model: Optional[str] = None, on_fields: Optional[Dict[str, Callable[[str], None]]] = None):
+        """
+        Streams a structured completion, calling on_text with each piece of text_field as it arrives,
+        and each of on_fields with the value of its field once it has been decoded.
+        If on_text returns an awaitable, it is awaited before the next piece is shown; the response is received meanwhile,
+        so a slow reader does not hold the request's slot of the semaphore.
+
+        Returns:
+            AsyncStructuredStream: the finished stream, with result and timings
+        """
+        model = model or self.model
+        with self.telemetry.span("completion", model=model, streamed=True) as span:
+            if self.cache is not None:
+                cached = self.cache.lookup(model, self.temperature, messages, response_model)
+                if cached is not None:
+                    announce_fields(cached, on_fields)
+                    await show_text(on_text, getattr(cached, text_field))
+                    record_completion(self.telemetry, span, model, None, cache_hit=True)
+                    return StructuredStream.from_cache(cached, text_field)
+            with self.telemetry.span("request"):
+                stream = self.stream(messages, response_model, text_field, model, on_fields)
+                async for text in stream:
+                    await show_text(on_text, text)
+            if self.cache is not None:
+                self.cache.store(model, self.temperature, messages, response_model, stream.result)
+            span.set(time_to_first_token=stream.time_to_first_token)
+            record_completion(self.telemetry, span, model, stream.usage, cache_hit=False)
+            return stream
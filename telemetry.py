@@ -0,0 +1,262 @@
+import bisect
+import contextvars
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+METRIC_PREFIX = "provider_search_"
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 64)
+# histograms which count things rather than time them
+HISTOGRAM_BUCKETS = {
+    "llm_calls_per_turn": COUNT_BUCKETS,
+    "llm_calls_per_session": COUNT_BUCKETS,
+    "turns_per_session": COUNT_BUCKETS,
+}
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+        A timed phase of a turn, with tags.  Spans started while another span is current in the same
+        thread or asyncio task are its children, and share its trace_id.
+    """
+
+    def __init__(self, telemetry: "Telemetry", name: str, tags: Dict[str, Any]):
+        self.telemetry = telemetry
+        self.name = name
+        self.tags = tags
+        self.trace_id: Optional[str] = None
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id: Optional[str] = None
+        self.start = 0.0
+        self.started = 0.0
+        self.duration = 0.0
+        self.error: Optional[str] = None
+        self.token = None
+
+    def set(self, **tags):
+        self.tags.update(tags)
+
+    def __enter__(self) -> "Span":
+        parent = _current_span.get()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.trace_id = parent.trace_id if parent is not None else f"{random.getrandbits(64):016x}"
+        self.token = _current_span.set(self)
+        self.start = time.time()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.duration = time.perf_counter() - self.started
+        _current_span.reset(self.token)
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        self.telemetry.finish_span(self)
+        return False
+
+    def as_dict(self) -> Dict[str, Any]:
+        record = {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration": self.duration,
+            "tags": self.tags,
+        }
+        if self.error is not None:
+            record["error"] = self.error
+        return record
+
+
+class NullSpan:
+    """
+        The span of disabled telemetry, which records nothing.  One instance is shared by every call.
+    """
+
+    def set(self, **tags):
+        pass
+
+    def __enter__(self) -> "NullSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class JsonlSpanExporter:
+    """
+        Appends each finished span to a JSON lines trace file
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, "a", encoding="utf-8")
+
+    def export(self, span: Span):
+        line = json.dumps(span.as_dict(), default=str)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class MemorySpanExporter:
+    """
+        Keeps finished spans in a list, for tests and benchmarks
+    """
+
+    def __init__(self):
+        self.spans: List[Span] = []
+
+    def export(self, span: Span):
+        self.spans.append(span)
+
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Telemetry:
+    """
+        This Telemetry records spans for the phases of each turn, and counters and histograms.
+        Finished spans go to the exporters, and every span's duration is observed in the span_seconds histogram.
+        Metrics are kept in memory and rendered in the Prometheus text format by prometheus_text().
+
+        Disabled telemetry returns NULL_SPAN and ignores metrics, so instrumented code costs one method call.
+    """
+
+    def __init__(self, exporters: Sequence = (), enabled: bool = True):
+        """
+            Parameters:
+                exporters (Sequence): objects with an export(span) method, such as JsonlSpanExporter. Default is none.
+                enabled (bool): record spans and metrics. Default is True.
+        """
+        self.exporters = list(exporters)
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+
+    def span(self, name: str, **tags) -> Any:
+        """
+            Returns a context manager timing a phase: with telemetry.span("completion", model=...) as span: ...
+        """
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, tags)
+
+    def count(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = tuple(sorted((label, str(label_value)) for label, label_value in labels.items()))
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        key = tuple(sorted((label, str(label_value)) for label, label_value in labels.items()))
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(HISTOGRAM_BUCKETS.get(name, DURATION_BUCKETS))
+            histogram.observe(value)
+
+    def finish_span(self, span: Span):
+        self.observe("span_seconds", span.duration, span=span.name)
+        for exporter in self.exporters:
+            exporter.export(span)
+
+    def prometheus_text(self) -> str:
+        """
+            Returns every counter and histogram in the Prometheus text exposition format
+        """
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                metric = f"{METRIC_PREFIX}{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{metric}{format_labels(labels)} {value:g}")
+            for name, series in sorted(self.histograms.items()):
+                metric = f"{METRIC_PREFIX}{name}"
+                lines.append(f"# TYPE {metric} histogram")
+                for labels, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bucket, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{metric}_bucket{format_labels(labels + (('le', f'{bucket:g}'),))} {cumulative}")
+                    lines.append(f"{metric}_bucket{format_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+                    lines.append(f"{metric}_sum{format_labels(labels)} {histogram.sum:g}")
+                    lines.append(f"{metric}_count{format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        for exporter in self.exporters:
+            if hasattr(exporter, "close"):
+                exporter.close()
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{label}="{value}"' for (label, _), value in zip(labels, escaped)) + "}"
+
+
+# the default of every instrumented class
+DISABLED = Telemetry(enabled=False)
+
+
+def serve_metrics(telemetry: Telemetry, host: str = "127.0.0.1", port: int = 9464) -> ThreadingHTTPServer:
+    """
+        Serves GET /metrics in the Prometheus text format from a daemon thread, and returns the server
+    """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") != "/metrics":
+                self.send_error(404)
+                return
+            body = telemetry.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -0,0 +1,144 @@
+import asyncio
+import json
+from openai import AsyncOpenAI
+from batch_extract import (
+    BatchExtractor,
+    RateLimiter,
+    ResultWriter,
+    completed_ids,
+    emit_batch,
+    ingest_batch,
+    read_transcripts,
+)
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.simulation import PERSONAS, extraction_responder, persona_transcript
+from models import Insurance, MemberProfile, ProviderPreferences, ProviderSearchInputState
+from http_client import RequestPolicy
+from structured_chat import AsyncStructuredChatCompleter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def write_transcripts(path, count):
+    with open(path, "w") as f:
+        for index in range(count):
+            f.write(json.dumps(persona_transcript(PERSONAS[index % len(PERSONAS)], f"t{index}")) + "\n")
+
+
+async def extract(path, results, concurrency, max_in_flight=None):
+    fake = FakeOpenAIServer(extraction_responder, latency=0.01, max_in_flight=max_in_flight, retry_after=0.01)
+    server = await fake.serve()
+    client = AsyncOpenAI(api_key="fake", base_url=f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/v1", max_retries=0)
+    extractor = BatchExtractor(AsyncStructuredChatCompleter(temperature=0, client=client, policy=RequestPolicy(max_retries=0)), concurrency, backoff=0.01)
+    writer = ResultWriter(results)
+    try:
+        return await extractor.run(read_transcripts(path), writer, completed_ids(results)), fake
+    finally:
+        writer.close()
+        await client.close()
+        server.close()
+
+
+def test_rate_limiter_spaces_requests():
+    clock = Clock()
+    limiter = RateLimiter(requests_per_minute=120, tokens_per_minute=6000, clock=clock)
+    # the buckets hold one second: 2 requests and 100 tokens
+    assert limiter.delay(40) == 0 and limiter.delay(40) == 0
+    assert limiter.delay(40) == 0.5
+    clock.now = 0.5
+    assert limiter.delay(40) == 0
+    # a request larger than the token bucket waits for a full bucket
+    clock.now = 10
+    assert limiter.delay(1000) == 0
+    limiter.pause(3)
+    assert limiter.delay(1) == 3
+
+
+def test_run_extracts_and_resumes(tmp_path):
+    transcripts, results = str(tmp_path / "transcripts.jsonl"), str(tmp_path / "results.jsonl")
+    write_transcripts(transcripts, 12)
+    stats, _ = asyncio.run(extract(transcripts, results, concurrency=4))
+    assert (stats.extracted, stats.failed, stats.skipped) == (12, 0, 0)
+    with open(results) as f:
+        lines = [json.loads(line) for line in f]
+    states = {line["id"]: ProviderSearchInputState.model_validate(line["state"]) for line in lines}
+    assert states["t0"].member_profile.insurance == Insurance.AETNA
+    assert states["t1"].member_profile.insurance == Insurance.BLUE_CROSS
+
+    # a crash cut the last result short: it is extracted again, and the rest are skipped
+    with open(results) as f:
+        content = f.read()
+    with open(results, "w") as f:
+        f.write(content[:-10])
+    stats, _ = asyncio.run(extract(transcripts, results, concurrency=4))
+    assert (stats.extracted, stats.skipped) == (1, 11)
+    assert completed_ids(results) == {f"t{index}" for index in range(12)}
+
+
+def test_rate_limited_requests_are_retried(tmp_path):
+    transcripts, results = str(tmp_path / "transcripts.jsonl"), str(tmp_path / "results.jsonl")
+    write_transcripts(transcripts, 12)
+    stats, fake = asyncio.run(extract(transcripts, results, concurrency=6, max_in_flight=2))
+    assert (stats.extracted, stats.failed) == (12, 0)
+    assert stats.rate_limited == fake.rate_limited > 0
+
+
+class FailingCompleter:
+    """
+        Raises an error the extractor does not retry for the second and fourth transcripts, and extracts the rest
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    async def complete_with_usage(self, messages, response_model):
+        self.calls += 1
+        if self.calls in (2, 4):
+            raise TypeError("unexpected")
+        return response_model(member_profile=MemberProfile(), provider_preferences=ProviderPreferences()), None
+
+
+def test_unexpected_errors_fail_only_their_transcript(tmp_path):
+    transcripts, results = str(tmp_path / "transcripts.jsonl"), str(tmp_path / "results.jsonl")
+    write_transcripts(transcripts, 12)
+    writer = ResultWriter(results)
+    try:
+        # one worker, in transcript order, and a queue shorter than the transcripts
+        extractor = BatchExtractor(FailingCompleter(), concurrency=1)
+        stats = asyncio.run(asyncio.wait_for(extractor.run(read_transcripts(transcripts), writer), 5))
+    finally:
+        writer.close()
+    assert (stats.extracted, stats.failed) == (10, 2)
+    with open(results) as f:
+        errors = {line["id"]: line["error"] for line in map(json.loads, f) if "error" in line}
+    assert errors == {"t1": "TypeError: unexpected", "t3": "TypeError: unexpected"}
+
+
+def test_batch_api_files(tmp_path):
+    transcripts, requests = str(tmp_path / "transcripts.jsonl"), str(tmp_path / "requests.jsonl")
+    write_transcripts(transcripts, 3)
+    assert emit_batch(transcripts, requests, "gpt-4o-mini", 0, done={"t1"}) == 2
+    with open(requests) as f:
+        lines = [json.loads(line) for line in f]
+    assert [line["custom_id"] for line in lines] == ["t0", "t2"]
+    assert lines[0]["url"] == "/v1/chat/completions"
+    assert lines[0]["body"]["response_format"]["json_schema"]["name"] == "ProviderSearchInputState"
+
+    output = str(tmp_path / "output.jsonl")
+    with open(output, "w") as f:
+        content = extraction_responder(lines[0]["body"]).model_dump_json()
+        body = {"choices": [{"message": {"role": "assistant", "content": content}}], "usage": {"prompt_tokens": 10, "completion_tokens": 5}}
+        f.write(json.dumps({"custom_id": "t0", "response": {"status_code": 200, "body": body}, "error": None}) + "\n")
+        f.write(json.dumps({"custom_id": "t2", "response": {"status_code": 500, "body": {"error": {"message": "failed"}}}, "error": None}) + "\n")
+    results = str(tmp_path / "results.jsonl")
+    writer = ResultWriter(results)
+    stats = ingest_batch(output, writer)
+    writer.close()
+    assert (stats.extracted, stats.failed, stats.prompt_tokens) == (1, 1, 10)
+    assert completed_ids(results) == {"t0"}
@@ -0,0 +1,72 @@
+import random
+import numpy as np
+from benchmarks.synthetic import random_columns, random_names, random_search_state
+from benchmarks.simulation import PERSONAS, SimulatedCompleter, run_session
+from candidates import CandidateSet
+from controller import ChatController
+from matching import DEFAULT_REQUIRED, ENUM_COLUMNS, ProviderIndex, encode, search_criteria
+from models import Insurance, MemberProfile, ProviderPreferences, ProviderSearchInputState
+
+
+def expected_facets(index: ProviderIndex, mask: np.ndarray, column: str):
+    values = index.columns[column][mask]
+    return [int(np.count_nonzero(values & (1 << bit))) for bit in range(len(ENUM_COLUMNS[column]))]
+
+
+def test_updates_match_refiltering():
+    index = ProviderIndex(random_columns(3000, seed=1), random_names(3000))
+    candidates = CandidateSet(index)
+    rng = random.Random(2)
+    for turn in range(40):
+        state = random_search_state(rng)
+        # corrections and withdrawn answers widen the set again
+        if turn % 3 == 0:
+            state.member_profile.insurance = None
+        if turn % 4 == 0:
+            state.provider_preferences.appointment_types = None
+        if turn % 5 == 0:
+            candidates.facet_array("languages_spoken")
+        candidates.update(state)
+        mask = index.filter([criterion for criterion in search_criteria(state) if criterion.column in DEFAULT_REQUIRED])
+        assert candidates.count == np.count_nonzero(mask)
+        assert np.array_equal(candidates.positions(), np.flatnonzero(mask))
+        for column in ENUM_COLUMNS:
+            assert candidates.facet_array(column).tolist() == expected_facets(index, mask, column)
+
+
+def test_unchanged_state_is_not_reapplied():
+    index = ProviderIndex(random_columns(100), random_names(100))
+    candidates = CandidateSet(index)
+    state = ProviderSearchInputState(member_profile=MemberProfile(insurance=Insurance.AETNA), provider_preferences=ProviderPreferences())
+    candidates.update(state)
+    candidates.update(state)
+    assert candidates.changes == 1
+
+
+def test_questions_which_cannot_change_the_result_are_skipped():
+    columns = random_columns(500, seed=3)
+    # every provider accepts every insurance
+    columns["insurance_accepted"][:] = encode("insurance_accepted", list(Insurance))
+    index = ProviderIndex(columns, random_names(500))
+    candidates = CandidateSet(index)
+    assert not candidates.question_matters(("member_profile.insurance",))
+    assert candidates.question_matters(("member_profile.language",))
+    assert candidates.question_matters(("provider_preferences.gender",))
+    assert candidates.question_matters(("provider_preferences.specialties",))
+    assert not candidates.question_matters(("member_profile.language",), enough=500)
+
+    persona = PERSONAS[0]
+    controller = ChatController(completer=SimulatedCompleter(persona), debug=False, provider_index=index)
+    asked = []
+    get_agent = controller.get_agent
+
+    def recording_get_agent():
+        asked.append(get_agent().name())
+        return controller.agent
+    controller.get_agent = recording_get_agent
+    assert run_session(controller, persona)["complete"]
+    assert "MemberInsuranceProviderSearchAgent" not in asked
+    assert "MemberDemographicsProviderSearchAgent" in asked and "MemberLanguangeProviderSearchAgent" in asked
+    assert controller.candidates.count == index.filter(
+        [criterion for criterion in search_criteria(controller.search_input_state) if criterion.column in DEFAULT_REQUIRED]
+    ).sum()
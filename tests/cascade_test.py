@@ -0,0 +1,107 @@
+from openai import OpenAI
+from agents import CompositeProviderSearchAgent, GeneralProviderSearchAgent, MemberDemographicsProviderSearchAgent, MemberInsuranceProviderSearchAgent
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.simulation import PERSONAS, CheapModelResponder, field_value, rule_responder, run_session
+from cascade import CascadePolicy, completion_cost, consistency_problems, mentions_specialty, withdraws
+from controller import ChatController
+from models import AgentGoalState, Insurance, MemberProfile, ProviderPreferences, ProviderSearchAgentResponse, ProviderSearchInputState, TherapyType
+from structured_chat import StructuredChatCompleter
+
+MESSAGES = [{"role": "user", "content": "I need a therapist"}]
+
+
+def response(state: ProviderSearchInputState, agent_state=AgentGoalState.MATCHED) -> ProviderSearchAgentResponse:
+    return ProviderSearchAgentResponse(assistant_response="Thank you.", provider_search_information=state, agent_state=agent_state)
+
+
+def test_consistency_problems():
+    empty = ProviderSearchInputState(member_profile=MemberProfile(), provider_preferences=ProviderPreferences())
+    insured = ProviderSearchInputState(member_profile=MemberProfile(insurance=Insurance.AETNA), provider_preferences=ProviderPreferences())
+    general = GeneralProviderSearchAgent()
+    assert consistency_problems(None, empty, general, "hi") == ["refused"]
+    assert consistency_problems(response(empty), empty, general, "hello") == []
+    assert consistency_problems(response(empty), insured, general, "hello") == ["regressed:member_profile.insurance"]
+    assert consistency_problems(response(empty), empty, general, "I have been so anxious lately") == ["specialties"]
+    assert consistency_problems(response(empty, AgentGoalState.COMPLETE), empty, general, "I'd like CBT") == ["agent_state"]
+    # COMPLETE is the answer to a member who declines
+    assert consistency_problems(response(empty, AgentGoalState.COMPLETE), empty, general, "hello") == []
+    insurance = MemberInsuranceProviderSearchAgent()
+    assert consistency_problems(response(empty, AgentGoalState.COMPLETE), empty, insurance, "I'd rather not say") == []
+    assert consistency_problems(response(empty, AgentGoalState.COMPLETE), empty, insurance, "I have Blue Cross") == ["agent_state"]
+    aged = ProviderSearchInputState(member_profile=MemberProfile(age=34), provider_preferences=ProviderPreferences())
+    demographics = MemberDemographicsProviderSearchAgent()
+    assert consistency_problems(response(aged, AgentGoalState.COMPLETE), empty, demographics, "34, and I'd rather not give my gender") == []
+    assert consistency_problems(response(empty, AgentGoalState.COMPLETE), empty, demographics, "34, and I'd rather not give my gender") == ["agent_state"]
+    # a clear the member asked for, or a deliberate null change, is not a regression
+    assert consistency_problems(response(empty), insured, general, "Never mind the insurance") == []
+    assert consistency_problems(response(empty), insured, general, "forget Aetna") == []
+    assert consistency_problems(response(empty), insured, general, "never mind the gender") == ["regressed:member_profile.insurance"]
+    assert consistency_problems(response(empty), insured, general, "hello", withdrawn={"member_profile.insurance"}) == []
+    assert consistency_problems(response(insured, AgentGoalState.NO_MATCH), empty, MemberInsuranceProviderSearchAgent(), "Aetna") == ["agent_state"]
+
+
+def test_specialties_and_withdrawals_are_whole_phrases():
+    for text in ("I have been so anxious lately", "I keep having panic attacks", "my marriage is falling apart", "self-harm"):
+        assert mentions_specialty(text)
+    # words which only begin like a specialty are no reason for the search
+    for text in ("I am looking for a psychologist", "I will self pay", "I am eating lunch", "my life is fine", "married, two kids"):
+        assert not mentions_specialty(text)
+    assert withdraws("never mind the therapy type", "provider_preferences.therapy_types", [])
+    assert not withdraws("never mind, any therapist is fine", "provider_preferences.therapy_types", [TherapyType.FAMILY])
+    general = GeneralProviderSearchAgent()
+    empty = ProviderSearchInputState(member_profile=MemberProfile(), provider_preferences=ProviderPreferences())
+    assert consistency_problems(response(empty), empty, general, "I am looking for a psychologist") == []
+
+
+def test_model_for_agents():
+    cascade = CascadePolicy(agent_models={"MemberInsuranceProviderSearchAgent": "gpt-4o"})
+    assert cascade.model_for(GeneralProviderSearchAgent()) == "gpt-4o-mini"
+    assert cascade.model_for(MemberInsuranceProviderSearchAgent()) == "gpt-4o"
+    composite = CompositeProviderSearchAgent([MemberDemographicsProviderSearchAgent(), MemberInsuranceProviderSearchAgent()])
+    assert cascade.model_for(composite) == "gpt-4o"
+
+
+def test_escalation_decision():
+    cascade = CascadePolicy()
+    assert cascade.escalation("gpt-4o-mini", None, None, 0.1, lambda response: ["refused"]) == "gpt-4o"
+    assert cascade.escalation("gpt-4o-mini", None, None, 0.1, lambda response: []) is None
+    # the large model's responses are not checked
+    assert cascade.escalation("gpt-4o", None, None, 0.1, lambda response: ["refused"]) is None
+    assert (cascade.stats.completions, cascade.stats.escalations) == (2, 1)
+    assert cascade.stats.calls == {"gpt-4o-mini": 2, "gpt-4o": 1}
+
+
+def test_failed_checks_are_escalated():
+    port = FakeOpenAIServer(CheapModelResponder(error_rate=1.0, seed=0), latency=0.001).serve_in_thread()
+    client = OpenAI(api_key="fake", base_url=f"http://127.0.0.1:{port}/v1", max_retries=0)
+    cascade = CascadePolicy()
+    completer = StructuredChatCompleter(client=client, cascade=cascade)
+    parsed, usages = completer.complete_cascade(MESSAGES, ProviderSearchAgentResponse, lambda parsed: ["agent_state"])
+    assert parsed == rule_responder({"messages": MESSAGES, "model": "gpt-4o"})
+    assert len(usages) == 2 and cascade.stats.escalations == cascade.stats.completions == 1
+    assert cascade.stats.calls == {"gpt-4o-mini": 1, "gpt-4o": 1}
+    assert cascade.stats.total_cost == sum(completion_cost(model, usage) for model, usage in zip(("gpt-4o-mini", "gpt-4o"), usages)) > 0
+
+    parsed, usages = completer.complete_cascade(MESSAGES, ProviderSearchAgentResponse, lambda parsed: [])
+    assert len(usages) == 1 and cascade.stats.escalations == 1 and cascade.stats.completions == 2
+    client.close()
+
+
+def test_cascade_session_is_corrected():
+    responder = CheapModelResponder(error_rate=0.3, seed=2)
+    port = FakeOpenAIServer(responder, latency=0.001).serve_in_thread()
+    client = OpenAI(api_key="fake", base_url=f"http://127.0.0.1:{port}/v1", max_retries=0)
+    cascade = CascadePolicy()
+    persona = PERSONAS[0]
+    shown = []
+    controller = ChatController(completer=StructuredChatCompleter(client=client, cascade=cascade), debug=False)
+    result = run_session(controller, persona, on_text=shown.append)
+    assert result["complete"]
+    # checked responses are shown whole, once they passed their checks, between the separators of multi-agent turns
+    assert all(text.startswith("Thank you") or not text.strip() for text in shown)
+    assert cascade.stats.escalations >= responder.mistakes["regressed"] + responder.mistakes["agent_state"] > 0
+    assert controller.usage.calls == sum(cascade.stats.calls.values())
+    for field, (_, value) in persona.answers.items():
+        if field != "provider_preferences.specialties" or not responder.mistakes["wrong_specialty"]:
+            assert field_value(controller.search_input_state, field) == value
+    client.close()
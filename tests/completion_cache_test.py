@@ -0,0 +1,79 @@
+import os
+import tempfile
+from types import SimpleNamespace
+from pydantic import BaseModel
+from completion_cache import CompletionCache, MemoryCache, SqliteCache, request_key
+from structured_chat import StructuredChatCompleter
+
+
+class Answer(BaseModel):
+    text: str
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def fake_client(calls):
+    def create(model, temperature, messages, response_format, timeout=None):
+        calls.append(messages)
+        message = SimpleNamespace(content=Answer(text=f"answer {len(calls)}").model_dump_json())
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+def test_request_key_is_stable():
+    first = request_key("m", 0, [{"role": "user", "content": "hi"}], Answer)
+    assert first == request_key("m", 0, [{"content": "hi", "role": "user"}], Answer)
+    assert first != request_key("m", 0.5, [{"role": "user", "content": "hi"}], Answer)
+
+
+def test_memory_cache_lru_and_ttl():
+    clock = Clock()
+    cache = MemoryCache(max_entries=2, ttl=10, clock=clock)
+    cache.put("a", Answer(text="a"))
+    cache.put("b", Answer(text="b"))
+    assert cache.get("a", Answer).text == "a"
+    cache.put("c", Answer(text="c"))
+    # b was least recently used
+    assert cache.get("b", Answer) is None
+    cached = cache.get("a", Answer)
+    cached.text = "changed"
+    assert cache.get("a", Answer).text == "a"
+    clock.now = 11
+    assert cache.get("a", Answer) is None
+
+
+def test_sqlite_cache_persists_and_evicts_by_size():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "cache.sqlite")
+        clock = Clock()
+        cache = SqliteCache(path, max_bytes=40, clock=clock)
+        for index in range(4):
+            clock.now = index
+            cache.put(str(index), Answer(text=str(index)))
+        # each entry is 12 bytes of JSON, so the oldest entry is evicted
+        assert cache.get("0", Answer) is None
+        cache.close()
+        reopened = SqliteCache(path, max_bytes=40)
+        assert reopened.get("3", Answer) == Answer(text="3")
+        assert len(reopened) == 3
+        reopened.close()
+
+
+def test_completer_caches_deterministic_requests_only():
+    calls = []
+    messages = [{"role": "user", "content": "hi"}]
+    cache = CompletionCache()
+    completer = StructuredChatCompleter(temperature=0, cache=cache, client=fake_client(calls))
+    assert completer.complete(messages, Answer).text == "answer 1"
+    assert completer.complete(messages, Answer).text == "answer 1"
+    assert len(calls) == 1
+    completer.temperature = 0.65
+    assert completer.complete(messages, Answer).text == "answer 2"
+    assert cache.stats.as_dict()["hits"] == 1
+    assert cache.stats.bypassed == 1
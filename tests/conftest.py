@@ -0,0 +1,15 @@
+import pytest
+import structured_chat
+
+
+@pytest.fixture(autouse=True, scope="session")
+def schema_cache_dir(tmp_path_factory):
+    """
+        Keeps the response formats the tests build in a temporary directory, never in the user's own schema cache
+    """
+    directory = str(tmp_path_factory.mktemp("schemas"))
+    with pytest.MonkeyPatch.context() as patch:
+        # the environment variable too, for the tests which start python processes
+        patch.setenv("SCHEMA_CACHE_DIR", directory)
+        patch.setattr(structured_chat, "SCHEMA_CACHE_DIR", directory)
+        yield directory
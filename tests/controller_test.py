@@ -0,0 +1,289 @@
+import agents
+import inspect
+from types import SimpleNamespace
+from controller import PROMPT_PREFIX, ChatController, agent_prompt
+from fast_extract import FastPathExtractor, apply_fields
+from models import (
+    AgentGoalState,
+    AppointmentType,
+    Gender,
+    Insurance,
+    Language,
+    MemberProfile,
+    ProviderPreferences,
+    ProviderSearchAgentResponse,
+    ProviderSearchInputState,
+    TherapyType,
+    TreatmentSpecialty,
+)
+
+ANSWERS = {
+    "member_profile.gender": Gender.FEMALE,
+    "member_profile.age": 34,
+    "member_profile.insurance": Insurance.AETNA,
+    "member_profile.language": Language.SPANISH,
+    "provider_preferences.specialties": [TreatmentSpecialty.ANXIETY],
+    "provider_preferences.therapy_types": [TherapyType.COGNITIVE_BEHAVIORAL],
+    "provider_preferences.gender": Gender.FEMALE,
+    "provider_preferences.appointment_types": [AppointmentType.ONLINE],
+}
+AGENT_CLASSES = [cls for cls in vars(agents).values() if isinstance(cls, type) and issubclass(cls, agents.ProviderSearchChatAgent) and cls.fields]
+
+
+def field_value(state, field):
+    section, name = field.split(".")
+    return getattr(getattr(state, section), name)
+
+
+def prompt_fields(messages):
+    """
+        Returns the fields of the agent, or of the batched agents, whose goal is in the prompt
+    """
+    return [field for cls in AGENT_CLASSES if inspect.cleandoc(cls().goal()) in messages[0]["content"] for field in cls.fields]
+
+
+class Usage:
+    prompt_tokens = 100
+    completion_tokens = 10
+    prompt_tokens_details = SimpleNamespace(cached_tokens=64)
+
+
+class ScriptedCompleter:
+    """
+        Stands in for StructuredChatCompleter.  The member answers whatever fields the previous assistant message
+        asked about, and the response asks about the fields of the agent whose goal is in the prompt.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def complete_with_usage(self, messages, response_model):
+        self.calls += 1
+        state = ProviderSearchInputState(member_profile=MemberProfile(), provider_preferences=ProviderPreferences())
+        for asked, answer in zip(messages, messages[1:]):
+            if asked["role"] == "assistant" and answer["role"] == "user":
+                for field in ANSWERS:
+                    if field in asked["content"]:
+                        section, name = field.split(".")
+                        setattr(getattr(state, section), name, ANSWERS[field])
+        unanswered = [field for field in prompt_fields(messages) if field_value(state, field) is None]
+        return ProviderSearchAgentResponse(
+            assistant_response=f"Please tell me your {', '.join(unanswered)}",
+            provider_search_information=state,
+            agent_state=AgentGoalState.MATCHED if unanswered else AgentGoalState.COMPLETE,
+        ), Usage()
+
+    def complete(self, messages, response_model):
+        return self.complete_with_usage(messages, response_model)[0]
+
+    def complete_streaming(self, messages, response_model, text_field, on_text, model=None, on_fields=None):
+        response, usage = self.complete_with_usage(messages, response_model)
+        # agent_state is generated before the reply
+        for field, callback in (on_fields or {}).items():
+            callback(getattr(response, field).value)
+        text = response.assistant_response
+        for start in range(0, len(text), 8):
+            on_text(text[start:start + 8])
+        return SimpleNamespace(result=response, usage=usage)
+
+
+def run_conversation(controller, turns):
+    controller.get_next_assistant_response()
+    for _ in range(turns):
+        controller.add_user_message("here is my answer")
+        controller.get_next_assistant_response()
+
+
+def test_speculation_hits_when_agent_completes():
+    controller = ChatController(completer=ScriptedCompleter(), debug=False, speculative=True)
+    run_conversation(controller, 3)
+    stats = controller.speculation_stats
+    # every answered turn completes the current agent, and the predicted agent is the one selected next;
+    # the greeting turn needs no second agent, which is not a miss
+    assert stats.hits == 3
+    assert stats.misses == 0 and stats.unneeded == 1
+    assert stats.hit_rate == 1.0
+    assert controller.completer.calls == 4 + stats.launched
+    controller.end_session()
+    assert controller.executor is None
+
+
+class PromptStateCompleter(ScriptedCompleter):
+    """
+        Extracts only the answers to the fields of the agent in the prompt, and keeps the rest of the search state
+        sent in the prompt, so a speculative completion does not know what the current agent extracted this turn
+    """
+
+    def complete_with_usage(self, messages, response_model):
+        response, usage = super().complete_with_usage(messages, response_model)
+        sent = ProviderSearchInputState.model_validate_json(messages[0]["content"].split("<CURRENT_SEARCH_STATE>\n")[1].split("\n")[1])
+        extracted = response.provider_search_information
+        response.provider_search_information = apply_fields(sent, {field: field_value(extracted, field) for field in prompt_fields(messages)
+                                                                   if field_value(extracted, field) is not None})
+        return response, usage
+
+
+def test_speculative_response_keeps_the_first_agents_fields():
+    states = []
+    for speculative in (False, True):
+        controller = ChatController(completer=PromptStateCompleter(), debug=False, speculative=speculative)
+        run_conversation(controller, 3)
+        states.append(controller.search_input_state)
+    assert controller.speculation_stats.hits == 3
+    assert states[1] == states[0]
+    assert states[1].provider_preferences.specialties == [TreatmentSpecialty.ANXIETY]
+
+
+def test_speculation_switch_off():
+    completer = ScriptedCompleter()
+    controller = ChatController(completer=completer, debug=False)
+    run_conversation(controller, 3)
+    assert controller.speculation_stats.launched == 0
+    assert completer.calls == 7
+
+
+def test_streaming_shows_only_the_final_reply():
+    streamed = ChatController(completer=ScriptedCompleter(), debug=False)
+    plain = ChatController(completer=ScriptedCompleter(), debug=False)
+    shown = []
+    for controller, on_text in ((streamed, shown.append), (plain, None)):
+        controller.get_next_assistant_response(on_text)
+        controller.add_user_message("here is my answer")
+    shown.clear()
+    # the answer completes the current agent, and the next agent asks its question
+    response = streamed.get_next_assistant_response(shown.append)
+    assert streamed.completer.calls == 3
+    assert "".join(shown) == response.assistant_response == streamed.history.messages[-1]["content"]
+    assert plain.get_next_assistant_response().assistant_response == response.assistant_response
+
+
+class StreamingFlagCompleter(ScriptedCompleter):
+    """
+        Tells whether a completion is being streamed
+    """
+    streaming = False
+
+    def complete_streaming(self, *args, **kwargs):
+        self.streaming = True
+        try:
+            return super().complete_streaming(*args, **kwargs)
+        finally:
+            self.streaming = False
+
+
+def test_single_agent_reply_is_streamed_as_it_arrives():
+    controller = ChatController(completer=StreamingFlagCompleter(), debug=False)
+    during = []
+    # the greeting is answered by the general agent alone
+    response = controller.get_next_assistant_response(lambda text: during.append(controller.completer.streaming))
+    assert controller.completer.calls == 1 and response.agent_state == AgentGoalState.MATCHED
+    assert len(during) > 1 and all(during)
+
+
+def test_fast_path_resolves_single_value_locally():
+    completer = ScriptedCompleter()
+    controller = ChatController(completer=completer, debug=False, fast_path=FastPathExtractor())
+    controller.agent = agents.MemberInsuranceProviderSearchAgent()
+    controller.add_user_message("I have Aetna")
+    response = controller.get_next_assistant_response()
+    # only the next agent's question needs a completion, and the resolved value is kept in its response
+    assert completer.calls == 1
+    assert response.provider_search_information.member_profile.insurance == Insurance.AETNA
+    assert not isinstance(controller.agent, agents.MemberInsuranceProviderSearchAgent)
+    stats = controller.fast_path_stats
+    assert (stats.turns, stats.resolved, stats.llm_calls_saved) == (1, 1, 1)
+
+
+def test_fast_path_leaves_ambiguous_reply_to_llm():
+    completer = ScriptedCompleter()
+    controller = ChatController(completer=completer, debug=False, fast_path=FastPathExtractor())
+    controller.agent = agents.MemberInsuranceProviderSearchAgent()
+    controller.add_user_message("Aetna or maybe Cigna")
+    controller.get_next_assistant_response()
+    assert controller.search_input_state.member_profile.insurance is None
+    assert controller.fast_path_stats.resolved == 0
+    assert controller.fast_path_stats.resolved_fraction == 0.0
+
+
+def test_usage_records_cached_tokens_per_turn():
+    controller = ChatController(completer=ScriptedCompleter(), debug=False)
+    run_conversation(controller, 2)
+    # the last turn completes the current agent, so it calls two agents
+    assert controller.turn_usage.calls == 2
+    assert controller.turn_usage.cached_tokens == 128
+    assert controller.turn_usage.cached_fraction == 0.64
+    assert controller.usage.calls == 5
+    assert controller.usage.prompt_tokens == 500
+
+
+def test_agent_prompt_is_built_once_per_agent():
+    prompt = agent_prompt(agents.MemberInsuranceProviderSearchAgent())
+    assert prompt is agent_prompt(agents.MemberInsuranceProviderSearchAgent())
+    assert prompt.startswith(PROMPT_PREFIX)
+    controller = ChatController(completer=ScriptedCompleter(), debug=False)
+    controller.agent = agents.MemberInsuranceProviderSearchAgent()
+    assert controller.get_agent_messages(controller.agent)[0]["content"].startswith(prompt)
+
+
+def test_batching_asks_agents_of_a_group_together():
+    completer = ScriptedCompleter()
+    controller = ChatController(completer=completer, debug=False, batch_size=2)
+    controller.search_input_state = ProviderSearchInputState(
+        member_profile=MemberProfile(),
+        provider_preferences=ProviderPreferences(specialties=[TreatmentSpecialty.ANXIETY], therapy_types=[TherapyType.FAMILY]),
+    )
+    controller.agent_state = AgentGoalState.COMPLETE
+    agent = controller.get_agent()
+    assert isinstance(agent, agents.CompositeProviderSearchAgent)
+    assert [type(batched) for batched in agent.agents] == [agents.AppointmentTypeProviderSearchAgent, agents.ProviderGenderProviderSearchAgent]
+    assert agent.fields == ("provider_preferences.appointment_types", "provider_preferences.gender")
+    assert agent_prompt(agent) is agent_prompt(agents.CompositeProviderSearchAgent(list(agent.agents)))
+
+    # the appointment type is answered, so only the provider gender agent is selected again, as no other agent of its group is left
+    controller.search_input_state.provider_preferences.appointment_types = [AppointmentType.ONLINE]
+    controller.agent_state = AgentGoalState.MATCHED
+    controller.get_agent()
+    assert isinstance(controller.agent, agents.ProviderGenderProviderSearchAgent)
+    assert agents.AppointmentTypeProviderSearchAgent not in [type(unused) for unused in controller.unused_agents]
+
+
+def test_batched_conversation_takes_fewer_turns():
+    turns = {}
+    for batch_size in (1, 3):
+        controller = ChatController(completer=ScriptedCompleter(), debug=False, batch_size=batch_size)
+        controller.get_next_assistant_response()
+        turns[batch_size] = 0
+        while any(field_value(controller.search_input_state, field) is None for field in ANSWERS) and turns[batch_size] < 20:
+            controller.add_user_message("here is my answer")
+            controller.get_next_assistant_response()
+            turns[batch_size] += 1
+    assert turns[3] < turns[1] <= 20
+
+
+class DecliningCompleter(ScriptedCompleter):
+    """
+        The member declines to give a preferred provider gender, and an agent asking about it is COMPLETE without it
+    """
+    declined = "provider_preferences.gender"
+
+    def complete_with_usage(self, messages, response_model):
+        response, usage = super().complete_with_usage(messages, response_model)
+        response.provider_search_information.provider_preferences.gender = None
+        if all(field_value(response.provider_search_information, field) is not None for field in prompt_fields(messages) if field != self.declined):
+            response.agent_state = AgentGoalState.COMPLETE
+        return response, usage
+
+
+def test_declined_question_is_not_asked_again():
+    for batch_size in (1, 3):
+        controller = ChatController(completer=DecliningCompleter(), debug=False, batch_size=batch_size)
+        controller.get_next_assistant_response()
+        asked = 0
+        for _ in range(8):
+            controller.add_user_message("here is my answer")
+            controller.get_next_assistant_response()
+            asked += DecliningCompleter.declined in controller.agent.fields
+        # the question is asked in one turn, declined in the next, and the other agents are asked in turn
+        assert asked == 1
+        assert all(field_value(controller.search_input_state, field) is not None for field in ANSWERS if field != DecliningCompleter.declined)
+        assert isinstance(controller.agent, agents.GeneralProviderSearchAgent)
@@ -0,0 +1,115 @@
+import asyncio
+from openai import AsyncOpenAI, OpenAI
+from agents import GeneralProviderSearchAgent
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.simulation import PERSONAS, field_value, rule_responder, run_session
+from cascade import CascadePolicy
+from controller import AsyncChatController, ChatController
+from delta import apply_changes, delta_response, full_response, state_changes, withdrawn_fields
+from models import (
+    AgentGoalState,
+    AppointmentType,
+    Gender,
+    Insurance,
+    MemberAgeChange,
+    MemberGenderChange,
+    MemberInsuranceChange,
+    MemberProfile,
+    ProviderAppointmentTypesChange,
+    ProviderPreferences,
+    ProviderSearchAgentDeltaResponse,
+    ProviderSearchInputState,
+    ProviderSpecialtiesChange,
+    TreatmentSpecialty,
+)
+from structured_chat import AsyncStructuredChatCompleter, StructuredChatCompleter
+
+
+def state(**fields) -> ProviderSearchInputState:
+    member = {name: value for name, value in fields.items() if name in MemberProfile.model_fields}
+    provider = {name: value for name, value in fields.items() if name not in member}
+    return ProviderSearchInputState(member_profile=MemberProfile(**member), provider_preferences=ProviderPreferences(**provider))
+
+
+def test_changes_round_trip():
+    before = state(insurance=Insurance.AETNA, specialties=[TreatmentSpecialty.ANXIETY])
+    after = state(age=34, specialties=[TreatmentSpecialty.ANXIETY, TreatmentSpecialty.INSOMNIA])
+    changes = state_changes(before, after)
+    assert changes == [
+        MemberAgeChange(field="member_profile.age", value=34),
+        MemberInsuranceChange(field="member_profile.insurance", value=None),
+        ProviderSpecialtiesChange(field="provider_preferences.specialties", value=[TreatmentSpecialty.ANXIETY, TreatmentSpecialty.INSOMNIA]),
+    ]
+    assert apply_changes(before, changes) == after
+    assert state_changes(after, after) == []
+
+
+def test_apply_changes_keeps_unchanged_fields():
+    before = state(gender=Gender.FEMALE, appointment_types=[AppointmentType.ONLINE])
+    # an empty list is no answer, and only a null value clears a field
+    assert apply_changes(before, [ProviderAppointmentTypesChange(field="provider_preferences.appointment_types", value=[])]) == before
+    changes = [
+        ProviderAppointmentTypesChange(field="provider_preferences.appointment_types", value=None),
+        MemberGenderChange(field="member_profile.gender", value=Gender.MALE),
+    ]
+    assert apply_changes(before, changes) == state(gender=Gender.MALE)
+
+
+def test_delta_session_against_the_fake_endpoint():
+    fake = FakeOpenAIServer(rule_responder, latency=0.0)
+    port = fake.serve_in_thread()
+    client = OpenAI(api_key="fake", base_url=f"http://127.0.0.1:{port}/v1", max_retries=0)
+    completer = StructuredChatCompleter(client=client)
+    persona = PERSONAS[1]
+    usage = {}
+    for delta in (False, True):
+        controller = ChatController(completer=completer, debug=False, delta=delta, speculative=delta)
+        assert run_session(controller, persona, on_text=(lambda text: None) if delta else None)["complete"]
+        for field, (_, value) in persona.answers.items():
+            assert field_value(controller.search_input_state, field) == value
+        usage[delta] = controller.usage
+    assert usage[True].calls == usage[False].calls
+    assert usage[True].completion_tokens < usage[False].completion_tokens
+    client.close()
+
+
+async def async_delta_turns(replies):
+    server = await FakeOpenAIServer(rule_responder, latency=0.0).serve()
+    client = AsyncOpenAI(api_key="fake", base_url=f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/v1", max_retries=0)
+    controller = AsyncChatController(AsyncStructuredChatCompleter(client=client), delta=True)
+    try:
+        await controller.get_next_assistant_response()
+        for reply in replies:
+            controller.add_user_message(reply)
+            await controller.get_next_assistant_response()
+        return controller.search_input_state
+    finally:
+        await client.close()
+        server.close()
+
+
+def test_async_delta_session():
+    persona = PERSONAS[0]
+    answered = ["provider_preferences.specialties", "provider_preferences.therapy_types"]
+    result = asyncio.run(async_delta_turns([persona.reply(answered)]))
+    for field in answered:
+        assert field_value(result, field) == persona.answers[field][1]
+
+
+def test_delta_and_full_responses():
+    assert full_response(None, state()) is None
+    response = rule_responder({"messages": [{"role": "user", "content": "Aetna"}]})
+    delta = delta_response(response, state())
+    assert isinstance(delta, ProviderSearchAgentDeltaResponse)
+    assert full_response(delta, state()) == response
+
+
+def test_null_changes_are_not_regressions():
+    insured = state(insurance=Insurance.AETNA)
+    changes = [MemberInsuranceChange(field="member_profile.insurance", value=None)]
+    cleared = ProviderSearchAgentDeltaResponse(assistant_response="Sure.", provider_search_changes=changes, agent_state=AgentGoalState.MATCHED)
+    assert withdrawn_fields(cleared) == ["member_profile.insurance"] and withdrawn_fields(None) == []
+    controller = ChatController(completer=None, delta=True, debug=False)
+    check = CascadePolicy().check(insured, GeneralProviderSearchAgent(), "hello")
+    assert check(full_response(cleared, insured)) == ["regressed:member_profile.insurance"]
+    assert controller.merged_check(check, insured)(cleared) == []
@@ -0,0 +1,52 @@
+from fast_extract import FastPathExtractor, apply_fields
+from models import AppointmentType, Gender, Insurance, Language, MemberProfile, ProviderPreferences, ProviderSearchInputState
+
+DEMOGRAPHICS = ("member_profile.gender", "member_profile.age")
+
+
+def test_single_values_resolve():
+    extractor = FastPathExtractor()
+    assert extractor.extract("Aetna", ["member_profile.insurance"]) == {"member_profile.insurance": Insurance.AETNA}
+    assert extractor.extract("I have BCBS, thanks", ["member_profile.insurance"]) == {"member_profile.insurance": Insurance.BLUE_CROSS}
+    assert extractor.extract("self-pay", ["member_profile.insurance"]) == {"member_profile.insurance": Insurance.NO_INSURANCE}
+    assert extractor.extract("Español", ["member_profile.language"]) == {"member_profile.language": Language.SPANISH}
+    assert extractor.extract("a woman please", ["provider_preferences.gender"]) == {"provider_preferences.gender": Gender.FEMALE}
+    assert extractor.extract("Online", ["provider_preferences.appointment_types"]) == {"provider_preferences.appointment_types": [AppointmentType.ONLINE]}
+
+
+def test_reply_resolves_to_the_field_it_answers():
+    extractor = FastPathExtractor()
+    assert extractor.extract("female", DEMOGRAPHICS) == {"member_profile.gender": Gender.FEMALE}
+    assert extractor.extract("I'm 34 years old", DEMOGRAPHICS) == {"member_profile.age": 34}
+    # a value for a field the agent did not ask about is left to the LLM
+    assert extractor.extract("Aetna", DEMOGRAPHICS) is None
+
+
+def test_ambiguous_replies_are_not_resolved():
+    extractor = FastPathExtractor()
+    assert extractor.extract("either is fine", ["provider_preferences.appointment_types"]) is None
+    assert extractor.extract("online or in person", ["provider_preferences.appointment_types"]) is None
+    assert extractor.extract("Chinese", ["member_profile.language"]) is None
+    assert extractor.extract("34 female", DEMOGRAPHICS) is None
+    assert extractor.extract("I'm not sure", ["member_profile.insurance"]) is None
+    # declining to answer is not NO_INSURANCE
+    assert extractor.extract("No thanks", ["member_profile.insurance"]) is None
+    assert extractor.extract("no", ["member_profile.insurance"]) is None
+    assert extractor.extract("none", ["member_profile.insurance"]) == {"member_profile.insurance": Insurance.NO_INSURANCE}
+    assert extractor.extract("", ["member_profile.insurance"]) is None
+    assert extractor.extract("200", DEMOGRAPHICS) is None
+    # pronouns are about someone, not a gender answer
+    assert extractor.extract("she said I should call", DEMOGRAPHICS) is None
+    assert extractor.extract("they referred me", ["provider_preferences.gender"]) is None
+    assert extractor.extract("she is", DEMOGRAPHICS) is None
+    assert extractor.extract("it's him", ["provider_preferences.gender"]) is None
+    assert extractor.extract("f", DEMOGRAPHICS) is None
+
+
+def test_apply_fields_copies_state():
+    state = ProviderSearchInputState(member_profile=MemberProfile(age=34), provider_preferences=ProviderPreferences())
+    updated = apply_fields(state, {"member_profile.insurance": Insurance.AETNA, "provider_preferences.gender": Gender.MALE})
+    assert updated.member_profile.age == 34
+    assert updated.member_profile.insurance == Insurance.AETNA
+    assert updated.provider_preferences.gender == Gender.MALE
+    assert state.member_profile.insurance is None
@@ -0,0 +1,78 @@
+import json
+import pytest
+from argparse import Namespace
+from benchmarks.fake_openai import RecordedResponder, messages_key
+from benchmarks.harness import regressions, run_benchmark
+from benchmarks.simulation import PERSONAS, SimulatedCompleter, run_session, rule_responder
+from controller import ChatController
+
+
+def benchmark_args(**overrides):
+    args = dict(sessions=1, concurrency=3, latency=0.0, jitter=0.0, seed=0, responder="rule", recording=None,
+                batch_size=1, fast_path=False, no_stream=False, token_latency=0.0, delta=False)
+    args.update(overrides)
+    return Namespace(**args)
+
+
+def test_benchmark_completes_every_persona_against_the_fake_endpoint():
+    metrics = run_benchmark(benchmark_args())
+    assert metrics["sessions"] == len(PERSONAS)
+    assert metrics["completed_sessions"] == len(PERSONAS)
+    assert metrics["llm_calls_per_session"] > metrics["turns_per_session"] > 0
+    assert metrics["prompt_tokens_per_session"] > 0 and metrics["completion_tokens_per_session"] > 0
+    assert metrics["turn_latency_p50"] <= metrics["turn_latency_p99"]
+
+
+def test_batching_reduces_calls_in_the_benchmark():
+    single = run_benchmark(benchmark_args(no_stream=True))
+    batched = run_benchmark(benchmark_args(no_stream=True, batch_size=3, fast_path=True))
+    assert batched["completed_sessions"] == len(PERSONAS)
+    assert batched["llm_calls_per_session"] < single["llm_calls_per_session"]
+    assert batched["turns_per_session"] < single["turns_per_session"]
+
+
+def test_delta_responses_cut_completion_tokens():
+    full = run_benchmark(benchmark_args())
+    delta = run_benchmark(benchmark_args(delta=True))
+    assert delta["completed_sessions"] == len(PERSONAS)
+    assert delta["llm_calls_per_session"] == full["llm_calls_per_session"]
+    assert delta["completion_tokens_per_session"] < full["completion_tokens_per_session"]
+
+
+def test_regressions():
+    baseline = {"llm_calls_per_session": 10, "turn_latency_p50": 0.2, "turns_per_second": 20, "completed_sessions": 30}
+    assert regressions({"llm_calls_per_session": 10, "turn_latency_p50": 0.24, "turns_per_second": 17, "completed_sessions": 30},
+                       baseline, tolerance=0.25, timing=True) == []
+    worse = {"llm_calls_per_session": 11, "turn_latency_p50": 0.3, "turns_per_second": 14, "completed_sessions": 29}
+    failures = regressions(worse, baseline, tolerance=0.25, timing=True)
+    assert [failure.split()[0] for failure in failures] == [
+        "llm_calls_per_session", "completed_sessions", "turn_latency_p50", "turns_per_second"
+    ]
+    # timing metrics depend on the machine, and are only compared when asked for
+    assert [failure.split()[0] for failure in regressions(worse, baseline, tolerance=0.25)] == ["llm_calls_per_session", "completed_sessions"]
+
+
+def test_recorded_responder_replays_by_messages(tmp_path):
+    requests = []
+
+    class RecordingCompleter(SimulatedCompleter):
+        def complete_with_usage(self, messages, response_model):
+            response, usage = super().complete_with_usage(messages, response_model)
+            requests.append({"messages": messages, "response": json.loads(response.model_dump_json())})
+            return response, usage
+
+    persona = PERSONAS[0]
+    run_session(ChatController(completer=RecordingCompleter(persona), debug=False), persona)
+    path = tmp_path / "recording.jsonl"
+    path.write_text("".join(json.dumps(request) + "\n" for request in requests))
+
+    responder = RecordedResponder(str(path))
+    for request in requests:
+        assert json.loads(responder({"messages": request["messages"]}).model_dump_json()) == request["response"]
+    assert len(responder.responses) == len({messages_key(request["messages"]) for request in requests})
+
+    unrecorded = {"messages": [{"role": "user", "content": "not recorded"}]}
+    # an unrecorded request fails without a fallback
+    with pytest.raises(KeyError):
+        responder(unrecorded)
+    assert RecordedResponder(str(path), fallback=rule_responder)(unrecorded).agent_state is not None
@@ -0,0 +1,46 @@
+from openai import AsyncOpenAI
+from controller import AsyncChatController
+from history import ChatHistory, estimate_tokens
+from structured_chat import AsyncStructuredChatCompleter
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("I'm anxious.") == 6
+
+
+def test_history_moves_oldest_turns_into_transcript_beyond_budget():
+    history = ChatHistory(token_budget=120, keep_recent=2)
+    for turn in range(10):
+        history.add_user_message(f"user message number {turn} with some extra words to take up space")
+        history.add_assistant_message(f"assistant reply number {turn}")
+    assert history.tokens() <= 120
+    messages = history.render("PROMPT")
+    assert messages[0]["role"] == "developer"
+    assert messages[0]["content"].startswith("PROMPT")
+    assert "<EARLIER_CONVERSATION>" in messages[0]["content"]
+    assert messages[-1] == {"role": "assistant", "content": "assistant reply number 9"}
+    assert len(messages) - 1 < 20
+
+
+def test_history_keeps_recent_messages_even_over_budget():
+    history = ChatHistory(token_budget=1, keep_recent=2)
+    history.add_user_message("a long message " * 20)
+    history.add_assistant_message("reply")
+    assert [message["role"] for message in history.render("PROMPT")] == ["developer", "user", "assistant"]
+    assert history.transcript() is None
+
+
+def test_transcript_drops_oldest_quotes_beyond_its_budget():
+    history = ChatHistory(token_budget=60, keep_recent=2, transcript_budget=30)
+    for turn in range(10):
+        history.add_user_message(f"user message number {turn}")
+    transcript = history.transcript()
+    assert "number 0" not in transcript and "number 6" in transcript
+    assert history.transcript_tokens <= 30
+
+
+def test_async_controller_takes_a_history():
+    history = ChatHistory(token_budget=500)
+    controller = AsyncChatController(AsyncStructuredChatCompleter(client=AsyncOpenAI(api_key="fake")), history=history)
+    assert controller.history is history
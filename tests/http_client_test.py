@@ -0,0 +1,137 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from openai import AsyncOpenAI, OpenAI
+from benchmarks.fake_openai import FakeOpenAIServer
+from controller import ChatController
+from http_client import DeadlineExceeded, RequestPolicy, deadline, remaining, shared_client, wait_for_warm_up, warm_up
+from models import ProviderSearchAgentResponse
+from structured_chat import AsyncStructuredChatCompleter, StructuredChatCompleter
+
+MESSAGES = [{"role": "user", "content": "I need a therapist"}]
+
+
+async def complete_all(fake: FakeOpenAIServer, policy: RequestPolicy, count: int):
+    server = await fake.serve()
+    client = AsyncOpenAI(api_key="fake", base_url=f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/v1", max_retries=0)
+    completer = AsyncStructuredChatCompleter(temperature=0, client=client, policy=policy)
+    latencies = []
+    try:
+        for _ in range(count):
+            start = time.perf_counter()
+            assert await completer.complete(MESSAGES, ProviderSearchAgentResponse) is not None
+            latencies.append(time.perf_counter() - start)
+        return latencies
+    finally:
+        await client.close()
+        server.close()
+
+
+def test_deadlines_nest():
+    assert remaining() is None
+    with deadline(10):
+        assert 9 < remaining() <= 10
+        with deadline(60):
+            assert remaining() <= 10
+        with deadline(None):
+            assert remaining() <= 10
+    assert remaining() is None
+
+
+def test_completers_share_the_pooled_client(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+    shared_client.cache_clear()
+    try:
+        assert StructuredChatCompleter().client is StructuredChatCompleter().client is shared_client()
+        assert shared_client().max_retries == 0
+    finally:
+        shared_client.cache_clear()
+
+
+def test_shared_client_keeps_the_limits_it_was_built_with(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+    shared_client.cache_clear()
+    try:
+        client = shared_client(max_connections=8, max_keepalive_connections=8)
+        # the completers pass no limits, and get the configured client
+        assert StructuredChatCompleter().client is client is shared_client(max_connections=8)
+        with pytest.raises(ValueError):
+            shared_client(max_connections=50)
+        with pytest.raises(ValueError):
+            shared_client(keepalive_expiry=5.0)
+    finally:
+        shared_client.cache_clear()
+
+
+def test_warm_up_connection_is_reused(monkeypatch):
+    fake = FakeOpenAIServer(latency=0.0, connect_latency=0.2)
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+    monkeypatch.setenv("OPENAI_BASE_URL", f"http://127.0.0.1:{fake.serve_in_thread()}/v1")
+    shared_client.cache_clear()
+    try:
+        assert warm_up() is not None
+        start = time.perf_counter()
+        StructuredChatCompleter().complete(MESSAGES, ProviderSearchAgentResponse)
+        # the completion waited for the warm-up's connection rather than opening a second one
+        assert wait_for_warm_up(0)
+        assert fake.connections == 1 and fake.requests == 1
+        assert time.perf_counter() - start < 0.4
+    finally:
+        shared_client.cache_clear()
+
+
+def test_server_errors_are_retried():
+    fake = FakeOpenAIServer(latency=0.001, seed=0, error_fraction=0.3)
+    policy = RequestPolicy(max_retries=8, backoff=0.001)
+    asyncio.run(complete_all(fake, policy, 20))
+    assert fake.errors > 0
+    assert policy.stats.retries == fake.errors
+    assert policy.stats.requests == 20 + fake.errors
+
+
+def test_hedging_cuts_slow_responses():
+    fake = FakeOpenAIServer(latency=0.005, seed=1, slow_fraction=0.1, slow_latency=0.5)
+    policy = RequestPolicy(hedge=True, hedge_percentile=0.5, hedge_min_samples=10, hedge_min_delay=0.02)
+    latencies = asyncio.run(complete_all(fake, policy, 100))
+    # once latencies are known, a slow response is not waited for, unless its duplicate is slow too
+    assert policy.stats.hedge_wins >= 5
+    assert sum(latency > 0.25 for latency in latencies[10:]) <= policy.stats.hedges - policy.stats.hedge_wins
+    assert policy.stats.requests == 100 + policy.stats.hedges
+
+
+def test_threaded_hedges_share_a_bounded_pool():
+    policy = RequestPolicy(hedge=True, hedge_min_samples=1, hedge_min_delay=0.01, hedge_concurrency=2)
+    policy.latency.record("completion", 0.001)
+    sent = []
+
+    def send(timeout):
+        sent.append(timeout)
+        # the first request is slow, and its duplicate answers
+        time.sleep(0.3 if len(sent) == 1 else 0.0)
+        return len(sent)
+    start = time.perf_counter()
+    assert policy.call(send) == 2
+    assert time.perf_counter() - start < 0.2
+    assert (policy.stats.hedges, policy.stats.hedge_wins, policy.stats.requests) == (1, 1, 2)
+    assert policy.executor._max_workers == 4
+    with ThreadPoolExecutor(max_workers=8) as callers:
+        assert sorted(callers.map(lambda _: policy.call(lambda timeout: 0, hedge=False), range(200))) == [0] * 200
+    assert policy.stats.requests == 202
+    policy.close()
+    assert policy.executor is None
+
+
+def test_turn_deadline_stops_slow_requests():
+    fake = FakeOpenAIServer(latency=0.0, slow_fraction=1.0, slow_latency=2.0)
+    port = fake.serve_in_thread()
+    client = OpenAI(api_key="fake", base_url=f"http://127.0.0.1:{port}/v1", max_retries=0)
+    policy = RequestPolicy(backoff=0.01)
+    for on_text in (None, lambda text: None):
+        controller = ChatController(completer=StructuredChatCompleter(client=client, policy=policy), debug=False, turn_timeout=0.3)
+        start = time.perf_counter()
+        with pytest.raises(DeadlineExceeded):
+            controller.get_next_assistant_response(on_text)
+        assert time.perf_counter() - start < 1.0
+    assert policy.stats.timeouts >= 2 and policy.stats.deadline_exceeded == 2
+    client.close()
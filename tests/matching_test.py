@@ -0,0 +1,27 @@
+from matching import ProviderIndex, decode, encode, treatment_age
+from models import AppointmentType, TreatmentAge, TreatmentSpecialty
+from provider_fixtures import PROVIDERS, state
+
+
+def test_encode_decode_round_trip():
+    values = [TreatmentSpecialty.ADHD, TreatmentSpecialty.LIFE_COACHING]
+    assert decode("specialties", encode("specialties", values)) == values
+    assert treatment_age(16) == TreatmentAge.ADOLESCENT
+
+
+def test_search_filters_and_ranks():
+    index = ProviderIndex.from_providers(PROVIDERS)
+    matches = index.search(state(
+        specialties=[TreatmentSpecialty.ANXIETY, TreatmentSpecialty.INSOMNIA],
+        appointment_types=[AppointmentType.ONLINE],
+    ))
+    # C does not accept AETNA, D does not speak ENGLISH, E is not ONLINE
+    assert [match.provider.name.last for match in matches] == ["B", "A"]
+    assert matches[0].score > matches[1].score
+    assert matches[0].provider == PROVIDERS[1]
+
+
+def test_search_top_k_breaks_ties_by_position():
+    index = ProviderIndex.from_providers(PROVIDERS)
+    matches = index.search(state(), k=2, required=())
+    assert [match.position for match in matches] == [0, 1]
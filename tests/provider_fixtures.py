@@ -0,0 +1,46 @@
+"""
+    Providers and search states shared by the matching and roster tests
+"""
+from models import (
+    AppointmentType,
+    Gender,
+    Insurance,
+    Language,
+    MemberProfile,
+    Name,
+    ProviderInformation,
+    ProviderPreferences,
+    ProviderSearchInputState,
+    TherapyType,
+    TreatmentAge,
+    TreatmentSpecialty,
+)
+
+
+def make_provider(last, specialties, insurance, languages=(Language.ENGLISH,), appointment_types=(AppointmentType.ONLINE,)):
+    return ProviderInformation(
+        name=Name(first="Pat", last=last),
+        specialties=list(specialties),
+        ages_treated=[TreatmentAge.ADULT],
+        insurance_accepted=list(insurance),
+        languages_spoken=list(languages),
+        genders_treated=[Gender.MALE, Gender.FEMALE],
+        appointment_types=list(appointment_types),
+        therapy_types=[TherapyType.COGNITIVE_BEHAVIORAL],
+    )
+
+
+PROVIDERS = [
+    make_provider("A", [TreatmentSpecialty.ANXIETY], [Insurance.AETNA]),
+    make_provider("B", [TreatmentSpecialty.ANXIETY, TreatmentSpecialty.INSOMNIA], [Insurance.AETNA, Insurance.CIGNA]),
+    make_provider("C", [TreatmentSpecialty.INSOMNIA, TreatmentSpecialty.ANXIETY], [Insurance.CIGNA]),
+    make_provider("D", [TreatmentSpecialty.DEPRESSION], [Insurance.AETNA], languages=[Language.SPANISH]),
+    make_provider("E", [TreatmentSpecialty.INSOMNIA], [Insurance.AETNA], appointment_types=[AppointmentType.IN_PERSON]),
+]
+
+
+def state(**preferences):
+    return ProviderSearchInputState(
+        member_profile=MemberProfile(insurance=Insurance.AETNA, language=Language.ENGLISH, age=30, gender=Gender.FEMALE),
+        provider_preferences=ProviderPreferences(**preferences),
+    )
@@ -0,0 +1,106 @@
+import os
+import tempfile
+from agents import ProviderSpecialtiesProviderSearchAgent
+from benchmarks.simulation import PERSONAS, SimulatedCompleter, run_session
+from controller import ChatController
+from models import ProviderPreferences, TherapyType, TreatmentSpecialty
+from reason_match import ReasonMatcher
+
+SPECIALTIES = "provider_preferences.specialties"
+THERAPY_TYPES = "provider_preferences.therapy_types"
+
+
+def test_ranks_each_clause_of_a_reason():
+    matcher = ReasonMatcher()
+    ranked = matcher.specialties.rank("I can't sleep and I'm always on edge")
+    assert {candidate.value for candidate in ranked[:2]} == {TreatmentSpecialty.INSOMNIA, TreatmentSpecialty.ANXIETY}
+    assert ranked[0].score >= ranked[1].score >= ranked[2].score
+    assert matcher.specialties.rank("I keep having panic attacks at work")[0].value == TreatmentSpecialty.PANIC_ATTACKS
+    assert matcher.specialties.rank("the") == []
+
+
+def test_fills_only_when_every_clause_is_confident():
+    matcher = ReasonMatcher()
+    assert matcher.extract("anxiety and insomnia, CBT", [SPECIALTIES, THERAPY_TYPES]) == {
+        SPECIALTIES: [TreatmentSpecialty.ANXIETY, TreatmentSpecialty.INSOMNIA],
+        THERAPY_TYPES: [TherapyType.COGNITIVE_BEHAVIORAL],
+    }
+    assert matcher.extract("bipolar disorder", [SPECIALTIES]) == {SPECIALTIES: [TreatmentSpecialty.BIPOLAR, TreatmentSpecialty.BIPOLAR_DISORDER]}
+    # the insurance clause matches no specialty, so the whole reply goes to the LLM
+    assert matcher.extract("anxiety, and my insurance is Aetna", [SPECIALTIES]) is None
+    assert matcher.extract("anxiety", ["member_profile.insurance"]) is None
+    assert vars(matcher.stats) == {"queries": 3, "filled": 2}
+
+
+def test_never_fills_negated_or_hedged_clauses():
+    matcher = ReasonMatcher()
+    for text in ("I'm not anxious", "alcohol is not a problem", "depression, not anxiety", "I used to drink", "I never had panic attacks"):
+        assert matcher.extract(text, [SPECIALTIES]) is None
+        assert matcher.specialties.match(text, 0.0) is None
+    assert matcher.extract("I don't have anxiety", [SPECIALTIES]) is None
+    # the negation of a curated symptom phrase denies nothing
+    assert matcher.extract("I can't sleep and I'm always on edge", [SPECIALTIES]) == {SPECIALTIES: [TreatmentSpecialty.INSOMNIA, TreatmentSpecialty.ANXIETY]}
+    assert matcher.extract("I can't focus at work", [SPECIALTIES]) == {SPECIALTIES: [TreatmentSpecialty.ADHD]}
+    assert matcher.extract("I have no motivation", [SPECIALTIES]) == {SPECIALTIES: [TreatmentSpecialty.DEPRESSION]}
+    assert matcher.extract("I'm not someone who can't sleep", [SPECIALTIES]) is None
+    # still hinted, for the LLM to read in context
+    assert "ANXIETY" in matcher.hints("I'm not anxious", [SPECIALTIES])
+
+
+def test_precomputed_index_round_trips():
+    matcher = ReasonMatcher()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "reason_index.npz")
+        matcher.save(path)
+        loaded = ReasonMatcher.load(path)
+    text = "my husband and I fight all the time, and I drink too much"
+    assert loaded.specialties.rank(text) == matcher.specialties.rank(text)
+    assert loaded.therapy_types.rank(text) == matcher.therapy_types.rank(text)
+
+
+def run_recorded(persona, matcher):
+    completer = SimulatedCompleter(persona)
+    requests = []
+    respond = completer.respond
+
+    def recording_respond(messages):
+        requests.append(messages)
+        return respond(messages)
+    completer.respond = recording_respond
+    controller = ChatController(completer=completer, debug=False, reason_matcher=matcher)
+    assert run_session(controller, persona)["complete"]
+    return controller, requests
+
+
+def test_controller_fills_confident_reasons():
+    controller, requests = run_recorded(PERSONAS[0], ReasonMatcher(fill=True))
+    assert controller.reason_matcher.stats.filled == 1
+    assert controller.search_input_state.provider_preferences.specialties == [TreatmentSpecialty.ANXIETY, TreatmentSpecialty.INSOMNIA]
+    # the reply was applied before the only completion of its turn, which moved on to the next agent
+    assert not any("<REASON_HINTS>" in messages[-1]["content"] for messages in requests)
+
+
+def test_controller_hints_only_by_default():
+    controller, requests = run_recorded(PERSONAS[0], ReasonMatcher())
+    assert controller.reason_matcher.stats.queries == 0
+    assert any("<REASON_HINTS>" in messages[-1]["content"] for messages in requests)
+    assert controller.search_input_state.provider_preferences.specialties == [TreatmentSpecialty.ANXIETY, TreatmentSpecialty.INSOMNIA]
+
+
+def test_controller_adds_to_collected_specialties():
+    controller = ChatController(completer=None, debug=False, reason_matcher=ReasonMatcher(fill=True))
+    controller.search_input_state.provider_preferences = ProviderPreferences(specialties=[TreatmentSpecialty.DEPRESSION])
+    controller.agent = ProviderSpecialtiesProviderSearchAgent()
+    controller.history.add_user_message("anxiety")
+    assert controller.resolve_locally() == {SPECIALTIES: [TreatmentSpecialty.DEPRESSION, TreatmentSpecialty.ANXIETY]}
+    assert controller.search_input_state.provider_preferences.specialties == [TreatmentSpecialty.DEPRESSION, TreatmentSpecialty.ANXIETY]
+
+
+def test_controller_hints_uncertain_reasons():
+    controller, requests = run_recorded(PERSONAS[1], ReasonMatcher(fill=True))
+    assert controller.reason_matcher.stats.filled == 0
+    # the hints follow the user's reply, after the cached prefix
+    hinted = [messages for messages in requests if "<REASON_HINTS>" in messages[-1]["content"]]
+    assert hinted and hinted[0][-2] == {"role": "user", "content": "I keep having panic attacks at work, whatever works for panic"}
+    assert "PANIC_ATTACKS" in hinted[0][-1]["content"] and "<REASON_HINTS>" not in hinted[0][0]["content"]
+    assert controller.search_input_state.provider_preferences.specialties == [TreatmentSpecialty.PANIC_ATTACKS]
@@ -0,0 +1,22 @@
+import os
+import tempfile
+from matching import ProviderIndex
+from models import AppointmentType, Name, TreatmentSpecialty
+from provider_fixtures import PROVIDERS, state
+from roster import compile_roster, load_roster
+
+
+def test_compiled_roster_round_trip():
+    providers = PROVIDERS + [PROVIDERS[0].model_copy(update={"name": Name(first="Zoë", last=None)})]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "roster.bin")
+        assert compile_roster(providers, path) == len(providers)
+        index = load_roster(path)
+        assert len(index) == len(providers)
+        expected = ProviderIndex.from_providers(providers)
+        assert [index.provider(position) for position in range(len(index))] == [expected.provider(position) for position in range(len(expected))]
+        assert index.provider(5).name == Name(first="Zoë", last=None)
+        assert not index.columns["specialties"].flags.writeable
+        matches = index.search(state(specialties=[TreatmentSpecialty.ANXIETY], appointment_types=[AppointmentType.ONLINE]))
+        assert [match.position for match in matches] == [0, 1, 5]
+        del index, matches
@@ -0,0 +1,157 @@
+import asyncio
+import json
+from openai import AsyncOpenAI
+from benchmarks.fake_openai import FakeOpenAIServer
+from models import ProviderSearchAgentResponse
+from session_server import SessionServer
+from session_store import SessionStore
+from structured_chat import AsyncStructuredChatCompleter
+from telemetry import Telemetry
+
+
+async def post(port, path, payload=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps(payload or {}).encode("utf-8")
+    writer.write(f"POST {path} HTTP/1.1\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return response.decode("utf-8").split("\r\n\r\n", 1)
+
+
+async def run_sessions(count):
+    fake = await FakeOpenAIServer(latency=0.05).serve()
+    client = AsyncOpenAI(api_key="fake", base_url=f"http://127.0.0.1:{fake.sockets[0].getsockname()[1]}/v1")
+    server = await SessionServer(AsyncStructuredChatCompleter(client=client, max_concurrency=4)).serve("127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+
+    async def session():
+        _, body = await post(port, "/sessions")
+        session_id = json.loads(body)["session_id"]
+        head, events = await post(port, f"/sessions/{session_id}/turns")
+        head, events = await post(port, f"/sessions/{session_id}/turns", {"message": "I feel anxious"})
+        return head, events
+
+    results = await asyncio.gather(*(session() for _ in range(count)))
+    server.close()
+    fake.close()
+    return results
+
+
+def test_sessions_stream_server_sent_events():
+    for head, events in asyncio.run(run_sessions(8)):
+        assert "text/event-stream" in head
+        text = "".join(json.loads(line[len("data: "):]) for block in events.split("\n\n") if block.startswith("event: text")
+                       for line in block.split("\n") if line.startswith("data: "))
+        response = [block for block in events.split("\n\n") if block.startswith("event: response")]
+        assert len(response) == 1
+        assert json.loads(response[0].split("data: ", 1)[1])["assistant_response"] == text
+
+
+async def stream_to_slow_reader():
+    fake = await FakeOpenAIServer(latency=0.0).serve()
+    client = AsyncOpenAI(api_key="fake", base_url=f"http://127.0.0.1:{fake.sockets[0].getsockname()[1]}/v1")
+    shown = []
+
+    async def on_text(text):
+        await asyncio.sleep(0.001)
+        shown.append(text)
+    stream = await AsyncStructuredChatCompleter(client=client).complete_streaming(
+        [{"role": "user", "content": "I need a therapist"}], ProviderSearchAgentResponse, "assistant_response", on_text,
+        on_fields={"agent_state": lambda value: shown.append(("agent_state", value))})
+    fake.close()
+    return stream, shown
+
+
+def test_streaming_awaits_a_coroutine_on_text():
+    stream, shown = asyncio.run(stream_to_slow_reader())
+    # agent_state is decoded before the reply which follows it
+    assert shown[0] == ("agent_state", stream.result.agent_state.value)
+    assert len(shown) > 2 and "".join(shown[1:]) == stream.result.assistant_response
+
+
+async def stream_behind_a_stalled_reader():
+    fake = FakeOpenAIServer(latency=0.0)
+    server = await fake.serve()
+    client = AsyncOpenAI(api_key="fake", base_url=f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/v1")
+    completer = AsyncStructuredChatCompleter(client=client, max_concurrency=1)
+    messages = [{"role": "user", "content": "I need a therapist"}]
+    # a stream which is never iterated sends no request
+    completer.stream(messages, ProviderSearchAgentResponse, "assistant_response")
+    second_done = asyncio.Event()
+
+    async def stalled(text):
+        await second_done.wait()
+
+    async def second():
+        await completer.complete_streaming(messages, ProviderSearchAgentResponse, "assistant_response", lambda text: None)
+        second_done.set()
+    first = asyncio.ensure_future(completer.complete_streaming(messages, ProviderSearchAgentResponse, "assistant_response", stalled))
+    await asyncio.sleep(0.05)
+    try:
+        # the only slot was released once the first response arrived, though its reader has not taken the text yet
+        await asyncio.wait_for(asyncio.gather(first, second()), 5)
+    finally:
+        server.close()
+    return fake.requests
+
+
+def test_slow_reader_does_not_hold_a_request_slot():
+    assert asyncio.run(stream_behind_a_stalled_reader()) == 2
+
+
+async def get(port, path):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {path} HTTP/1.1\r\nConnection: close\r\n\r\n".encode("latin-1"))
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return response.decode("utf-8").split("\r\n\r\n", 1)
+
+
+async def run_session_with_metrics():
+    telemetry = Telemetry()
+    fake = await FakeOpenAIServer(latency=0.01).serve()
+    client = AsyncOpenAI(api_key="fake", base_url=f"http://127.0.0.1:{fake.sockets[0].getsockname()[1]}/v1")
+    completer = AsyncStructuredChatCompleter(client=client, telemetry=telemetry)
+    server = await SessionServer(completer, telemetry=telemetry).serve("127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    _, body = await post(port, "/sessions")
+    await post(port, f"/sessions/{json.loads(body)['session_id']}/turns")
+    head, metrics = await get(port, "/metrics")
+    server.close()
+    fake.close()
+    return head, metrics
+
+
+def test_metrics_endpoint():
+    head, metrics = asyncio.run(run_session_with_metrics())
+    assert "200 OK" in head
+    assert 'provider_search_turns_total{fast_path="False"} 1' in metrics
+    assert 'provider_search_span_seconds_count{span="completion"} 1' in metrics
+
+
+async def resume_in_new_server(path):
+    fake = await FakeOpenAIServer(latency=0.01).serve()
+    client = AsyncOpenAI(api_key="fake", base_url=f"http://127.0.0.1:{fake.sockets[0].getsockname()[1]}/v1")
+    completer = AsyncStructuredChatCompleter(client=client)
+    first = await SessionServer(completer, store=SessionStore(path)).serve("127.0.0.1", 0)
+    _, body = await post(first.sockets[0].getsockname()[1], "/sessions")
+    session_id = json.loads(body)["session_id"]
+    await post(first.sockets[0].getsockname()[1], f"/sessions/{session_id}/turns")
+    first.close()
+
+    # a second server process, sharing the store, picks the session up
+    second_sessions = SessionServer(completer, store=SessionStore(path))
+    second = await second_sessions.serve("127.0.0.1", 0)
+    head, events = await post(second.sockets[0].getsockname()[1], f"/sessions/{session_id}/turns", {"message": "I feel anxious"})
+    second.close()
+    fake.close()
+    return head, second_sessions.sessions[session_id]
+
+
+def test_session_resumes_from_store(tmp_path):
+    head, controller = asyncio.run(resume_in_new_server(str(tmp_path / "sessions.sqlite")))
+    assert "200 OK" in head
+    assert [message["role"] for message in controller.history.messages] == ["assistant", "user", "assistant"]
+    assert controller.turns == 2
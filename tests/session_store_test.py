@@ -0,0 +1,81 @@
+import os
+import tempfile
+from benchmarks.simulation import FIELDS, PERSONAS, SimulatedCompleter, field_value, run_session
+from controller import ChatController
+from session_store import SessionStore, agent_from_spec, agent_spec
+import agents
+
+
+def stored_turns(store, session_id, controller, persona, turns):
+    """
+        Runs the opening turn and up to turns member replies like run_session(), checkpointing each one
+    """
+    controller.get_next_assistant_response()
+    store.checkpoint_turn(session_id, controller)
+    for _ in range(turns):
+        asked = [field for field in controller.agent.fields if field_value(controller.search_input_state, field) is None]
+        reply = persona.reply(asked or [field for field in FIELDS if field_value(controller.search_input_state, field) is None][:1])
+        controller.add_user_message(reply)
+        store.append_user_message(session_id, reply)
+        controller.get_next_assistant_response()
+        store.checkpoint_turn(session_id, controller)
+
+
+def assert_same_session(restored, controller):
+    assert restored.search_input_state == controller.search_input_state
+    assert agent_spec(restored.agent) == agent_spec(controller.agent)
+    assert restored.agent_state == controller.agent_state
+    assert [agent_spec(agent) for agent in restored.unused_agents] == [agent_spec(agent) for agent in controller.unused_agents]
+    assert restored.history.messages == controller.history.messages
+    assert restored.history.transcript() == controller.history.transcript()
+    assert restored.turns == controller.turns
+    assert restored.usage.calls == controller.usage.calls
+
+
+def test_agent_specs():
+    composite = agents.CompositeProviderSearchAgent([agents.MemberInsuranceProviderSearchAgent(), agents.MemberLanguangeProviderSearchAgent()])
+    assert agent_spec(composite) == ["MemberInsuranceProviderSearchAgent", "MemberLanguangeProviderSearchAgent"]
+    assert agent_from_spec(agent_spec(composite)).prompt_key() == composite.prompt_key()
+    assert isinstance(agent_from_spec("GeneralProviderSearchAgent"), agents.GeneralProviderSearchAgent)
+    assert agent_from_spec(None) is None
+
+
+def test_rehydrated_session_continues_like_the_original():
+    with tempfile.TemporaryDirectory() as directory:
+        store = SessionStore(os.path.join(directory, "sessions.sqlite"))
+        for persona in PERSONAS:
+            for batch_size in (1, 3):
+                controller = ChatController(completer=SimulatedCompleter(persona), debug=False, batch_size=batch_size)
+                session_id = store.create()
+                stored_turns(store, session_id, controller, persona, turns=2)
+
+                restored = store.rehydrate(session_id, ChatController(completer=SimulatedCompleter(persona), debug=False, batch_size=batch_size))
+                assert_same_session(restored, controller)
+
+                # both finish the conversation the same way
+                original, resumed = run_session(controller, persona), run_session(restored, persona)
+                assert original == dict(resumed, turn_seconds=original["turn_seconds"])
+                assert resumed["complete"]
+        store.close()
+
+
+def test_events_are_appended():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "sessions.sqlite")
+        store = SessionStore(path)
+        persona = PERSONAS[0]
+        session_id = store.create()
+        controller = ChatController(completer=SimulatedCompleter(persona), debug=False)
+        stored_turns(store, session_id, controller, persona, turns=3)
+        kinds = [kind for kind, data in store.events(session_id)]
+        assert kinds == ["start", "turn", "user", "turn", "user", "turn", "user", "turn"]
+        store.close()
+
+        # another store on the same file, as another worker would open it
+        store = SessionStore(path)
+        assert session_id in store and len(store) == 1
+        assert_same_session(store.rehydrate(session_id, ChatController(completer=SimulatedCompleter(persona), debug=False)), controller)
+        assert store.rehydrate("unknown", ChatController(completer=SimulatedCompleter(persona), debug=False)) is None
+        store.delete(session_id)
+        assert session_id not in store
+        store.close()
@@ -1,4 +1,10 @@
-from structured_chat import StructuredChatCompleter
+import json
+import os
+import subprocess
+import sys
+import structured_chat
+from structured_chat import JsonStringFieldReader, StructuredChatCompleter, parse_completion, response_format
+from types import SimpleNamespace
 from typing import List
 from pydantic import BaseModel, Field
 
@@ -23,3 +29,57 @@ def test_chat():
         print(f"An unexpected error occurred: {e}")
         assert(False)
 
+
+def test_json_string_field_reader():
+    document = json.dumps({"assistant_response": "Hi \"there\"\né \U0001F600 done", "other": "x"})
+    reader = JsonStringFieldReader("assistant_response")
+    # feed one character at a time so escape sequences are split across chunks
+    text = "".join(reader.feed(char) for char in document)
+    assert text == "Hi \"there\"\né \U0001F600 done"
+    assert reader.done
+
+
+def test_response_format_is_built_once():
+    schema = response_format(ChatResponse)
+    assert schema is response_format(ChatResponse)
+    assert schema["json_schema"]["strict"] is True
+    assert schema["json_schema"]["name"] == "ChatResponse"
+    # the strict transform forbids extra properties and requires every property
+    body = schema["json_schema"]["schema"]
+    assert body["additionalProperties"] is False and body["required"] == list(body["properties"])
+
+
+def test_parse_completion():
+    def completion(content):
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+    content = json.dumps({"response": [{"code": "F41.1", "description": "Generalized anxiety disorder"}]})
+    assert parse_completion(completion(content), ChatResponse).response[0].code == "F41.1"
+    # a refusal has no content
+    assert parse_completion(completion(None), ChatResponse) is None
+
+
+def test_response_format_is_cached_across_runs(tmp_path, monkeypatch):
+    monkeypatch.setattr(structured_chat, "SCHEMA_CACHE_DIR", str(tmp_path))
+    response_format.cache_clear()
+    built = response_format(ChatResponse)
+    [path] = tmp_path.iterdir()
+    assert json.loads(path.read_text()) == built
+    # a later run reads the file instead of building the schema
+    path.write_text(json.dumps(dict(built, cached=True)))
+    response_format.cache_clear()
+    assert response_format(ChatResponse)["cached"]
+    response_format.cache_clear()
+
+
+def test_schema_cache_is_off_unless_set():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {name: value for name, value in os.environ.items() if name != "SCHEMA_CACHE_DIR"}
+    script = "import structured_chat; assert structured_chat.SCHEMA_CACHE_DIR == ''"
+    subprocess.run([sys.executable, "-c", script], cwd=root, env=env, check=True)
+
+
+def test_openai_is_imported_on_first_use():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    # constructing a completer without a client does not import openai either
+    script = "import sys, controller, structured_chat; structured_chat.StructuredChatCompleter(); assert 'openai' not in sys.modules"
+    subprocess.run([sys.executable, "-c", script], cwd=root, check=True)
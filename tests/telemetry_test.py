@@ -0,0 +1,142 @@
+import asyncio
+import json
+import os
+import tempfile
+import urllib.request
+from types import SimpleNamespace
+from pydantic import BaseModel
+from benchmarks.simulation import PERSONAS, SimulatedCompleter, run_session
+from completion_cache import CompletionCache, MemoryCache
+from controller import ChatController
+from structured_chat import StructuredChatCompleter
+from telemetry import DISABLED, NULL_SPAN, JsonlSpanExporter, MemorySpanExporter, Telemetry, serve_metrics
+
+
+class Answer(BaseModel):
+    text: str
+
+
+def fake_client():
+    def create(model, temperature, messages, response_format, timeout=None):
+        message = SimpleNamespace(content=Answer(text="answer").model_dump_json())
+        usage = SimpleNamespace(prompt_tokens=100, completion_tokens=10, prompt_tokens_details=SimpleNamespace(cached_tokens=64))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+def test_spans_nest_within_a_trace():
+    exporter = MemorySpanExporter()
+    telemetry = Telemetry([exporter])
+    with telemetry.span("turn") as turn:
+        with telemetry.span("completion", model="m") as completion:
+            completion.set(prompt_tokens=5)
+    with telemetry.span("turn"):
+        pass
+    inner, outer, other = exporter.spans
+    assert (inner.name, outer.name) == ("completion", "turn")
+    assert inner.parent_id == outer.span_id and outer.parent_id is None
+    assert inner.trace_id == outer.trace_id != other.trace_id
+    assert inner.tags == {"model": "m", "prompt_tokens": 5}
+    assert outer.duration >= inner.duration
+
+
+def test_spans_of_concurrent_tasks_do_not_nest():
+    exporter = MemorySpanExporter()
+    telemetry = Telemetry([exporter])
+
+    async def turn():
+        with telemetry.span("turn"):
+            await asyncio.sleep(0.01)
+            with telemetry.span("completion"):
+                await asyncio.sleep(0.01)
+
+    async def turns():
+        await asyncio.gather(turn(), turn())
+
+    asyncio.run(turns())
+    turns_by_id = {span.span_id: span for span in exporter.spans if span.name == "turn"}
+    for span in exporter.spans:
+        if span.name == "completion":
+            assert turns_by_id[span.parent_id].trace_id == span.trace_id
+    assert len({span.parent_id for span in exporter.spans if span.name == "completion"}) == 2
+
+
+def test_disabled_telemetry_records_nothing():
+    assert DISABLED.span("turn", agent="a") is NULL_SPAN
+    with DISABLED.span("turn") as span:
+        span.set(tokens=1)
+    DISABLED.count("turns")
+    DISABLED.observe("llm_calls_per_turn", 2)
+    assert DISABLED.counters == {} and DISABLED.histograms == {}
+
+
+def test_prometheus_text():
+    telemetry = Telemetry()
+    telemetry.count("completions", model="gpt", cache_hit=False)
+    telemetry.count("completions", model="gpt", cache_hit=False)
+    telemetry.observe("llm_calls_per_turn", 2)
+    telemetry.observe("llm_calls_per_turn", 1)
+    text = telemetry.prometheus_text()
+    assert "# TYPE provider_search_completions_total counter" in text
+    assert 'provider_search_completions_total{cache_hit="False",model="gpt"} 2' in text
+    assert 'provider_search_llm_calls_per_turn_bucket{le="1"} 1' in text
+    assert 'provider_search_llm_calls_per_turn_bucket{le="2"} 2' in text
+    assert 'provider_search_llm_calls_per_turn_bucket{le="+Inf"} 2' in text
+    assert "provider_search_llm_calls_per_turn_sum 3" in text
+
+
+def test_completer_spans_and_token_counters():
+    exporter = MemorySpanExporter()
+    telemetry = Telemetry([exporter])
+    completer = StructuredChatCompleter(client=fake_client(), cache=CompletionCache(MemoryCache()), temperature=0, telemetry=telemetry)
+    messages = [{"role": "user", "content": "hi"}]
+    completer.complete(messages, Answer)
+    completer.complete(messages, Answer)
+    assert [span.name for span in exporter.spans] == ["request", "parse", "completion", "completion"]
+    missed, hit = exporter.spans[2], exporter.spans[3]
+    assert missed.tags["cache_hit"] is False and missed.tags["prompt_tokens"] == 100 and missed.tags["cached_tokens"] == 64
+    assert hit.tags["cache_hit"] is True
+    assert telemetry.counters["prompt_tokens"] == {(("model", completer.model),): 100}
+    assert sum(telemetry.counters["completions"].values()) == 2
+
+
+def test_controller_turn_spans_and_metrics():
+    exporter = MemorySpanExporter()
+    telemetry = Telemetry([exporter])
+    persona = PERSONAS[0]
+    controller = ChatController(completer=SimulatedCompleter(persona), debug=False, telemetry=telemetry)
+    result = run_session(controller, persona)
+
+    turns = [span for span in exporter.spans if span.name == "turn"]
+    assert len(turns) == result["turns"] + 1
+    assert sum(span.tags["llm_calls"] for span in turns) == controller.usage.calls
+    by_id = {span.span_id: span for span in exporter.spans}
+    for span in exporter.spans:
+        if span.name in ("select_agent", "build_prompt", "agent_call"):
+            assert by_id[span.parent_id].name == "turn"
+    assert {span.tags["agent"] for span in exporter.spans if span.name == "agent_call"} >= {"GeneralProviderSearchAgent"}
+    assert telemetry.histograms["llm_calls_per_turn"][()].count == len(turns)
+    assert telemetry.histograms["llm_calls_per_session"][()].sum == controller.usage.calls
+    assert telemetry.histograms["turns_per_session"][()].sum == len(turns)
+
+
+def test_jsonl_exporter_and_metrics_endpoint():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "trace.jsonl")
+        exporter = JsonlSpanExporter(path)
+        telemetry = Telemetry([exporter])
+        with telemetry.span("turn", agent="a"):
+            telemetry.count("turns")
+        exporter.close()
+        with open(path) as f:
+            records = [json.loads(line) for line in f]
+        assert records[0]["name"] == "turn" and records[0]["tags"] == {"agent": "a"}
+
+    server = serve_metrics(telemetry, port=0)
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as response:
+            text = response.read().decode("utf-8")
+    finally:
+        server.shutdown()
+    assert "provider_search_turns_total 1" in text
+    assert 'provider_search_span_seconds_count{span="turn"} 1' in text